@@ -1,25 +1,165 @@
 import os
-from flask import Flask, render_template, jsonify, request
-from dungeon.dm import DungeonMaster
+import json
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, g
+from werkzeug.local import LocalProxy
+from dungeon.database import DEFAULT_GAME
+from dungeon.games import GameRegistry, valid_game_id
+from dungeon.gamedata import GAME_HOSTING_CONFIG
+from dungeon import gamedata, items
+from dungeon.state_encoding import MAP_ENCODINGS
+from dungeon.metrics import metrics
+from dungeon.maintenance import maintenance
 
 app = Flask(__name__)
 # Force Reload Trigger v37 for Backend Modularization - CACHE BUSTER TOUCH
-dm = DungeonMaster()
+games = GameRegistry() # Loaded games, LRU (see dungeon/games.py)
+games.get(DEFAULT_GAME)
+dm = LocalProxy(lambda: g.dm) # The requesting game's DungeonMaster
+maintenance.start() # Corpse/dead monster purge, off the request path
+
+STREAM_HEARTBEAT = 15 # Seconds between keep-alive comments on an idle /api/stream
+
+def _source_stamp(module):
+    """mtime of a data module's source as loaded: its catalogs only change with an edit and a restart."""
+    return int(os.path.getmtime(module.__file__))
+
+CATALOG_TAGS = {"craft": f"craft-{_source_stamp(gamedata)}", "shop": f"shop-{_source_stamp(items)}"}
+
+@app.before_request
+def start_request_metrics():
+    if request.endpoint != 'static':
+        metrics.begin(request.endpoint or request.path)
+
+def _game_id():
+    """?game=<id>, else the game cookie, else the default game."""
+    game_id = request.args.get('game') or request.cookies.get(GAME_HOSTING_CONFIG["cookie"])
+    return game_id if valid_game_id(game_id) else DEFAULT_GAME
+
+@app.before_request
+def load_game():
+    if request.endpoint != 'static':
+        g.dm = games.get(_game_id())
+
+@app.after_request
+def finish_request_metrics(response):
+    req = metrics.end()
+    if req is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(req)
+    return response
 
 @app.teardown_appcontext
 def shutdown_session(exception=None):
-    from dungeon.database import SessionLocal
-    SessionLocal.remove()
+    game = g.pop('dm', None)
+    if game is not None:
+        game.session.remove()
 
 @app.route('/')
 def home():
-    print("DEBUG: SERVING index_v2.html")
     return render_template('index_v2.html')
 
+@app.route('/api/games', methods=['GET', 'POST'])
+def hosted_games():
+    """GET: the requesting game and the loaded ones. POST: start a new game and switch to it."""
+    if request.method == 'POST':
+        game_id, _ = games.new_game()
+        response = jsonify({"game_id": game_id})
+        response.set_cookie(GAME_HOSTING_CONFIG["cookie"], game_id, samesite='Lax')
+        return response
+    return jsonify({"game_id": dm.game_id, "loaded": games.loaded()})
+
+def _not_modified(tag):
+    """304 if the client already holds `tag`, else None (caller builds the body)."""
+    if request.if_none_match.contains(tag):
+        return _tagged(app.response_class(status=304), tag)
+    return None
+
+def _tagged(response, tag):
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'no-cache' # Keep a copy, but always revalidate
+    return response
+
 @app.route('/api/state')
 def get_state():
-    state = dm.get_state_dict()
-    return jsonify(state)
+    # The body only depends on the query string, the game and its world version, so those
+    # are the ETag and an unchanged world costs at most the active-encounter lookup. Versions
+    # are per game and may coincide, hence the game id in the tag. A stalled AI turn commits
+    # nothing, so it never moves the tag: the body is rebuilt to run the failsafe.
+    tag = f"state-{dm.game_id}-{dm.world_version.current}"
+    cached = _not_modified(tag)
+    if cached and not dm.ai_turn_pending(): return cached
+
+    # ?since=<version> returns only what changed after that world version
+    since = request.args.get('since', type=int)
+    state = dm.get_state_dict(since=since, view=_parse_view(request.args),
+                              encoding=_parse_map_encoding(request.args))
+    with metrics.phase("serialize"):
+        response = jsonify(state)
+    if "error" in state:
+        return response
+    return _tagged(response, tag)
+
+def _parse_view(args):
+    """?view=viewport[&radius=N] or ?bbox=x0,y0,x1,y1 -> map window for get_state_dict."""
+    bbox = args.get('bbox')
+    if bbox:
+        try:
+            x0, y0, x1, y1 = [int(v) for v in bbox.split(',')]
+            return {"bbox": (x0, y0, x1, y1)}
+        except ValueError:
+            pass # Malformed box: fall back to radius/legacy mode
+    if args.get('view') == 'viewport' or 'radius' in args:
+        return {"radius": args.get('radius', type=int)}
+    return None
+
+def _parse_map_encoding(args):
+    """?map_encoding=rle -> palette + run-length map; anything else keeps "x,y,z" keys."""
+    encoding = args.get('map_encoding')
+    return encoding if encoding in MAP_ENCODINGS else None
+
+@app.route('/api/stream')
+def stream_state():
+    """
+    Server-Sent Events push channel. Emits a `state` event (same payload as /api/state,
+    delta-encoded after the first one) each time a commit bumps the world version.
+    Reconnects resume from the Last-Event-ID header (or ?since=) instead of resyncing.
+    The stream ends when its game is unloaded; the client reconnects to the reloaded game.
+    """
+    since = request.args.get('since', type=int)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    view = _parse_view(request.args)
+    encoding = _parse_map_encoding(request.args)
+    game = g.dm
+    world_version = game.world_version
+
+    @stream_with_context
+    def generate():
+        last = since
+        yield "retry: 2000\n\n"
+        while not world_version.closed:
+            if last is not None and world_version.wait_for_change(last, STREAM_HEARTBEAT) == last:
+                if world_version.closed:
+                    break
+                stalled = game.ai_turn_pending()
+                game.session.remove()
+                if not stalled:
+                    yield ": heartbeat\n\n" # Idle: blocked on the version condition
+                    continue
+                # An AI turn stalled without a commit: get_state_dict runs the failsafe
+
+            state = game.get_state_dict(since=last, view=view, encoding=encoding)
+            game.session.remove() # Next push reads a fresh snapshot
+            if "version" not in state:
+                yield f"event: error\ndata: {json.dumps(state)}\n\n"
+                world_version.wait_for_change(world_version.current, STREAM_HEARTBEAT)
+                continue
+
+            last = state["version"]
+            yield f"id: {last}\nevent: state\ndata: {json.dumps(state)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/combat/action', methods=['POST'])
 def combat_action():
@@ -28,16 +168,19 @@ def combat_action():
     target_id = data.get('target_id')
     
     narrative_data = dm.combat.player_action(action, target_id=target_id)
+    if narrative_data.get("events"):
+        dm.world_version.push_events(narrative_data["events"])
     
     # We might need to fetch updated combat state from DM if we want it separately
     # But get_state loop handles it mostly. 
     # For the immediate response:
     state = dm.get_state_dict()
     
-    return jsonify({
-        "result": narrative_data, # Contains "events" list
-        "combat": state.get("combat") 
-    })
+    with metrics.phase("serialize"):
+        return jsonify({
+            "result": narrative_data, # Contains "events" list
+            "combat": state.get("combat") 
+        })
 
 @app.route('/api/interact', methods=['POST'])
 def interact():
@@ -75,9 +218,12 @@ def chat():
 
 @app.route('/api/narrative')
 def get_narrative():
-    return jsonify({
+    tag = f"narrative-{dm.game_id}-{dm.world_version.current}"
+    cached = _not_modified(tag)
+    if cached: return cached
+    return _tagged(jsonify({
         "narrative": dm.describe_current_room()
-    })
+    }), tag)
 
 
 
@@ -96,20 +242,29 @@ def perform_investigate():
 def move_player():
     data = request.json
     direction = data.get('direction')
+    path = None
     
-    # Check for direct dx/dy first (from mouse)
-    if 'dx' in data and 'dy' in data:
-         dx = data['dx']
-         dy = data['dy']
+    # Click-to-move: walk a planned route to a target tile in one request
+    if 'target' in data:
+        try:
+            tx, ty = int(data['target'][0]), int(data['target'][1])
+        except (TypeError, ValueError, IndexError, KeyError):
+            return jsonify({"error": "target must be [x, y]"}), 400
+        new_pos, result, path = dm.travel_to(tx, ty)
     else:
-        # Fallback to string direction
-        dx, dy = 0, 0
-        if direction == 'north': dy = -1
-        elif direction == 'south': dy = 1
-        elif direction == 'east': dx = 1
-        elif direction == 'west': dx = -1
-    
-    new_pos, result = dm.move_player(dx, dy)
+        # Check for direct dx/dy first (from mouse)
+        if 'dx' in data and 'dy' in data:
+             dx = data['dx']
+             dy = data['dy']
+        else:
+            # Fallback to string direction
+            dx, dy = 0, 0
+            if direction == 'north': dy = -1
+            elif direction == 'south': dy = 1
+            elif direction == 'east': dx = 1
+            elif direction == 'west': dx = -1
+        
+        new_pos, result = dm.move_player(dx, dy)
     
     narrative = result
     events = []
@@ -123,16 +278,23 @@ def move_player():
                 if e['type'] == 'text':
                     narrative = e['message']
                     break
+    if events:
+        dm.world_version.push_events(events)
     
     # Return updated stats after move
     state = dm.get_state_dict()
     
-    return jsonify({
+    response = {
         "position": new_pos,
         "narrative": narrative,
         "events": events,
         "state": state
-    })
+    }
+    if path is not None:
+        response["path"] = path # Cells walked, in order
+    
+    with metrics.phase("serialize"):
+        return jsonify(response)
 
 @app.route('/api/inventory/equip', methods=['POST'])
 def equip_item():
@@ -163,8 +325,11 @@ def take_loot_item():
 
 @app.route('/api/craft/list')
 def list_recipes():
+    tag = CATALOG_TAGS["craft"]
+    cached = _not_modified(tag)
+    if cached: return cached
     from dungeon.gamedata import RECIPES
-    return jsonify(RECIPES)
+    return _tagged(jsonify(RECIPES), tag)
 
 @app.route('/api/craft/make', methods=['POST'])
 def perform_craft():
@@ -174,8 +339,11 @@ def perform_craft():
 
 @app.route('/api/shop/list')
 def list_shops():
+    tag = CATALOG_TAGS["shop"]
+    cached = _not_modified(tag)
+    if cached: return cached
     from dungeon.items import SHOPS, ITEM_TEMPLATES
-    return jsonify({"shops": SHOPS, "items": ITEM_TEMPLATES})
+    return _tagged(jsonify({"shops": SHOPS, "items": ITEM_TEMPLATES}), tag)
 
 @app.route('/api/shop/buy', methods=['POST'])
 def buy_item():
@@ -219,16 +387,20 @@ def choose_skill():
 def gallery():
     return render_template('gallery.html')
 
-@app.route('/api/assets/list')
 @app.route('/api/assets/list')
 def list_assets():
     """List all images in static/asset_library recursively"""
     base_folder = os.path.join(app.root_path, 'static', 'asset_library')
     if not os.path.exists(base_folder):
         os.makedirs(base_folder)
-    
+
+    # The listing only changes when entries are added, removed or renamed, which moves the
+    # mtime of the directory holding them: the newest directory mtime of the walk is the tag.
+    # (The JSON encoding is what a 304 saves; the walk itself is cheap.)
+    stamp = 0
     image_files = []
     for root, dirs, files in os.walk(base_folder):
+        stamp = max(stamp, os.stat(root).st_mtime_ns)
         for f in files:
             if f.lower().endswith(('.png', '.jpg', '.jpeg')):
                 # Get path relative to asset_library
@@ -237,8 +409,11 @@ def list_assets():
                 # Ensure forward slashes for web
                 rel_path = rel_path.replace('\\', '/')
                 image_files.append(rel_path)
-                
-    return jsonify({"files": sorted(image_files)})
+
+    tag = f"assets-{stamp}"
+    cached = _not_modified(tag)
+    if cached: return cached
+    return _tagged(jsonify({"files": sorted(image_files)}), tag)
 
 @app.route('/api/assets/assign', methods=['POST'])
 def assign_asset():
@@ -277,28 +452,17 @@ def assign_asset():
         print(f"DEBUG: Error copying: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/debug/metrics', methods=['GET', 'DELETE'])
+def debug_metrics():
+    """Per-endpoint timing/statement aggregates and recent slow requests (DELETE resets)."""
+    if request.method == 'DELETE':
+        metrics.reset()
+    return jsonify(metrics.snapshot())
+
 @app.route('/api/debug/reset', methods=['POST', 'GET'])
 def debug_reset():
-    """Resets the game state (DB cleanup handled by DM init usually or we force it)."""
-    global dm
-    if dm and hasattr(dm, 'session'):
-        dm.session.close()
-    
-    from dungeon.database import Base, engine, SessionLocal
-    SessionLocal.remove()
-    
-    # For SQLite, deleting the file is one way, or dropping tables.
-    # DM logic usually handles creating if missing.
-    # Let's drop all tables and init.
-    try:
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
-    except Exception as e:
-        print(f"Reset Error (Locked?): {e}")
-        # Fallback: Just clear tables
-        pass
-    
-    dm = DungeonMaster() # Re-init
+    """Resets the requesting game's state. Other hosted games share the tables, so rows are deleted instead of dropping them."""
+    dm.reset_game() # Clears its layers and forces its clients to resync
     return jsonify({"message": "World Reset Completed", "state": dm.get_state_dict()})
 
 if __name__ == '__main__':
@@ -2,7 +2,12 @@ import math
 import random
 from sqlalchemy.orm.attributes import flag_modified
 from .rules import roll_dice
-from .database import Monster, Player, CombatEncounter
+from .database import Monster, CombatEncounter
+from .metrics import metrics
+from .context import game_context
+from .layers import layer_store
+from .occupancy import occupancy, entity_key
+from .distance import distance_map
 
 class CombatSystem:
     def __init__(self, dm_instance):
@@ -26,12 +31,7 @@ class CombatSystem:
             player.hp_current = player.hp_max
             
             # Stat Point
-            stats = dict(player.stats or {})
-            stats['unspent_points'] = stats.get('unspent_points', 0) + 1
-            player.stats = stats
-            
-            from sqlalchemy.orm.attributes import flag_modified
-            flag_modified(player, "stats")
+            player.unspent_points = (player.unspent_points or 0) + 1
             
             # Add Level Up Event
             events.append({"type": "popup", "title": "LEVEL UP!", "content": f"Level {player.level}!", "color": "#00ff00", "duration": 3000})
@@ -46,11 +46,11 @@ class CombatSystem:
 
     def is_active(self):
         """Check if there is an active combat encounter."""
-        return self.session.query(CombatEncounter).filter_by(is_active=True).first() is not None
+        return game_context(self.session).encounter is not None
 
     def end_combat(self):
         """Force end the active combat encounter."""
-        active = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+        active = game_context(self.session).encounter
         if active:
             active.is_active = False
             for m in active.monsters:
@@ -64,32 +64,26 @@ class CombatSystem:
 
         """Initialize a new combat encounter with all nearby enemies."""
         # 1. Check for existing active encounter
-        active = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+        active = game_context(self.session).encounter
         if active:
             return "Combat is already active!"
             
         # 2. Find all enemies in range (e.g., same room/radius 5)
         # For now, just the target + any within 5 tiles
-        room_monsters = self.session.query(Monster).filter(
-            Monster.z == target_enemy.z,
-            Monster.is_alive == True,
-            Monster.x.between(target_enemy.x - 3, target_enemy.x + 3),
-            Monster.y.between(target_enemy.y - 3, target_enemy.y + 3)
-        ).all()
+        nearby = occupancy.near(self.session, target_enemy.x, target_enemy.y, target_enemy.z, 3, "monster")
+        room_monsters = self.session.query(Monster).filter(Monster.id.in_(nearby)).all() if nearby else []
         
         # 3. Roll Initiatives
         participants = []
         
         # Player Init
-        player = self.session.query(Player).first()
-        p_stats = player.stats or {"dex": 10}
-        p_init = roll_dice(20) + self._get_modifier(p_stats.get("dex", 10))
+        player = self.dm.player
+        p_init = roll_dice(20) + self._get_modifier(player.dexterity or 10)
         participants.append({"type": "player", "id": player.id, "init": p_init, "name": "You"})
         
         # Enemy Init
         for m in room_monsters:
-            e_stats = m.stats or {"dex": 10}
-            e_init = roll_dice(20) + self._get_modifier(e_stats.get("dex", 10))
+            e_init = roll_dice(20) + self._get_modifier(m.dexterity or 10)
             m.initiative = e_init
             m.state = "combat"
             participants.append({"type": "monster", "id": m.id, "init": e_init, "name": m.name})
@@ -122,17 +116,15 @@ class CombatSystem:
         )
         self.session.add(encounter)
         self.session.commit()
+        game_context(self.session).encounter = encounter
         
         # Link monsters and REVEAL them
-        from .database import MapTile
         for m in room_monsters:
             m.encounter_id = encounter.id
             m.state = "combat"
             
             # Reveal Monster Position
-            tile = self.session.query(MapTile).filter_by(x=m.x, y=m.y, z=m.z).first()
-            if tile and not tile.is_visited:
-                tile.is_visited = True
+            layer_store.set_visited(self.session, m.x, m.y, m.z)
                 
         self.session.commit()
         
@@ -156,7 +148,7 @@ class CombatSystem:
         if not monsters: return None
         
         # Sort by distance
-        player = self.session.query(Player).first()
+        player = self.dm.player
         monsters.sort(key=lambda m: max(abs(m.x - player.x), abs(m.y - player.y)))
         return monsters[0]
 
@@ -164,7 +156,8 @@ class CombatSystem:
         """Wrapper for player action."""
         # No lock needed (scoped_session)
         try:
-            return self._player_action_impl(action_type, target_id)
+            with metrics.phase("combat_action"):
+                return self._player_action_impl(action_type, target_id)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -175,9 +168,9 @@ class CombatSystem:
 
     def _player_action_impl(self, action_type, target_id=None):
         """Execute player turn phase-step."""
-        player = self.session.query(Player).first()
+        player = self.dm.player
 
-        encounter = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+        encounter = game_context(self.session).encounter
         if not encounter:
             return {"events": [{"type": "text", "message": "No active combat."}]}
 
@@ -192,13 +185,10 @@ class CombatSystem:
         # --- FLEXIBLE TURN LOGIC ---
         if action_type == "end_turn":
             # Decrement Rage
-            props = dict(player.properties or {})
-            if props.get("rage_turns", 0) > 0:
-                props["rage_turns"] -= 1
-                if props["rage_turns"] == 0:
+            if player.rage_turns > 0:
+                player.rage_turns -= 1
+                if player.rage_turns == 0:
                     events.append({"type": "text", "message": "<b>Your rage subsides.</b>"})
-                player.properties = props
-                flag_modified(player, "properties")
 
             events.append({"type": "text", "message": "Ending Turn..."})
             events.extend(self._cycle_turn(encounter))
@@ -268,13 +258,11 @@ class CombatSystem:
              encounter.actions_left -= 1
              events.append({"type": "text", "message": f"You wind up for a HEAVY STRIKE against {target.name}!"})
              
-             p_stats = player.stats or {"str": 10}
-             str_mod = self._get_modifier(p_stats.get("str", 10))
+             str_mod = self._get_modifier(player.strength or 10)
              prof_bonus = 2 # Assuming player proficiency bonus is 2
              
              # Rage Check
-             props = player.properties or {}
-             range_bonus = 2 if props.get("rage_turns", 0) > 0 else 0
+             range_bonus = 2 if player.rage_turns > 0 else 0
 
              # Roll to Hit: Heavy Strike has -2 penalty, but Rage adds +2
              hit_roll = roll_dice(20) + str_mod + prof_bonus - 2 + range_bonus
@@ -282,8 +270,7 @@ class CombatSystem:
                  dmg = roll_dice(8) + roll_dice(8) + int(str_mod * 1.5) # 2d8 + 1.5x STR
                  
                  # Rage Bonus (20% Scale)
-                 props = player.properties or {}
-                 if props.get("rage_turns", 0) > 0:
+                 if player.rage_turns > 0:
                      dmg = int(dmg * 1.2)
                      
                  target.hp_current -= dmg
@@ -318,16 +305,14 @@ class CombatSystem:
              encounter.actions_left -= 1
              events.append({"type": "text", "message": "You sweep your weapon in a wide arc! (Cleave)"})
              
-             p_stats = player.stats or {"str": 10}
-             str_mod = self._get_modifier(p_stats.get("str", 10))
+             str_mod = self._get_modifier(player.strength or 10)
              prof_bonus = 2 # Assuming player proficiency bonus is 2
 
              # Find all adjacent (within 1.5 units, effectively adjacent squares)
              enemies = [m for m in encounter.monsters if m.is_alive and self._dist(player, m) <= 1.5]
              
              # Rage Check
-             props = player.properties or {}
-             range_bonus = 2 if props.get("rage_turns", 0) > 0 else 0
+             range_bonus = 2 if player.rage_turns > 0 else 0
 
              if not enemies:
                  events.append({"type": "text", "message": "You hit nothing but air."})
@@ -376,8 +361,7 @@ class CombatSystem:
              
              encounter.bonus_actions_left -= 1
              
-             p_stats = player.stats or {"str": 10}
-             str_mod = self._get_modifier(p_stats.get("str", 10))
+             str_mod = self._get_modifier(player.strength or 10)
 
              # Contest: Player STR (Athletics) vs DC 12
              athletics = roll_dice(20) + str_mod # +STR mod
@@ -410,10 +394,7 @@ class CombatSystem:
              events.append({"type": "text", "message": "You ROAR with primal fury! (+20% DMG, +2 HIT, Vuln +20%)"})
              events.append({"type": "anim", "actor": "player", "anim": "buff"}) # visual?
              
-             props = dict(player.properties or {})
-             props["rage_turns"] = 3
-             player.properties = props
-             flag_modified(player, "properties")
+             player.rage_turns = 3
              
              self.session.commit()
              return {"events": events}
@@ -458,7 +439,7 @@ class CombatSystem:
                 events.extend(self._resolve_second_wind())
 
         elif action_type == "flee":
-             active = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+             active = game_context(self.session).encounter
              if active:
                  # 1. Calculate Escape Vector (Average Enemy Position)
                  avg_x, avg_y, count = 0, 0, 0
@@ -589,7 +570,7 @@ class CombatSystem:
         return events
 
     def _resolve_second_wind(self):
-        player = self.session.query(Player).first()
+        player = self.dm.player
         heal = roll_dice(10) + 1
         player.hp_current = min(player.hp_max, player.hp_current + heal)
         return [
@@ -600,16 +581,14 @@ class CombatSystem:
     def _resolve_player_attack(self, enemy):
         events = []
         # Stats
-        player = self.session.query(Player).first()
-        p_stats = player.stats or {"str": 10}
-        str_mod = self._get_modifier(p_stats.get("str", 10))
+        player = self.dm.player
+        str_mod = self._get_modifier(player.strength or 10)
         prof_bonus = 2
         
         # Attack Roll
         # Attack Roll: Regular Attack gets +1 Accuracy
         # Rage Bonus: +2 Hit
-        props = player.properties or {}
-        is_raging = props.get("rage_turns", 0) > 0
+        is_raging = player.rage_turns > 0
         rage_hit_mod = 2 if is_raging else 0
         
         roll = roll_dice(20)
@@ -628,9 +607,7 @@ class CombatSystem:
                 dmg = max(1, dmg // 2)
                 events.append({"type": "text", "message": "<i style='color:#777'>Your weapon glances off the obsidian armor!</i>"})
 
-            print(f"DEBUG: Applying {dmg} damage to {enemy.name} (ID: {enemy.id}). HP before: {enemy.hp_current}")
             enemy.hp_current -= dmg
-            print(f"DEBUG: HP after: {enemy.hp_current}")
             flag_modified(enemy, "hp_current") # Force SQLAlchemy to notice (paranoid)
             
             # Check Death
@@ -676,82 +653,26 @@ class CombatSystem:
     # --- HELPER METHODS ---
     def _move_actor_towards(self, actor, target_x, target_y, max_steps=6):
         """Standardized pathfinding - moves actor towards target."""
-        # Simple Pathfinding: Move towards target one tile at a time
-        from .database import MapTile, NPC, Monster
-        
-        start_dist = max(abs(actor.x - target_x), abs(actor.y - target_y))
-        current_dist = start_dist
+        # Walk down the distance map towards the target, one tile at a time
+        current_dist = max(abs(actor.x - target_x), abs(actor.y - target_y))
         steps = 0
         moved = False
         
-        # Valid Tile Cache (optional optimization could go here)
+        dmap = distance_map(layer_store.grid(self.session, actor.z), target_x, target_y)
+        me = entity_key(actor) # Not flushed mid-walk: its indexed cell is where it started
+        
+        def blocked(x, y):
+            # Occupied by another entity (monster, NPC or the player)?
+            return occupancy.occupied(self.session, x, y, actor.z, ignore=me)
         
         while steps < max_steps and current_dist > 1.5: # 1.5 is melee range
-            dx = 0
-            dy = 0
-            if actor.x < target_x: dx = 1
-            elif actor.x > target_x: dx = -1
-            
-            if actor.y < target_y: dy = 1
-            elif actor.y > target_y: dy = -1
-            
-            new_x = actor.x + dx
-            new_y = actor.y + dy
-            
-            # blocked?
-            blocked = False
-            
-            # 1. Wall Check
-            # We should query the map. For now, we trust the generator's open space or check known obstacles.
-            # Ideally: tile = self.session.query(MapTile).filter_by(x=new_x, y=new_y, z=actor.z).first()
-            # This is expensive in a loop.
-            # Simplified: Check if occupied by another entity
-            
-            if self.session.query(Monster).filter_by(x=new_x, y=new_y, z=actor.z, is_alive=True).first(): blocked = True
-            if self.session.query(NPC).filter_by(x=new_x, y=new_y, z=actor.z).first(): blocked = True
-            player = self.session.query(Player).first()
-            if new_x == player.x and new_y == player.y: blocked = True
-            
-            if not blocked:
-                actor.x = new_x
-                actor.y = new_y
-                moved = True
-                steps += 1
-                current_dist = max(abs(actor.x - target_x), abs(actor.y - target_y))
-            else:
-                # Try only ONE axis if diagonal blocked, OR try alternate axis if straight blocked
-                alt_moves = []
-                if dx != 0 and dy != 0:
-                     alt_moves.append((dx, 0)) # Try X only
-                     alt_moves.append((0, dy)) # Try Y only
-                elif dx != 0:
-                     alt_moves.append((0, 1))
-                     alt_moves.append((0, -1))
-                elif dy != 0:
-                     alt_moves.append((1, 0))
-                     alt_moves.append((-1, 0))
-                
-                found_alt = False
-                for adx, ady in alt_moves:
-                     anx, any_ = actor.x + adx, actor.y + ady
-                     
-                     # Simple Block Check (Copy of above)
-                     ablocked = False
-                     player = self.session.query(Player).first()
-                     if anx == player.x and any_ == player.y: ablocked = True
-                     elif self.session.query(Monster).filter_by(x=anx, y=any_, z=actor.z, is_alive=True).first(): ablocked = True
-                     
-                     if not ablocked:
-                         actor.x = anx
-                         actor.y = any_
-                         steps += 1
-                         current_dist = max(abs(actor.x - target_x), abs(actor.y - target_y))
-                         moved = True
-                         found_alt = True
-                         break
-                
-                if not found_alt:
-                    break # Truly blocked
+            step = dmap.step(actor.x, actor.y, blocked)
+            if not step:
+                break # Truly blocked (or no route)
+            actor.x, actor.y = step
+            moved = True
+            steps += 1
+            current_dist = max(abs(actor.x - target_x), abs(actor.y - target_y))
 
         if moved: 
             self.session.add(actor)
@@ -802,7 +723,7 @@ class CombatSystem:
         return False, events
 
     def _has_equipped_effect(self, effect_name):
-        player = self.session.query(Player).first()
+        player = self.dm.player
         if not player.inventory: return False
         for item in player.inventory:
             if item.is_equipped and item.properties and item.properties.get("effect") == effect_name:
@@ -811,7 +732,6 @@ class CombatSystem:
 
     # --- ENEMY TURN ---
     def _enemy_turn(self, enemy):
-        from .database import CombatEncounter # Ensure import
         events = []
         
         # 1. Check Stunned State
@@ -823,7 +743,7 @@ class CombatSystem:
             enemy.state = "combat" 
             return events
 
-        player = self.session.query(Player).first()
+        player = self.dm.player
         dist = max(abs(enemy.x - player.x), abs(enemy.y - player.y))
         attack_range = 1.5
 
@@ -845,7 +765,7 @@ class CombatSystem:
                  player.hp_current = max(0, player.hp_current - 5)
                  events.append({"type": "popup", "title": "UNKINDLED", "content": "You are webbed!", "duration": 2000})
                  
-                 encounter = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+                 encounter = game_context(self.session).encounter
                  if encounter:
                       encounter.moves_left = 0
                       events.append({"type": "text", "message": "The hardening lava prevents you from moving!"})
@@ -865,16 +785,14 @@ class CombatSystem:
                 events.append({"type": "anim", "actor": "enemy", "anim": "attack"})
                 
                 # Attack
-                stats = enemy.stats or {}
-                str_mod = self._get_modifier(stats.get("str", 10))
+                str_mod = self._get_modifier(enemy.strength or 10)
                 total_hit = roll_dice(20) + str_mod
                 
                 if total_hit >= player.armor_class:
                     dmg = roll_dice(6) + str_mod
                     
                     # Rage Vulnerability
-                    props = player.properties or {}
-                    if props.get("rage_turns", 0) > 0:
+                    if player.rage_turns > 0:
                          dmg = int(dmg * 1.2)
                          events.append({"type": "text", "message": f"<span style='color:orange'>(Rage Vulnerability +20%)</span>"})
 
@@ -888,7 +806,7 @@ class CombatSystem:
                         self.dm.teleport_player(0,0,1)
                         player.hp_current = player.hp_max
                         # Reset Encounter
-                        encounter = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+                        encounter = game_context(self.session).encounter
                         if encounter: encounter.is_active = False
                 else:
                      events.append({"type": "text", "message": f"{enemy.name} misses you."})
@@ -0,0 +1,118 @@
+"""
+Request Context.
+The rows nearly every subsystem touches during one request, the game's player (with its
+inventory) and the active combat encounter (with its monsters), loaded once per session
+instead of once per call site:
+
+    ctx = game_context(self.session)
+    ctx.player, ctx.encounter
+
+The context lives in `session.info`, so it is exactly as long-lived as the session: the
+Flask teardown (and every stream push) removes the thread's session, and the next request
+starts with an empty context. A rollback drops it as well, since objects it holds may be
+gone; code that swaps the player or bulk-deletes encounters calls `reset()` itself.
+
+Game sessions do not expire their objects on commit (games.py), so neither the context nor
+anything else a request loaded is read again after the request's own commits. What another
+session commits meanwhile shows up in the next request; the one exception is "no encounter",
+which is re-queried as soon as any commit to the game touches encounters (the "combat"
+section of its world log, versioning.py), so a fight started elsewhere is never missed.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, selectinload, object_session
+from sqlalchemy.orm.exc import ObjectDeletedError
+
+from .database import SessionFactory, DEFAULT_GAME, Player, CombatEncounter
+from .versioning import world_versions
+
+_UNLOADED = object()
+
+
+class GameContext:
+    """Per-session cache of the player and the active encounter."""
+
+    def __init__(self, session):
+        self.session = session
+        self._player = _UNLOADED
+        self._encounter = _UNLOADED
+        self._none_since = None # World version at which "no encounter" was last known to hold
+
+    @property
+    def player(self):
+        if self._player is _UNLOADED or self._player is None or not self._owns(self._player):
+            self._player = self.session.query(Player).options(selectinload(Player.inventory)).first()
+        return self._player
+
+    @property
+    def encounter(self):
+        """The active encounter, or None. Ended encounters drop out without a new query."""
+        enc = self._encounter
+        if enc is None:
+            if self._combat_changed():
+                enc = _UNLOADED
+        elif enc is not _UNLOADED:
+            try:
+                if not self._owns(enc):
+                    enc = _UNLOADED
+                elif not enc.is_active:
+                    enc = self._set_none()
+            except ObjectDeletedError: # Expired, and reaped by another session
+                enc = self._set_none()
+        if enc is _UNLOADED:
+            since = self._world().current # Taken before the query: a commit racing it is seen next time
+            enc = self._encounter = self.session.query(CombatEncounter).options(
+                selectinload(CombatEncounter.monsters)
+            ).filter_by(is_active=True).first()
+            if enc is None:
+                self._none_since = since
+        return enc
+
+    @encounter.setter
+    def encounter(self, encounter):
+        if encounter is None:
+            self._set_none()
+        else:
+            self._encounter = encounter
+
+    def reset(self):
+        """Forget everything; the next access loads fresh rows."""
+        self._player = _UNLOADED
+        self._encounter = _UNLOADED
+
+    def _set_none(self):
+        self._encounter = None
+        self._none_since = self._world().current
+        return None
+
+    def _combat_changed(self):
+        """Whether a commit since "no encounter" was established touched encounters."""
+        world = self._world()
+        current = world.current
+        if current == self._none_since:
+            return False
+        changes = world.changes_since(self._none_since)
+        if changes is None or "combat" in changes.sections:
+            return True
+        self._none_since = current
+        return False
+
+    def _world(self):
+        return world_versions.get(self.session.info.get("game_id", DEFAULT_GAME))
+
+    def _owns(self, obj):
+        return object_session(obj) is self.session
+
+
+def game_context(session):
+    """The GameContext of `session` (a Session or a scoped_session), created on first use."""
+    if isinstance(session, scoped_session):
+        session = session()
+    ctx = session.info.get("game_context")
+    if ctx is None:
+        ctx = session.info["game_context"] = GameContext(session)
+    return ctx
+
+
+@event.listens_for(SessionFactory, "after_rollback")
+def _drop_context(session):
+    session.info.pop("game_context", None)
@@ -1,14 +1,61 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, JSON, ForeignKey, Index
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, JSON, ForeignKey, Index, LargeBinary, UniqueConstraint, text
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.orm.collections import attribute_keyed_dict
 
 Base = declarative_base()
 
 engine = None
 Session = None
 
+DEFAULT_GAME = "default" # Rows written before saves had an identity belong to this game
 
 
-class Player(Base):
+class GameScoped:
+    """Rows owned by one game (save). Game sessions only ever see their own (see games.py)."""
+    game_id = Column(String, nullable=False, default=DEFAULT_GAME, server_default=DEFAULT_GAME)
+
+
+# Short stat name (as used in `stats` dicts and the state payload) -> column
+ABILITIES = {"str": "strength", "dex": "dexterity", "con": "constitution",
+             "int": "intelligence", "wis": "wisdom", "cha": "charisma"}
+
+class AbilityScores:
+    """
+    Ability scores as typed columns, so combat modifiers and stat upgrades read and write
+    single cells. `stats` is a dict view in the old JSON shape ({"str": 10, ...}); assigning
+    a dict to it sets the matching columns.
+    """
+    strength = Column(Integer, nullable=False, default=10, server_default="10")
+    dexterity = Column(Integer, nullable=False, default=10, server_default="10")
+    constitution = Column(Integer, nullable=False, default=10, server_default="10")
+    intelligence = Column(Integer, nullable=False, default=10, server_default="10")
+    wisdom = Column(Integer, nullable=False, default=10, server_default="10")
+    charisma = Column(Integer, nullable=False, default=10, server_default="10")
+
+    _extra_stats = {} # Further columns shown in `stats`: name -> default
+
+    @property
+    def stats(self):
+        out = {}
+        for short, attr in ABILITIES.items():
+            value = getattr(self, attr)
+            out[short] = 10 if value is None else value # Defaults only land on insert
+        for name, default in self._extra_stats.items():
+            value = getattr(self, name)
+            out[name] = default if value is None else value
+        return out
+
+    @stats.setter
+    def stats(self, values):
+        for key, value in (values or {}).items():
+            attr = ABILITIES.get(key.lower())
+            if attr:
+                setattr(self, attr, value)
+            elif key in self._extra_stats:
+                setattr(self, key, value)
+
+
+class Player(AbilityScores, GameScoped, Base):
     __tablename__ = 'players'
     
     id = Column(Integer, primary_key=True)
@@ -23,23 +70,88 @@ class Player(Base):
     y = Column(Integer, default=0)
     z = Column(Integer, default=1)
     
-    # Stats
-    stats = Column(JSON, default={}) # Str, Dex, etc.
-    skills = Column(JSON, default={}) # Mining, Herbalism, etc.
+    # Stats (ability scores: AbilityScores)
     armor_class = Column(Integer, default=10)
+    unspent_points = Column(Integer, nullable=False, default=0, server_default="0")
+    weapon_damage = Column(String, default="1d4") # Main-hand dice, kept by recalculate_stats
+    rage_turns = Column(Integer, nullable=False, default=0, server_default="0")
+    _extra_stats = {"unspent_points": 0, "weapon_damage": "1d4"}
     
     # Progression
     xp = Column(Integer, default=0)
     level = Column(Integer, default=1)
     gold = Column(Integer, default=0)
     
-    quest_state = Column(JSON, default={"active_quests": []})
-    
     # Relationships
     inventory = relationship("InventoryItem", back_populates="player", cascade="all, delete-orphan")
+    skill_rows = relationship("PlayerSkill", collection_class=attribute_keyed_dict("skill"),
+                              cascade="all, delete-orphan") # Mining, Herbalism, feats...
+    quest_rows = relationship("PlayerQuest", collection_class=attribute_keyed_dict("quest_id"),
+                              cascade="all, delete-orphan")
+
+    @property
+    def skills(self):
+        """{skill: {"level": n, "xp": n}}"""
+        return {name: {"level": row.level, "xp": row.xp} for name, row in self.skill_rows.items()}
+
+    @property
+    def quest_state(self):
+        """Read-only view in the old JSON shape: {"active": {id: {"progress": {...}}}, "completed": [...]}."""
+        active, completed = {}, []
+        for quest_id, row in self.quest_rows.items():
+            if row.status == "completed":
+                completed.append(quest_id)
+            else:
+                active[quest_id] = {"progress": {t: p.count for t, p in row.progress.items()}}
+        return {"active": active, "completed": completed}
+
+class PlayerSkill(GameScoped, Base):
+    __tablename__ = 'player_skills'
 
-class InventoryItem(Base):
+    __table_args__ = (
+        UniqueConstraint('player_id', 'skill'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player_id = Column(Integer, ForeignKey('players.id'), nullable=False)
+    skill = Column(String, nullable=False)
+    level = Column(Integer, nullable=False, default=1)
+    xp = Column(Integer, nullable=False, default=0)
+
+class PlayerQuest(GameScoped, Base):
+    __tablename__ = 'player_quests'
+
+    __table_args__ = (
+        UniqueConstraint('player_id', 'quest_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player_id = Column(Integer, ForeignKey('players.id'), nullable=False)
+    quest_id = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="active") # active, completed
+
+    progress = relationship("QuestProgress", collection_class=attribute_keyed_dict("target"),
+                            cascade="all, delete-orphan")
+
+class QuestProgress(GameScoped, Base):
+    """Kill counter for one quest objective."""
+    __tablename__ = 'quest_progress'
+
+    __table_args__ = (
+        UniqueConstraint('quest_row_id', 'target'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    quest_row_id = Column(Integer, ForeignKey('player_quests.id'), nullable=False)
+    target = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class InventoryItem(GameScoped, Base):
     __tablename__ = 'inventory_items'
+
+    __table_args__ = (
+        Index('idx_inventory_lookup', 'player_id', 'name', 'is_equipped'),
+    )
     
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer, ForeignKey('players.id'))
@@ -54,12 +166,31 @@ class InventoryItem(Base):
 
     player = relationship("Player", back_populates="inventory")
 
+class MapLayer(GameScoped, Base):
+    """One whole z-level packed into a single row (format: see dungeon/layers.py)."""
+    __tablename__ = 'map_layers'
+
+    game_id = Column(String, primary_key=True, default=DEFAULT_GAME, server_default=DEFAULT_GAME)
+    z = Column(Integer, primary_key=True, autoincrement=False)
+    x0 = Column(Integer, default=0)
+    y0 = Column(Integer, default=0)
+    width = Column(Integer, default=0)
+    height = Column(Integer, default=0)
+
+    palette = Column(JSON, default=[]) # index -> tile_type, 0 = no tile
+    tiles = Column(LargeBinary)        # uint8/uint16 palette index per cell
+    visited = Column(LargeBinary)      # Fog of war bitset, one bit per cell
+    meta = Column(JSON, default={})    # Sparse {"x,y": meta_data}
+    regions = Column(LargeBinary)      # uint8/uint16 region id per cell (None: no region layer yet)
+    region_names = Column(JSON)        # region id -> name, 0 = the rest of the level
+
+# Legacy one-row-per-tile storage. Only read by layers.migrate_map_tiles().
 class MapTile(Base):
     __tablename__ = 'map_tiles'
     
     # Composite Index for fast spatial lookups
     __table_args__ = (
-        Index('idx_maptile_location', 'z', 'x', 'y'),
+        Index('idx_maptile_location', 'z', 'x', 'y', unique=True),
     )
     
     id = Column(Integer, primary_key=True)
@@ -73,11 +204,11 @@ class MapTile(Base):
     # Allow storing extra data (e.g., "blood_stain": true)
     meta_data = Column(JSON, default={})
 
-class WorldObject(Base):
+class WorldObject(GameScoped, Base):
     __tablename__ = 'world_objects'
 
     __table_args__ = (
-        Index('idx_wobj_location', 'z', 'x', 'y'),
+        Index('idx_wobj_location', 'game_id', 'z', 'x', 'y', unique=True),
     )
     
     id = Column(Integer, primary_key=True)
@@ -91,8 +222,12 @@ class WorldObject(Base):
     
     properties = Column(JSON, default={}) # {"loot": [], "key": "iron_key"}
 
-class CombatEncounter(Base):
+class CombatEncounter(GameScoped, Base):
     __tablename__ = 'combat_encounters'
+
+    __table_args__ = (
+        Index('idx_encounter_active', 'game_id', 'is_active', sqlite_where=text('is_active = 1')),
+    )
     
     id = Column(Integer, primary_key=True)
     turn_order = Column(JSON) # List of IDs/Types dicts e.g. [{"type": "player"}, {"type": "monster", "id": 1}]
@@ -108,12 +243,14 @@ class CombatEncounter(Base):
     actions_left = Column(Integer, default=0)
     bonus_actions_left = Column(Integer, default=0)
 
-class Monster(Base):
+class Monster(AbilityScores, GameScoped, Base):
     __tablename__ = 'monsters'
 
     __table_args__ = (
-        Index('idx_monster_location', 'z', 'x', 'y'),
+        Index('idx_monster_location', 'game_id', 'z', 'x', 'y'),
         Index('idx_monster_alive', 'is_alive'),
+        Index('idx_monster_level', 'game_id', 'z', 'is_alive'),
+        Index('idx_monster_encounter', 'encounter_id', 'is_alive', sqlite_where=text('encounter_id IS NOT NULL')),
     )
     
     id = Column(Integer, primary_key=True)
@@ -137,7 +274,6 @@ class Monster(Base):
 
     armor_class = Column(Integer, default=10)
     initiative = Column(Integer, default=0)
-    stats = Column(JSON, default={"str":10, "dex":10, "con":10, "int":10, "wis":10, "cha":10})
     loot = Column(JSON, default=[]) # Loot dropped on death
     
     # Encounter Link
@@ -146,15 +282,16 @@ class Monster(Base):
 
 
 # NPC Table for Oakhaven
-class NPC(Base):
+class NPC(GameScoped, Base):
     __tablename__ = 'npcs'
 
     __table_args__ = (
-        Index('idx_npc_location', 'z', 'x', 'y'),
+        Index('idx_npc_location', 'game_id', 'z', 'x', 'y'),
+        UniqueConstraint('game_id', 'name'), # Every game has its own cast
     )
     
     id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True)
+    name = Column(String)
     persona_prompt = Column(String) # The system prompt for AI
     location = Column(String) # "Tavern", "Smithy"
     asset = Column(String, default="player.png")
@@ -166,18 +303,192 @@ class NPC(Base):
 
     quest_state = Column(JSON, default={}) # Tracks interactions
 
+# Name lookups use LIKE 'Name%', which can range-scan a NOCASE index
+Index('idx_npc_name_nocase', NPC.game_id, NPC.name.collate('NOCASE'))
+
 
 # Database Initialization
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
 from sqlalchemy.orm import scoped_session
 
-engine = create_engine('sqlite:///dungeon.db', connect_args={'check_same_thread': False})
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+# SQLite connection profiles, applied as PRAGMAs on every new connection.
+# Pick one with DUNGEON_DB_PROFILE; override single pragmas with DUNGEON_SQLITE_<NAME>
+# (e.g. DUNGEON_SQLITE_SYNCHRONOUS=FULL). DUNGEON_DB_URL selects the database file.
+SQLITE_PROFILES = {
+    # Driver defaults: rollback journal, readers and the writer block each other
+    "legacy": {},
+    # WAL: readers never block the writer (and vice versa); fsync only at checkpoints
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024, # Negative = KiB -> 64MB page cache
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000 # ms to wait on a locked database instead of failing
+    }
+}
+
+def sqlite_pragmas(environ=os.environ):
+    """PRAGMA settings for the configured profile, with per-pragma env overrides."""
+    profile = environ.get("DUNGEON_DB_PROFILE", "wal")
+    pragmas = dict(SQLITE_PROFILES.get(profile, SQLITE_PROFILES["wal"]))
+    for name in SQLITE_PROFILES["wal"]:
+        override = environ.get(f"DUNGEON_SQLITE_{name.upper()}")
+        if override is not None:
+            pragmas[name] = override
+    return pragmas
+
+DB_URL = os.environ.get("DUNGEON_DB_URL", "sqlite:///dungeon.db")
+_pragmas = sqlite_pragmas()
+
+def _apply_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    for name, value in _pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def create_db_engine(url):
+    """SQLite engine with the configured pragma profile."""
+    db_engine = create_engine(url, connect_args={'check_same_thread': False})
+    event.listen(db_engine, "connect", _apply_pragmas)
+    return db_engine
+
+engine = create_db_engine(DB_URL)
+
+SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = scoped_session(SessionFactory)
 
-def init_db():
-    """Create tables if they don't exist."""
-    Base.metadata.create_all(bind=engine)
+def init_db(bind=None):
+    """Create tables if they don't exist, then bring older saves up to date."""
+    from .migrations import run_migrations, check_query_plans
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    if run_migrations(bind):
+        check_query_plans(bind)
 
 def get_session():
     # Return the scoped_session registry/proxy directly.
     # This allows it to act as a thread-local proxy.
     return SessionLocal
+
+
+# Per-save storage. With DUNGEON_SAVE_DIR set, every game lives in its own SQLite file
+# (<dir>/<game_id>.db) instead of sharing DUNGEON_DB_URL, so games never wait on each
+# other's write lock and a save can be copied or archived on its own.
+# DUNGEON_MAX_OPEN_SAVES bounds how many save files are open at once.
+SAVE_DIR = os.environ.get("DUNGEON_SAVE_DIR")
+
+class SaveEngines:
+    """
+    game_id -> engine of its save file. LRU: the least recently used saves are closed when over
+    capacity, but only once nothing uses them: every game session leases its engine
+    (`acquire`/`release`, games.py), and an engine is disposed after its last lease is returned.
+    """
+
+    def __init__(self, directory, capacity=32):
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._engines = OrderedDict() # game_id -> engine, least recently used first
+        self._leases = {}             # engine -> sessions using it
+        self._closing = set()         # Evicted engines still leased: disposed on their last release
+        self._ready = set()           # Saves already created/migrated by this process
+        self._initializing = {}       # game_id -> Lock held while that save is created/migrated
+
+    def path(self, game_id):
+        return os.path.join(self.directory, f"{game_id}.db")
+
+    def get(self, game_id):
+        """The save's engine, without a lease (for one-off work; sessions use acquire)."""
+        return self._open(game_id, lease=False)
+
+    def acquire(self, game_id):
+        """The save's engine, kept open until the matching release()."""
+        return self._open(game_id, lease=True)
+
+    def release(self, save_engine):
+        """Return a lease taken by acquire()."""
+        with self._lock:
+            self._leases[save_engine] -= 1
+            if self._leases[save_engine]:
+                return
+            del self._leases[save_engine]
+            dispose = save_engine in self._closing
+            self._closing.discard(save_engine)
+            closed = self._trim()
+        if dispose:
+            closed.append(save_engine)
+        for old in closed:
+            old.dispose()
+
+    def close(self, game_id):
+        """Close the save's connections (e.g. before copying the file), once no session uses them."""
+        with self._lock:
+            save_engine = self._engines.pop(game_id, None)
+            if save_engine is not None and save_engine in self._leases:
+                self._closing.add(save_engine)
+                return
+        if save_engine is not None:
+            save_engine.dispose()
+
+    def open_saves(self):
+        """[(game_id, engine)] of the currently open saves."""
+        with self._lock:
+            return list(self._engines.items())
+
+    def _open(self, game_id, lease):
+        with self._lock:
+            save_engine = self._engines.get(game_id)
+            if save_engine is None:
+                os.makedirs(self.directory, exist_ok=True)
+                save_engine = self._engines[game_id] = create_db_engine(f"sqlite:///{self.path(game_id)}")
+            self._engines.move_to_end(game_id)
+            if lease:
+                self._leases[save_engine] = self._leases.get(save_engine, 0) + 1
+            closed = self._trim(keep=save_engine)
+            initializing = None
+            if game_id not in self._ready:
+                initializing = self._initializing.setdefault(game_id, threading.Lock())
+        for old in closed:
+            old.dispose()
+        if initializing is not None:
+            with initializing: # Only sessions of this save wait for it to be created/migrated
+                if game_id not in self._ready:
+                    try:
+                        init_db(save_engine)
+                        self._ready.add(game_id)
+                    finally:
+                        with self._lock:
+                            self._initializing.pop(game_id, None)
+        return save_engine
+
+    def _trim(self, keep=None):
+        """Drop unleased saves over capacity, least recently used first. Caller holds the lock and disposes them."""
+        closed = []
+        over = len(self._engines) - self.capacity
+        for game_id, save_engine in list(self._engines.items()):
+            if over <= 0:
+                break
+            if save_engine is keep or save_engine in self._leases:
+                continue
+            del self._engines[game_id]
+            closed.append(save_engine)
+            over -= 1
+        return closed
+
+save_engines = SaveEngines(SAVE_DIR, int(os.environ.get("DUNGEON_MAX_OPEN_SAVES", 32))) if SAVE_DIR else None
+
+def engine_for(game_id):
+    """Engine holding the game's rows: its own save file in per-save mode, else the shared database."""
+    if save_engines is not None:
+        return save_engines.get(game_id)
+    return engine
+
+def game_engines():
+    """Every engine that currently holds game rows (for work that spans all games)."""
+    if save_engines is not None:
+        return [save_engine for _, save_engine in save_engines.open_saves()]
+    return [engine]
@@ -1,5 +1,6 @@
 from sqlalchemy.orm.attributes import flag_modified
-from .database import NPC, MapTile, Player
+from .database import NPC
+from .layers import layer_store
 # from .ai_bridge import AIBridge # Removed LLM
 from .scripts import NPC_SCRIPTS
 
@@ -13,8 +14,8 @@ class DialogueSystem:
 
     @property
     def player(self):
-        # Always query fresh to ensure attachment to current thread's session
-        return self.session.query(Player).first()
+        # Always resolved through the current thread's session
+        return self.dm.player
 
     def chat_with_npc(self, npc_index, message):
         """Handle persistent chat with an NPC using Script Trees."""
@@ -315,11 +316,8 @@ class DialogueSystem:
         if action_name == "rescue_elara":
             state["status"] = "escorting"
             # Unlock Secret Door
-            door_tile = self.session.query(MapTile).filter_by(x=2, y=30, z=0).first()
-            if door_tile:
-                door_tile.tile_type = "door"
-                door_tile.is_visited = True 
-                flag_modified(door_tile, "tile_type")
+            if layer_store.set_type(self.session, 2, 30, 0, "door"):
+                layer_store.set_visited(self.session, 2, 30, 0)
             # Move Elara closer
             npc.x = 2
             return "Elara is following you."
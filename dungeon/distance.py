@@ -0,0 +1,92 @@
+"""
+Distance Maps.
+Dijkstra maps for chase AI: the number of steps from every walkable cell near a target to
+the target, over a level's TileGrid (tiles.py). Actors move 8-way at one step per move, so
+the map is a breadth-first flood out from the target, bounded to a square `radius` around it.
+
+A chaser reads its next step off the map (`step()`: the neighbour closest to the target),
+so every monster chasing the player shares one flood fill instead of searching on its own,
+and walls are walked around instead of bumped into.
+
+Maps are memoized per (grid, target cell, radius) like fields of view (fov.py): a TileGrid
+is a snapshot replaced whenever the level's tiles change, so a map is recomputed only when
+the target moves or the map changes, and old maps age out of the LRU.
+
+    dmap = distance_map(layer_store.grid(session, z), player.x, player.y)
+    nxt = dmap.step(m.x, m.y, blocked=...)   # -> (x, y) or None
+"""
+from array import array
+from collections import deque
+from functools import lru_cache
+
+from .gamedata import DISTANCE_CONFIG
+from .tiles import WALKABLE
+
+UNREACHED = 0xFFFF
+
+# Diagonals first: between equally good steps, prefer the one that closes both axes
+_NEIGHBOURS = [(1, 1), (1, -1), (-1, 1), (-1, -1), (1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+class DistanceMap:
+    """Steps to (x, y) from each cell of the square window around it (UNREACHED if none)."""
+    __slots__ = ("x", "y", "x0", "y0", "size", "dist")
+
+    def __init__(self, x, y, x0, y0, size, dist):
+        self.x = x
+        self.y = y
+        self.x0 = x0
+        self.y0 = y0
+        self.size = size
+        self.dist = dist # array('H'), row-major from (x0, y0)
+
+    def at(self, x, y):
+        """Steps from (x, y) to the target, or None (outside the window or no route)."""
+        if 0 <= x - self.x0 < self.size and 0 <= y - self.y0 < self.size:
+            d = self.dist[(y - self.y0) * self.size + (x - self.x0)]
+            if d != UNREACHED:
+                return d
+        return None
+
+    def step(self, x, y, blocked=None):
+        """Best next cell from (x, y) towards the target, skipping cells `blocked(x, y)` vetoes; None if no step gets closer."""
+        here = self.at(x, y)
+        if here is None:
+            return None
+        best, best_key = None, None
+        for dx, dy in _NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            d = self.at(nx, ny)
+            if d is None or d >= here:
+                continue
+            key = (d, max(abs(nx - self.x), abs(ny - self.y)))
+            if (best_key is None or key < best_key) and not (blocked and blocked(nx, ny)):
+                best, best_key = (nx, ny), key
+        return best
+
+
+def distance_map(grid, x, y, radius=None):
+    """DistanceMap towards (x, y) on `grid`, covering `radius` cells around it."""
+    return _distance_map(grid, x, y, DISTANCE_CONFIG["radius"] if radius is None else radius)
+
+
+@lru_cache(maxsize=DISTANCE_CONFIG["cache_size"])
+def _distance_map(grid, x, y, radius):
+    size = 2 * radius + 1
+    x0, y0 = x - radius, y - radius
+    dist = array("H", [UNREACHED]) * (size * size)
+    dist[radius * size + radius] = 0
+    frontier = deque([(x, y)])
+    while frontier:
+        cx, cy = frontier.popleft()
+        d = dist[(cy - y0) * size + (cx - x0)] + 1
+        for dx, dy in _NEIGHBOURS:
+            nx, ny = cx + dx, cy + dy
+            if not (0 <= nx - x0 < size and 0 <= ny - y0 < size):
+                continue
+            i = (ny - y0) * size + (nx - x0)
+            if dist[i] != UNREACHED or not grid.at(nx, ny) & WALKABLE:
+                continue
+            dist[i] = d
+            frontier.append((nx, ny))
+    return DistanceMap(x, y, x0, y0, size, dist)
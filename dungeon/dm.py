@@ -1,4 +1,4 @@
-from .database import get_session, Player, MapTile, Monster, InventoryItem, NPC, init_db, WorldObject, CombatEncounter
+from .database import DEFAULT_GAME, engine_for, Player, MapLayer, Monster, InventoryItem, NPC, init_db, WorldObject, CombatEncounter
 from .rules import roll_dice, get_skill_level, award_skill_xp
 from .combat import CombatSystem
 from .generator import LevelBuilder
@@ -6,17 +6,30 @@ from .dialogue import DialogueSystem
 from .inventory_system import InventorySystem
 from .world_sim import WorldSimulation
 from .movement import MovementSystem
+from .versioning import world_versions
+from .layers import layer_store, migrate_map_tiles
+from .occupancy import occupancy
+from .tiles import tile_flags, OPAQUE
+from .fov import field_of_view, lit_mask
+from .games import game_session
+from .context import game_context
+from .metrics import metrics
+from .state_encoding import encode_map, encode_visibility
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.orm import joinedload
-from .gamedata import NPC_START_CONFIG, PLAYER_START_CONFIG
+from .gamedata import NPC_START_CONFIG, PLAYER_START_CONFIG, STATE_VIEWPORT_CONFIG, FOV_CONFIG
 import threading
 import queue
 
 class DungeonMaster:
-    def __init__(self):
+    def __init__(self, game_id=DEFAULT_GAME):
         # self.lock removed; using scoped_session
-        init_db() # Ensure tables exist
-        self.session = get_session()
+        init_db(engine_for(game_id)) # Ensure tables exist (shared database or the game's save file)
+        self.game_id = game_id
+        self.session = game_session(game_id) # Only ever sees this game's rows
+        self.world_version = world_versions.get(game_id)
+        if game_id == DEFAULT_GAME:
+            migrate_map_tiles(self.session) # Older saves: per-tile rows -> packed layers
         self.inventory = InventorySystem(self.session)
         self.prefetch_queue = queue.Queue()
         self.processing = set()
@@ -27,61 +40,67 @@ class DungeonMaster:
         self.interactions = InteractionManager(self)
         self.world_sim = WorldSimulation(self)
         self.movement = MovementSystem(self)
+        self._quest_status_cache = {}
+        self._quest_status_version = None
         
         self._initialize_world()
 
+    @property
+    def player(self):
+        """This game's player, loaded once per request (see context.py)."""
+        return game_context(self.session).player
+
     def equip_item(self, item_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.equip_item(player, item_id)
         
     def unequip_item(self, item_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.unequip_item(player, item_id)
 
     def use_item(self, item_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.use_item(player, item_id)
 
     def take_loot(self, corpse_id, loot_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.take_loot(player, corpse_id, loot_id)
 
     def get_skill_level(self, skill):
         # Proxy to rules
-        player = self.session.query(Player).first()
+        player = self.player
         return get_skill_level(player, skill)
 
     def award_skill_xp(self, skill, amount):
         # Proxy to rules
-        player = self.session.query(Player).first()
+        player = self.player
         return award_skill_xp(player, skill, amount)
 
     def craft_item(self, recipe_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.craft_item(player, recipe_id)
 
     def buy_item(self, template_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.buy_item(player, template_id)
 
     def sell_item(self, item_id):
-        player = self.session.query(Player).first()
+        player = self.player
         return self.inventory.sell_item(player, item_id)
 
     def _initialize_world(self):
         # Ensure player exists
-        self.player = self.session.query(Player).options(joinedload(Player.inventory)).first()
-        if not self.player:
+        player = self.session.query(Player).options(joinedload(Player.inventory)).first()
+        if not player:
             print(f"DM: Creating new Hero '{PLAYER_START_CONFIG['name']}'...")
             cfg = PLAYER_START_CONFIG
-            self.player = Player(
+            player = Player(
                 name=cfg['name'],
                 hp_current=cfg['hp_current'], hp_max=cfg['hp_max'],
                 stats=cfg['stats'],
                 x=cfg['start_pos']['x'], 
                 y=cfg['start_pos']['y'], 
-                z=cfg['start_pos']['z'],
-                quest_state={"active_quests": []}
+                z=cfg['start_pos']['z']
             )
             
             # Add default gear
@@ -90,23 +109,23 @@ class DungeonMaster:
                     name=item['name'], 
                     slot=item['slot'], 
                     is_equipped=item['is_equipped'], 
-                    player=self.player
+                    player=player
                 ))
             
-            self.session.add(self.player)
+            self.session.add(player)
             
             # --- Generate Maps ---
             builder = LevelBuilder(self.session)
-            builder.generate_tutorial_dungeon(self.player)
+            builder.generate_tutorial_dungeon(player)
             builder.generate_town(1) # Force Generate Town
             
             # Reveal Starting Area
-            self.update_visited(self.player.x, self.player.y, self.player.z)
+            self.update_visited(player.x, player.y, player.z)
             
             # --- DEBUG: Auto-Rescue NPCs for Testing ---
             # Move everyone to town immediately based on config
             for npc_key, coords in NPC_START_CONFIG.items():
-                npc = self.session.query(NPC).filter(NPC.name.like(f"%{npc_key}%")).first()
+                npc = self.session.query(NPC).filter(NPC.name.like(f"{npc_key}%")).first()
                 if npc:
                     npc.x = coords['x']
                     npc.y = coords['y']
@@ -120,7 +139,7 @@ class DungeonMaster:
             # --- Spawn Town NPCs ---
             # LEGACY FIX: Check for "Gareth Ironhand" specifically.
             # If he exists (even in dungeon), DO NOT spawn the town placeholder.
-            gareth_exists = self.session.query(NPC).filter(NPC.name.like("%Gareth%")).first()
+            gareth_exists = self.session.query(NPC).filter(NPC.name.like("Gareth%")).first()
             # Clean up duplicates (Migration)
             # If we have "Gareth" (town) AND "Gareth Ironhand" (dungeon), delete "Gareth".
             generic_gareth = self.session.query(NPC).filter_by(name="Gareth").first()
@@ -140,15 +159,22 @@ class DungeonMaster:
         """Wipe database and restart."""
         print("DM: RESETTING GAME...")
         # Delete all data
-        from .database import CombatEncounter
+        from .database import CombatEncounter, PlayerSkill, PlayerQuest, QuestProgress
         self.session.query(InventoryItem).delete()
+        self.session.query(QuestProgress).delete()
+        self.session.query(PlayerQuest).delete()
+        self.session.query(PlayerSkill).delete()
         self.session.query(Monster).delete()
-        self.session.query(MapTile).delete()
+        self.session.query(MapLayer).delete()
         self.session.query(Player).delete()
         self.session.query(NPC).delete()
         self.session.query(CombatEncounter).delete()
         self.session.query(WorldObject).delete()
         self.session.commit()
+        layer_store.evict_game(self.game_id)
+        occupancy.evict_game(self.game_id)
+        game_context(self.session).reset()
+        self.world_version.invalidate() # Bulk deletes bypass change tracking
         
         # Re-init
         self._initialize_world()
@@ -169,6 +195,10 @@ class DungeonMaster:
         """Clean robust movement logic (Delegated)."""
         return self.movement.move_player(dx, dy)
 
+    def travel_to(self, tx, ty):
+        """Click-to-move along a planned route (Delegated)."""
+        return self.movement.travel_to(tx, ty)
+
     def player_interact(self, action, target_type, target_index):
         return self.interactions.handle_interaction(action, target_type, target_index)
 
@@ -198,7 +228,7 @@ class DungeonMaster:
         pass 
     
     def _worker(self):
-        worker_session = get_session() # Dedicated session
+        worker_session = game_session(self.game_id) # Dedicated session
         while True:
             xyz = self.prefetch_queue.get()
             try:
@@ -217,59 +247,12 @@ class DungeonMaster:
         sess = session if session else self.session
         
         # 1. Fetch Tile
-        tile = sess.query(MapTile).filter_by(x=x, y=y, z=z).first()
-        if not tile: return "Void."
-        
-        # Room Definitions
-        # Helper to check bounds
-        def in_rect(rx, ry, w, h):
-            # Centered rect logic from generator?
-            # Generator used: range(cx - w//2, cx + w//2 + 1)
-            # So bounds are [cx - w//2, cx + w//2] inclusive
-            
-            # Let's just define explicit ranges based on known generator logic
-            pass
-
-        if z == 1:
-            # Town
-            if -8 <= x <= 0 and 1 <= y <= 7: return "Town Hall"
-            if 8 <= x <= 15 and 6 <= y <= 12: return "The Smithy"
-            if -14 <= x <= -8 and 6 <= y <= 12: return "Alchemist's Shop"
-            if abs(x) <= 20 and abs(y) <= 20: return "Town Square"
-            return "Wilderness"
-        elif z == 0:
-            # Dungeon
-            # 1. Start Room (0,0, 3x3) -> -1 to 1
-            if -1 <= x <= 1 and -1 <= y <= 1: return "Dungeon Entrance"
-            
-            # 2. Corridor (0, 2-8)
-            if x == 0 and 2 <= y <= 8: return "Dark Corridor"
-            
-            # 3. Grand Hall (0, 11, 7x5) -> -3 to 3, 9 to 13
-            if -3 <= x <= 3 and 9 <= y <= 13: return "Grand Hall"
-            
-            # 4. Armory (-10, 11, 5x5) -> -12 to -8, 9 to 13
-            if -12 <= x <= -8 and 9 <= y <= 13: return "Old Armory"
-            
-            # 5. Library (10, 11, 5x5) -> 8 to 12, 9 to 13
-            if 8 <= x <= 12 and 9 <= y <= 13: return "Dusty Library"
-            
-            # 6. Barracks (0, 20, 9x5) -> -4 to 4, 18 to 22
-            if -4 <= x <= 4 and 18 <= y <= 22: return "Guard Barracks"
-            
-            # 7. Jail (0, 30, 5x5) -> -2 to 2, 28 to 32
-            if -2 <= x <= 2 and 28 <= y <= 32: return "High Security Jail"
-            
-            return "Dungeon Tunnels"
-
-        elif z == 2:
-            return "North Forest"
+        if layer_store.get(sess, x, y, z) is None: return "Void."
         
-        elif z == 4:
-            if x==0 and y==0: return "Frozen Entrance"
-            return "Glacial Cavern"
-
-        return None
+        # 2. Room name from the level's region layer (emitted by LevelBuilder)
+        if not layer_store.has_regions(sess, z):
+            LevelBuilder(sess).build_regions(z) # Level saved before region layers
+        return layer_store.region(sess, x, y, z)
 
     def investigate_room(self):
         """Active Skill: Analyze location for hidden secrets."""
@@ -278,7 +261,7 @@ class DungeonMaster:
         from sqlalchemy.orm.attributes import flag_modified
         
         
-        pl = self.session.query(Player).first()
+        pl = self.player
         skill_bonus = self.get_skill_level("investigation")
         roll = roll_dice(20) + skill_bonus
         
@@ -295,20 +278,13 @@ class DungeonMaster:
         # 1. Scan Tiles - VISIBILITY FLOOD FILL (Radius 6)
         # Instead of simple box, we do a BFS/FloodFill that stops at walls to simulate Line of Sight
         
-        revealed_count = 0
+        seen = []
         queue_pos = [(x, y)]
         visited_bfs = set([(x, y)])
         max_dist = 6
         
         # We need to fetch the local map for efficient checking
-        local_tiles = self.session.query(MapTile).filter(
-            MapTile.x.between(x-6, x+6),
-            MapTile.y.between(y-6, y+6),
-            MapTile.z == z
-        ).all()
-        
-        # Convert to dict for fast lookup
-        tile_map = {(t.x, t.y): t for t in local_tiles}
+        tile_map = layer_store.area(self.session, x-6, y-6, x+6, y+6, z)
         
         idx = 0
         while idx < len(queue_pos):
@@ -321,27 +297,24 @@ class DungeonMaster:
             
             # Reveal this tile
             if (cx, cy) in tile_map:
-                t = tile_map[(cx, cy)]
+                t_type = tile_map[(cx, cy)][0]
                 
-                # REVEAL FOG OF WAR
-                if not t.is_visited:
-                    t.is_visited = True
-                    revealed_count += 1
+                # REVEAL FOG OF WAR (applied below in one go)
+                seen.append((cx, cy))
                 
                 # REVEAL HIDDEN SECRETS (Check Roll)
-                md = t.meta_data or {}
+                md = layer_store.meta(self.session, cx, cy, z)
                 if md.get("hidden"):
                     dc = md.get("dc", 15)
                     if roll >= dc:
                         md["hidden"] = False
                         md["discovered"] = True
-                        t.meta_data = md
-                        flag_modified(t, "meta_data")
+                        layer_store.set_meta(self.session, cx, cy, z, md)
                         found.append(f"Hidden {md.get('interact_name', 'Feature')}")
 
                 # PROPAGATE?
                 # Stop at walls/doors (Vision blockers)
-                if t.tile_type in ["wall", "wall_grey", "wall_house", "void", "door"]:
+                if tile_flags(t_type) & OPAQUE:
                      continue # Don't look past walls
                 
                 # Add neighbors
@@ -353,6 +326,7 @@ class DungeonMaster:
             else:
                 # Void/Unmapped -> treat as wall, stop
                 pass
+        revealed_count = len(layer_store.reveal(self.session, z, seen))
 
         # 2. Scan Objects
         objs = self.session.query(WorldObject).filter_by(z=z).all()
@@ -403,9 +377,18 @@ class DungeonMaster:
         # Legacy fallback or quick look
         return self._generate_description(self.player.x, self.player.y, self.player.z)
 
-    def get_state_dict(self):
+    def get_state_dict(self, since=None, view=None, encoding=None):
+        """
+        Build the state payload.
+        since: world version the client already has -> delta response.
+        view: {"radius": n} or {"bbox": (x0, y0, x1, y1)} -> map limited to that window
+              on the player's level instead of every visited tile on every level.
+        encoding: "rle" -> palette + run-length map (see state_encoding); default "x,y,z" keys.
+        """
         try:
-             return self._get_state_dict_impl()
+             if since is not None:
+                 return self._get_state_delta_impl(since, view, encoding)
+             return self._get_state_dict_impl(view, encoding)
         except Exception as e:
              self.session.rollback() # CRITICAL: Reset session on error!
              import traceback
@@ -413,23 +396,174 @@ class DungeonMaster:
              traceback.print_exc()
              return { "error": str(e) }
 
-    def _get_state_dict_impl(self):
+    def _get_state_dict_impl(self, view=None, encoding=None):
         """Return a JSON-serializable state for the frontend."""
+        version = self.world_version.current
+        
         # Use fresh query to avoid DetachedInstanceError across threads
-        player = self.session.query(Player).first()
+        player = self.player
         if not player: return {} # Should not happen
 
+        window = self._resolve_window(player, view)
+        with metrics.phase("map"):
+            map_data = encode_map(self._state_map(window=window), encoding)
+            visibility = self._state_visibility(player, window) if encoding else None
+            lit = self._state_lit(player) if encoding else None
+        with metrics.phase("monsters"):
+            enemy_list, corpse_list = self._state_monsters(player)
+        with metrics.phase("npcs"):
+            npc_list = self._state_npcs(player)
+        with metrics.phase("combat"):
+            combat_state = self._state_combat()
+        with metrics.phase("secrets"):
+            secrets = self._state_secrets(player)
+        with metrics.phase("player"):
+            player_data = self._state_player(player)
+
+        state = {
+            "version": version,
+            "delta": False,
+            "player": player_data,
+            "world": {
+                "map": map_data,
+                "enemies": enemy_list,
+                "npcs": npc_list,
+                "secrets": secrets
+            },
+            "corpses": corpse_list,
+            "combat": combat_state 
+        }
+        if visibility:
+            state["world"]["visibility"] = visibility
+            state["world"]["lit"] = lit
+        return state
+
+    def _get_state_delta_impl(self, since, view=None, encoding=None):
+        """Return only what changed after world version `since` (full state if unknown)."""
+        # Read the version BEFORE the change log so anything committed while we build
+        # the delta is re-sent on the next poll rather than lost.
+        version = self.world_version.current
+        changes = self.world_version.changes_since(since)
+        if changes is None:
+            return self._get_state_dict_impl(view, encoding)
+
+        delta = {"version": version, "delta": True, "since": since}
+        if changes.events:
+            delta["events"] = changes.events
+        if not (changes.tiles or changes.sections or changes.player):
+            return delta
+
+        player = self.player
+        if not player: return {}
+        
+        world = {}
+        window = self._resolve_window(player, view)
+        with metrics.phase("map"):
+            if window and "radius" in view and "xyz" in changes.player:
+                # The window follows the player: resend what is now on screen
+                world["map"] = encode_map(self._state_map(window=window), encoding)
+            elif changes.tiles:
+                world["map"] = encode_map(self._state_map(changes.tiles, window=window), encoding)
+            if "map" in world and encoding:
+                world["visibility"] = self._state_visibility(player, window)
+            if encoding and ("map" in world or "xyz" in changes.player):
+                world["lit"] = self._state_lit(player)
+
+        if changes.sections & {"enemies", "corpses"}:
+            with metrics.phase("monsters"):
+                enemy_list, corpse_list = self._state_monsters(player)
+            world["enemies"] = enemy_list
+            delta["corpses"] = corpse_list
+
+        # Quest markers depend on the player's quests, bag and level too
+        if "npcs" in changes.sections or "inventory" in changes.sections or changes.player & {"quest_state", "level"}:
+            with metrics.phase("npcs"):
+                world["npcs"] = self._state_npcs(player)
+
+        if "secrets" in changes.sections or "xyz" in changes.player:
+            with metrics.phase("secrets"):
+                world["secrets"] = self._state_secrets(player)
+
+        if "combat" in changes.sections:
+            with metrics.phase("combat"):
+                delta["combat"] = self._state_combat()
+
+        if world:
+            delta["world"] = world
+
+        if changes.player or "inventory" in changes.sections:
+            with metrics.phase("player"):
+                full_player = self._state_player(player)
+            fields = set(changes.player)
+            if "quest_state" in fields: fields.add("quest_log")
+            if "inventory" in changes.sections: fields.add("inventory")
+            delta["player"] = {k: v for k, v in full_player.items() if k in fields}
+            
+        return delta
+
+    def _resolve_window(self, player, view):
+        """Turn a view request into a (z, x0, y0, x1, y1) window on the player's level."""
+        if not view:
+            return None
+        if view.get("bbox"):
+            x0, y0, x1, y1 = view["bbox"]
+            return (player.z, min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        
+        radius = view.get("radius") or STATE_VIEWPORT_CONFIG["default_radius"]
+        radius = max(1, min(int(radius), STATE_VIEWPORT_CONFIG["max_radius"]))
+        return (player.z, player.x - radius, player.y - radius, player.x + radius, player.y + radius)
+
+    def _state_map(self, keys=None, window=None):
+        """
+        Visited tiles as {(x, y, z): tile_type}; encode_map turns this into the payload.
+        keys: only those tiles (None value = tile removed).
+        window: (z, x0, y0, x1, y1) bounds, cut out of the in-memory layer.
+        """
+        if keys is None:
+            if window:
+                boxes = [window]
+            else:
+                boxes = [(z,) + layer_store.bounds(self.session, z) for z in layer_store.levels(self.session)]
+            map_data = {}
+            for z, x0, y0, x1, y1 in boxes:
+                for (x, y), (tile_type, visited) in layer_store.area(self.session, x0, y0, x1, y1, z).items():
+                    if visited:
+                        map_data[(x, y, z)] = tile_type
+            return map_data
+
+        if window:
+            wz, x0, y0, x1, y1 = window
+            keys = [(x, y, z) for (x, y, z) in keys if z == wz and x0 <= x <= x1 and y0 <= y <= y1]
+
         map_data = {}
-        px, py, pz = player.x, player.y, player.z
-        
-        # 1. Fetch visible tiles
-        try:
-             visited_tiles = self.session.query(MapTile).filter_by(is_visited=True).all()
-        except:
-             self.session.rollback()
-             visited_tiles = self.session.query(MapTile).filter_by(is_visited=True).all()
-             
-        map_data = {f"{t.x},{t.y},{t.z}": t.tile_type for t in visited_tiles}
+        for (x, y, z) in keys:
+            tile_type = layer_store.get(self.session, x, y, z)
+            if tile_type is None:
+                map_data[(x, y, z)] = None
+            elif layer_store.is_visited(self.session, x, y, z):
+                map_data[(x, y, z)] = tile_type
+            # else: still under fog, nothing to send
+        return map_data
+
+    def _state_visibility(self, player, window=None):
+        """Fog-of-war bitmask for the window (whole level without one)."""
+        if window:
+            z, x0, y0, x1, y1 = window
+        else:
+            z = player.z
+            x0, y0, x1, y1 = layer_store.bounds(self.session, z)
+        return encode_visibility(z, x0, y0, x1, y1, layer_store.visibility(self.session, x0, y0, x1, y1, z))
+
+    def _state_lit(self, player):
+        """Cells the player can see right now (line of sight), as a bitmask like the fog of war."""
+        r = FOV_CONFIG["radius"]
+        x0, y0, x1, y1 = player.x - r, player.y - r, player.x + r, player.y + r
+        lit = field_of_view(layer_store.grid(self.session, player.z), player.x, player.y)
+        return encode_visibility(player.z, x0, y0, x1, y1, lit_mask(lit, x0, y0, x1, y1))
+
+    def _state_monsters(self, player):
+        """Live enemies and lootable corpses on the player's level."""
+        pz = player.z
         
         # Enemies
         try:
@@ -445,81 +579,32 @@ class DungeonMaster:
             else:
                  enemy_list.append({"xyz": [m.x, m.y, m.z], "hp": m.hp_current, "max_hp": m.hp_max, "name": m.name, "id": m.id, "state": "idle", "level": m.level or 1})
 
-        # Corpses
+        # Corpses (empty ones are skipped here and purged by the maintenance worker)
         corpses = self.session.query(Monster).filter_by(is_alive=False, z=pz).all()
         corpse_list = []
-        corpses_to_delete = []
         
         for m in corpses:
-             # Check if loot is effectively empty
-             has_loot = False
-             if m.loot and len(m.loot) > 0:
-                 has_loot = True
-             
-             if has_loot:
+             if m.loot:
                  corpse_list.append({"xyz": [m.x, m.y, m.z], "name": f"Dead {m.name}", "id": m.id})
-             else:
-                 corpses_to_delete.append(m)
-        
-        # Cleanup empty corpses so they don't linger on map
-        if corpses_to_delete:
-            for c in corpses_to_delete:
-                self.session.delete(c)
-            self.session.commit()
 
-        from .quests import QuestManager, QUEST_DATABASE
-        qm = QuestManager(self.session, player)
+        return enemy_list, corpse_list
 
-        # NPCs
-        npcs = self.session.query(NPC).filter(NPC.x != None, NPC.z == pz).all()
+    def _state_npcs(self, player):
+        """NPCs on the player's level with their quest indicator."""
+        from .quests import QuestManager
+        statuses = self._quest_statuses()
+        qm = None
+
+        npcs = self.session.query(NPC).filter(NPC.x != None, NPC.z == player.z).all()
         npc_list = []
         for n in npcs:
             img = n.asset or "player.png"
             
-            # Quest Indicator Logic
-            q_status = "none"
-            # 1. Check for Turn Ins
-            for qid, q_data in QUEST_DATABASE.items():
-                if q_data.get("giver") in n.name: # Flexible Match
-                    # Is it active?
-                    status = qm.get_status(qid)
-                    if status == "active":
-                        if qm.can_complete(qid):
-                            q_status = "turn_in"
-                            break
-            
-            # 2. Check for New Quests (only if no turn in found)
-            if q_status == "none":
-                 for qid, q_data in QUEST_DATABASE.items():
-                    if q_data.get("giver") in n.name:
-                        status = qm.get_status(qid)
-                        if status == "available":
-                            # Check Requirements if defined in QUEST_DATABASE
-                            reqs = q_data.get("requirements", {})
-                            blocked = False
-                            
-                            # Level Check
-                            if "min_level" in reqs and self.player.level < reqs["min_level"]: blocked = True
-                            
-                            # Prerequisite Quest Check (Custom logic needed as it's not standard in DB yet?)
-                            # Actually let's just check the "active" list vs specific logic
-                            if qid == "titanium_hunt":
-                                # Gareth's second quest requires Iron Supply done
-                                if "iron_supply" not in self.player.quest_state.get("completed", []):
-                                    blocked = True
-                            
-                            if qid == "elemental_reagents":
-                                # Seraphina's second quest requires Herbal Remedy done
-                                if "herbal_remedy" not in self.player.quest_state.get("completed", []):
-                                    blocked = True
-
-                            if not blocked:
-                                 q_status = "available"
-                                 break
-            
-            # DEBUG
-            if q_status != "none":
-                print(f"DEBUG: NPC {n.name} has quest status: {q_status}")
+            # Quest Indicator (cached per NPC until quests/inventory/level change)
+            q_status = statuses.get(n.name)
+            if q_status is None:
+                if qm is None: qm = QuestManager(self.session, player)
+                q_status = statuses[n.name] = qm.indicator_for(n.name)
 
             npc_list.append({
                 "xyz": [n.x, n.y, n.z], 
@@ -528,10 +613,26 @@ class DungeonMaster:
                 "asset": img,
                 "quest_status": q_status 
             })
-            
-        # Check actual combat state
-        from .database import CombatEncounter
-        active_enc = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+        return npc_list
+
+    def _quest_statuses(self):
+        """NPC name -> quest indicator, dropped whenever an input of the indicator changed."""
+        version = self.world_version.current
+        if self._quest_status_version is not None:
+            changes = self.world_version.changes_since(self._quest_status_version)
+            if changes is None or "inventory" in changes.sections or changes.player & {"quest_state", "level"}:
+                self._quest_status_cache = {}
+        self._quest_status_version = version
+        return self._quest_status_cache
+
+    def ai_turn_pending(self):
+        """Whether the active encounter waits on a monster/NPC turn (which _state_combat's failsafe runs)."""
+        encounter = game_context(self.session).encounter
+        return encounter is not None and encounter.turn_order[encounter.current_turn_index]["type"] != "player"
+
+    def _state_combat(self):
+        """Active encounter summary (runs the stuck-AI-turn failsafe)."""
+        active_enc = game_context(self.session).encounter
         
         combat_state = {"active": False}
         
@@ -543,7 +644,6 @@ class DungeonMaster:
             # it means the Turn Processor failed to auto-continue previously.
             # We force it to run now to unblock the UI.
             if current_actor["type"] != "player":
-                print(f"DEBUG: Found stuck AI turn ({current_actor['name']}). Forcing Turn Process.")
                 try:
                     self.combat._process_turn_queue(active_enc)
                     # Refresh active_enc state after processing
@@ -569,26 +669,22 @@ class DungeonMaster:
                     "actions_left": active_enc.actions_left,
                     "bonus_actions_left": active_enc.bonus_actions_left
                 }
+        return combat_state
 
-        # Interactables (Generic)
+    def _state_secrets(self, player):
+        """Interactables next to the player plus visible world objects on the level."""
         secrets = []
         
         # 1. Fetch nearby tiles
-        # 1. Fetch nearby tiles
-        nearby_tiles = self.session.query(MapTile).filter(
-            MapTile.x.between(player.x - 1, player.x + 1),
-            MapTile.y.between(player.y - 1, player.y + 1),
-            MapTile.z == player.z
-        ).all()
+        nearby_tiles = layer_store.area(self.session, player.x - 1, player.y - 1, player.x + 1, player.y + 1, player.z)
         
         # 2. Check for Interactables
-        for t in nearby_tiles:
+        for (tx, ty), (tile_type, _) in nearby_tiles.items():
+            md = layer_store.meta(self.session, tx, ty, player.z)
             # Legacy/Hardcoded fix for our secret door at (2, 30)
-            if t.x == 2 and t.y == 30 and not t.meta_data:
-                 t.meta_data = {"interactable": True, "interact_name": "Suspicious Wall", "secret_id": "secret_door_1", "hidden": True}
-                 flag_modified(t, "meta_data") # Save it
-            
-            md = t.meta_data or {}
+            if tx == 2 and ty == 30 and not md:
+                 md = {"interactable": True, "interact_name": "Suspicious Wall", "secret_id": "secret_door_1", "hidden": True}
+                 layer_store.set_meta(self.session, tx, ty, player.z, md) # Save it
             
             if md.get("interactable"):
                 # If it's hidden and not discovered, skip
@@ -596,11 +692,11 @@ class DungeonMaster:
                     continue
                 
                 # If it's a secret door and already open, skip
-                if md.get("secret_id") and t.tile_type == "door":
+                if md.get("secret_id") and tile_type == "door":
                     continue
                 
                 secrets.append({
-                    "id": md.get("secret_id") or f"tile_{t.x}_{t.y}",
+                    "id": md.get("secret_id") or f"tile_{tx}_{ty}",
                     "name": md.get("interact_name", "Interesting Object"),
                     "type": "secret" 
                 })
@@ -626,7 +722,10 @@ class DungeonMaster:
                  "obj_type": o.obj_type,
                  "xyz": [o.x, o.y, o.z]
              })
+        return secrets
 
+    def _state_player(self, player):
+        """The "player" block of the state payload."""
         # Prepare Quest Log for Frontend
         quest_log = []
         try:
@@ -635,13 +734,7 @@ class DungeonMaster:
             
             # 1. New Dictionary System
             active_q = qs.get("active", {})
-            with open("debug_quest_log.txt", "w") as f:
-                 f.write(f"Active: {active_q}\n")
-                 f.write(f"DB Keys: {list(QUEST_DATABASE.keys())}\n")
-            
             if isinstance(active_q, dict):
-
-
                 for qid in active_q:
                     if qid in QUEST_DATABASE:
                         quest_log.append({
@@ -653,55 +746,32 @@ class DungeonMaster:
                     else:
                         quest_log.append({"title": qid, "status": "active"}) # Fallback
 
-            # 2. Legacy List System (Migration/Compat)
-            legacy_q = qs.get("active_quests", [])
-            if isinstance(legacy_q, list):
-                for q_title in legacy_q:
-                    quest_log.append({
-                        "title": q_title,
-                        "description": "Active Quest (Legacy)",
-                        "status": "active"
-                    })
-                    
         except Exception as e:
             print(f"Quest Log Error state: {e}")
 
-
-
-
         return {
-            "player": {
-                "xyz": [player.x, player.y, player.z],
-                "stats": player.stats,
-                "skills": player.skills or {},
-                "hp": player.hp_current,
-                "max_hp": player.hp_max,
-                "level": player.level or 1,
-                "xp": player.xp or 0,
-                "gold": player.gold or 0,
-                "quest_state": player.quest_state or {},
-                "quest_log": quest_log, # NEW friendliness
-                "inventory": [
-                    {
-                        "id": i.id,
-                        "name": i.name,
-                        "slot": i.slot,
-                        "is_equipped": i.is_equipped, 
-                        "properties": i.properties,
-                        "item_type": i.item_type,
-                        "quantity": i.quantity
-                    } 
-                    for i in player.inventory if i
-                ]
-            },
-            "world": {
-                "map": map_data,
-                "enemies": enemy_list,
-                "npcs": npc_list,
-                "secrets": secrets
-            },
-            "corpses": corpse_list,
-            "combat": combat_state 
+            "xyz": [player.x, player.y, player.z],
+            "stats": player.stats,
+            "skills": player.skills or {},
+            "hp": player.hp_current,
+            "max_hp": player.hp_max,
+            "level": player.level or 1,
+            "xp": player.xp or 0,
+            "gold": player.gold or 0,
+            "quest_state": player.quest_state or {},
+            "quest_log": quest_log, # NEW friendliness
+            "inventory": [
+                {
+                    "id": i.id,
+                    "name": i.name,
+                    "slot": i.slot,
+                    "is_equipped": i.is_equipped, 
+                    "properties": i.properties,
+                    "item_type": i.item_type,
+                    "quantity": i.quantity
+                } 
+                for i in player.inventory if i
+            ]
         }
 
     def player_interact(self, action, target_type, target_index):
@@ -724,11 +794,10 @@ class DungeonMaster:
 
     def upgrade_stat(self, stat_name):
         """Spend a point to upgrade a stat."""
-        from sqlalchemy.orm.attributes import flag_modified
+        from .database import ABILITIES
         
-        pl = self.session.query(Player).first()
-        stats = dict(pl.stats or {})
-        points = stats.get('unspent_points', 0)
+        pl = self.player
+        points = pl.unspent_points or 0
         
         if points <= 0: return "No points available."
         
@@ -741,12 +810,10 @@ class DungeonMaster:
         if s_lower == 'intelligence': s_lower = 'int'
         if s_lower == 'constitution': s_lower = 'con'
         
-        current = stats.get(s_lower, 10)
-        stats[s_lower] = current + 1
-        stats['unspent_points'] = points - 1
-        
-        pl.stats = stats
-        flag_modified(pl, "stats")
+        column = ABILITIES.get(s_lower)
+        if column is None: return f"Unknown stat: {stat_name}."
+        setattr(pl, column, (getattr(pl, column) or 10) + 1)
+        pl.unspent_points = points - 1
         self.session.commit()
         
         if s_lower == 'con':
@@ -759,18 +826,18 @@ class DungeonMaster:
         inv_sys.recalculate_stats(pl)
         self.session.commit()
             
-        return f"Upgraded {s_lower.upper()} to {stats[s_lower]}."
+        return f"Upgraded {s_lower.upper()} to {getattr(pl, column)}."
 
     def choose_skill(self, skill_id):
         """Learn a level-up feat."""
-        from sqlalchemy.orm.attributes import flag_modified
+        from .database import PlayerSkill
         
         valid_skills = ["cleave", "heavy_strike", "kick", "rage"]
         if skill_id not in valid_skills:
             return "Invalid skill."
             
-        pl = self.session.query(Player).first()
-        current_skills = dict(pl.skills or {})
+        pl = self.player
+        current_skills = pl.skill_rows
         
         # 1. Check Capacity (1 feat per 4 levels)
         allowed_feats = pl.level // 4
@@ -788,9 +855,7 @@ class DungeonMaster:
             return "You already know this skill."
             
         # 3. Learn
-        current_skills[skill_id] = 1 # Tier 1
-        pl.skills = current_skills
-        flag_modified(pl, "skills")
+        current_skills[skill_id] = PlayerSkill(skill=skill_id, level=1, xp=0) # Tier 1
         self.session.commit()
         return f"You learned {skill_id.replace('_', ' ').title()}!"
 
@@ -799,7 +864,7 @@ class DungeonMaster:
         from sqlalchemy.orm.attributes import flag_modified
         from .database import InventoryItem
         
-        pl = self.session.query(Player).first()
+        pl = self.player
         if not pl: return "Error: No player."
         
         # Find item
@@ -842,7 +907,7 @@ class DungeonMaster:
         from .items import ITEM_TEMPLATES
         from .database import InventoryItem
         
-        pl = self.session.query(Player).first()
+        pl = self.player
         
         tmpl = ITEM_TEMPLATES.get(template_id)
         if not tmpl: return "Item unavailable."
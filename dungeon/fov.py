@@ -0,0 +1,84 @@
+"""
+Field of View.
+Recursive shadowcasting over a level's TileGrid (tiles.py): eight octants are scanned row
+by row outward from the viewer, and every opaque cell casts a shadow that later rows skip.
+Opaque cells themselves are seen, so walls show up around a lit room.
+
+Results are memoized per (grid, position, radius). A TileGrid is a snapshot that the
+layer store replaces whenever the level's tiles change, so the grid doubles as the level
+version and old entries simply age out of the LRU.
+
+    lit = field_of_view(layer_store.grid(session, z), x, y)
+"""
+from functools import lru_cache
+
+from .gamedata import FOV_CONFIG
+from .tiles import OPAQUE, NO_TILE
+
+# (xx, xy, yx, yy): maps octant-local (col, row) to a grid offset
+_OCTANTS = [
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1),
+]
+
+
+def field_of_view(grid, x, y, radius=None):
+    """Frozenset of the (x, y) cells visible from (x, y) within `radius`, including (x, y)."""
+    return _field_of_view(grid, x, y, FOV_CONFIG["radius"] if radius is None else radius)
+
+
+@lru_cache(maxsize=FOV_CONFIG["cache_size"])
+def _field_of_view(grid, x, y, radius):
+    lit = {(x, y)}
+    for octant in _OCTANTS:
+        _cast(grid, x, y, radius, 1, 1.0, 0.0, octant, lit)
+    return frozenset(lit)
+
+
+def _cast(grid, cx, cy, radius, row, start, end, octant, lit):
+    """Scan rows `row`..radius of one octant between slopes start > end."""
+    if start < end:
+        return
+    xx, xy, yx, yy = octant
+    flags, x0, y0, width, height = grid.flags, grid.x0, grid.y0, grid.width, grid.height
+    r2 = radius * radius
+    for j in range(row, radius + 1):
+        blocked = False
+        next_start = start
+        dy = -j
+        for dx in range(-j, 1):
+            left, right = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+            if start < right:
+                continue
+            if end > left:
+                break
+            x, y = cx + dx * xx + dy * xy, cy + dx * yx + dy * yy
+            if dx * dx + dy * dy <= r2:
+                lit.add((x, y))
+            if 0 <= x - x0 < width and 0 <= y - y0 < height:
+                opaque = flags[(y - y0) * width + (x - x0)] & OPAQUE
+            else:
+                opaque = NO_TILE & OPAQUE # Off the map: solid rock
+            if blocked:
+                if opaque:
+                    next_start = right
+                    continue
+                blocked = False
+                start = next_start
+            elif opaque and j < radius:
+                # This cell starts a shadow: scan the part of the next rows still in view
+                blocked = True
+                _cast(grid, cx, cy, radius, j + 1, start, left, octant, lit)
+                next_start = right
+        if blocked:
+            return
+
+
+def lit_mask(lit, x0, y0, x1, y1):
+    """Lit cells inside the window as little-endian bitset bytes (the layout of LayerStore.visibility)."""
+    w = x1 - x0 + 1
+    bits = 0
+    for x, y in lit:
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            bits |= 1 << ((y - y0) * w + (x - x0))
+    return bits.to_bytes((w * (y1 - y0 + 1) + 7) // 8, "little")
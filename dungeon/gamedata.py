@@ -103,6 +103,49 @@ NPC_START_CONFIG = {
     "Elder": {"x": 0, "y": 7, "z": 1, "asset": "elder.png"}
 }
 
+# /api/state viewport mode: tiles within `radius` of the player on the current level
+STATE_VIEWPORT_CONFIG = {
+    "default_radius": 16,
+    "max_radius": 64,
+    "rle_chunk_size": 32 # Tiles per side of a chunk in map_encoding=rle payloads
+}
+
+# Player sight (see fov.py): shadowcasting radius in tiles, memoized fields of view
+FOV_CONFIG = {
+    "radius": 5,
+    "cache_size": 4096
+}
+
+# Chase AI (see distance.py): memoized step-distance maps towards the player (or a target)
+DISTANCE_CONFIG = {
+    "radius": 16,     # Cells around the target a map covers
+    "cache_size": 64
+}
+
+# Click-to-move (see pathing.py): a /api/move target is walked along an A* route
+PATH_CONFIG = {
+    "max_steps": 40,    # Longest route walked in one request
+    "max_nodes": 4000,  # Cells A* may expand before giving up
+    "detour_cost": 8    # Stepping onto a hazard or an interactable tile costs this many plain steps
+}
+
+METRICS_CONFIG = {
+    "slow_request_ms": 250, # Requests slower than this are logged and kept for /api/debug/metrics
+    "slow_history": 50
+}
+
+MAINTENANCE_CONFIG = {
+    "interval_seconds": 30,      # Background purge period (see maintenance.py)
+    "batch_size": 200,           # Monster rows deleted per transaction
+    "max_corpses_per_level": 25  # Older unlooted corpses beyond this are purged
+}
+
+GAME_HOSTING_CONFIG = {
+    "max_loaded_games": 16,  # DungeonMasters kept in memory (LRU, see games.py)
+    "cookie": "game_id",     # Request -> game: ?game=<id>, else this cookie, else the default game
+    "id_pattern": r"^[A-Za-z0-9_-]{1,64}$"
+}
+
 PLAYER_START_CONFIG = {
     "name": "Generic Hero",
     "hp_current": 20,
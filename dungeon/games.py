@@ -0,0 +1,159 @@
+"""
+Game Hosting.
+One server process can host many independent games (saves). Every game-owned row carries a
+`game_id` (GameScoped in database.py) and a game's DungeonMaster works on sessions tagged
+with its id (`game_session()`). The session hooks below keep those sessions inside their
+game, so no subsystem filters by hand:
+- every ORM SELECT and bulk UPDATE/DELETE gets a `game_id = <id>` criteria
+- new rows are stamped with the session's game on flush
+Untagged sessions (tools/, the maintenance worker) still see every game.
+
+Where a game's rows live is up to `database.engine_for()`: the shared database, or the
+game's own save file when DUNGEON_SAVE_DIR is set. A game session leases its save file's
+engine for its lifetime, so the file is not closed under it; `remove()` returns the lease.
+
+Loaded games are kept in a bounded LRU (`GameRegistry`). Evicting one drops its
+DungeonMaster, its cached map layers and its version log; its rows stay in the database and
+the game loads again on its next request.
+"""
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, with_loader_criteria
+
+from . import database
+from .database import SessionFactory, GameScoped, DEFAULT_GAME
+from .gamedata import GAME_HOSTING_CONFIG
+from .layers import layer_store
+from .occupancy import occupancy
+from .versioning import world_versions
+
+_VALID_ID = re.compile(GAME_HOSTING_CONFIG["id_pattern"])
+
+
+def game_session(game_id):
+    """
+    Thread-local session registry (like SessionLocal) whose sessions only see `game_id`.
+    Sessions live for one request and keep what they loaded across its commits (see context.py).
+    """
+    return GameSessions(lambda: _open_session(game_id))
+
+
+def _open_session(game_id):
+    info = {"game_id": game_id}
+    saves = database.save_engines
+    if saves is not None:
+        bind = saves.acquire(game_id)
+        info["save_lease"] = (saves, bind)
+    else:
+        bind = database.engine_for(game_id)
+    return SessionFactory(bind=bind, info=info, expire_on_commit=False)
+
+
+class GameSessions(scoped_session):
+    """scoped_session that returns the session's save file lease when the session is removed."""
+
+    def remove(self):
+        lease = self.registry().info.pop("save_lease", None) if self.registry.has() else None
+        super().remove()
+        if lease is not None:
+            saves, bind = lease
+            saves.release(bind)
+
+
+def valid_game_id(game_id):
+    return bool(game_id) and bool(_VALID_ID.match(game_id))
+
+
+class GameRegistry:
+    def __init__(self, capacity=None):
+        self.capacity = capacity or GAME_HOSTING_CONFIG["max_loaded_games"]
+        self._lock = threading.Lock()
+        self._games = OrderedDict() # game_id -> DungeonMaster, least recently used first
+        self._loading = {}          # game_id -> Lock held while that game loads
+
+    def get(self, game_id=DEFAULT_GAME):
+        """The game's DungeonMaster, loading (or creating) the game on first use."""
+        with self._lock:
+            dm = self._touch(game_id)
+            if dm is not None:
+                return dm
+            loading = self._loading.setdefault(game_id, threading.Lock())
+
+        with loading: # Only requests for this game wait for it to load
+            with self._lock:
+                dm = self._touch(game_id)
+                if dm is not None:
+                    return dm
+            from .dm import DungeonMaster
+            try:
+                dm = DungeonMaster(game_id)
+            finally:
+                with self._lock:
+                    self._loading.pop(game_id, None)
+
+            with self._lock:
+                self._games[game_id] = dm
+                evicted = []
+                while len(self._games) > self.capacity:
+                    evicted.append(self._games.popitem(last=False))
+        for old_id, old_dm in evicted:
+            self._unload(old_id, old_dm)
+        return dm
+
+    def new_game(self):
+        """Start a fresh game under a new id. Returns (game_id, DungeonMaster)."""
+        game_id = uuid.uuid4().hex
+        return game_id, self.get(game_id)
+
+    def loaded(self):
+        """Loaded game ids, most recently used last."""
+        with self._lock:
+            return list(self._games)
+
+    def unload(self, game_id):
+        with self._lock:
+            dm = self._games.pop(game_id, None)
+        if dm is not None:
+            self._unload(game_id, dm)
+
+    def _touch(self, game_id):
+        dm = self._games.get(game_id)
+        if dm is not None:
+            self._games.move_to_end(game_id)
+        return dm
+
+    def _unload(self, game_id, dm):
+        print(f"Games: Unloading '{game_id}'.")
+        dm.session.remove() # This thread's session; those still open on other threads keep their lease
+        world_versions.drop(game_id) # Wakes the game's streams, which end and release their sessions
+        layer_store.evict_game(game_id)
+        occupancy.evict_game(game_id)
+        if database.save_engines is not None:
+            database.save_engines.close(game_id) # Disposed once the last leased session is removed
+
+
+# --- Session Hooks ---
+
+@event.listens_for(SessionFactory, "do_orm_execute")
+def _scope_to_game(state):
+    game_id = state.session.info.get("game_id")
+    if game_id is None or state.is_column_load or state.is_relationship_load:
+        return # Relationship/column loads inherit the criteria of the query that loaded the parent
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(with_loader_criteria(
+            GameScoped, lambda cls: cls.game_id == game_id, include_aliases=True
+        ))
+
+
+@event.listens_for(SessionFactory, "before_flush")
+def _stamp_new_rows(session, flush_context, instances):
+    game_id = session.info.get("game_id")
+    if game_id is None:
+        return
+    for obj in session.new:
+        if isinstance(obj, GameScoped) and obj.game_id is None:
+            obj.game_id = game_id
@@ -1,15 +1,133 @@
 import json
 import os
 import random
-from .database import MapTile, Monster, NPC, InventoryItem, WorldObject
+from .database import Monster, NPC, InventoryItem, WorldObject
 from sqlalchemy.orm.attributes import flag_modified
 from .rules import roll_dice
+from .layers import layer_store
+from .tiles import WALKABLE
+
+# Tutorial Dungeon (Z=0) layout. Rooms: (name, cx, cy, w, h) centered rects.
+# Corridors: (name, x1, y1, x2, y2) straight runs; unnamed ones belong to the tunnels.
+TUTORIAL_ROOMS = [
+    ("Dungeon Entrance", 0, 0, 3, 3),
+    ("Grand Hall", 0, 11, 7, 5),
+    ("Old Armory", -10, 11, 5, 5),
+    ("Dusty Library", 10, 11, 5, 5),
+    ("Guard Barracks", 0, 20, 9, 5),    # Wide
+    ("High Security Jail", 0, 30, 5, 5), # Boss/Jail Room
+]
+TUTORIAL_CORRIDORS = [
+    ("Dark Corridor", 0, 2, 0, 8), # Main Corridor North
+    (None, -3, 11, -8, 11),        # Hallway West (Armory)
+    (None, 3, 11, 8, 11),          # Hallway East (Library)
+    (None, 0, 14, 0, 18),          # North to Barracks
+    (None, 0, 23, 0, 28),          # Final Corridor to Jail
+]
+
+# Oakhaven (Z=1) buildings: (name, x, y, w, h, door)
+TOWN_STRUCTURES = [
+    ("Town Hall", -4, 4, 9, 7, (0, 4)),
+    ("The Smithy", 8, 6, 8, 7, (8, 9)),
+    ("Alchemist's Shop", -14, 6, 7, 7, (-8, 9)),
+]
+
+
+def _rect(x0, y0, x1, y1):
+    return [(x, y) for x in range(min(x0, x1), max(x0, x1) + 1) for y in range(min(y0, y1), max(y0, y1) + 1)]
+
 
 class LevelBuilder:
     def __init__(self, session):
         self.session = session
         self.floors = set()
         self.walls = set()
+        # Tiles are buffered per level and stored as one packed layer row (see layers.py)
+        self._tiles = {} # z -> [(x, y, tile_type, is_visited, meta_data)]
+        # Region layer emitted alongside the tiles (room naming)
+        self._regions = {} # z -> [default name, [(name, cells)]]
+
+    def _add_tile(self, x, y, z, tile_type, is_visited=False, meta_data=None):
+        self._tiles.setdefault(z, []).append((x, y, tile_type, is_visited, meta_data))
+
+    def _add_region(self, z, name, cells=None):
+        """Name an area of level z (the first area listing a cell wins); no cells = name the rest of the level."""
+        region = self._regions.setdefault(z, [None, []])
+        if cells is None:
+            region[0] = name
+        else:
+            region[1].append((name, list(cells)))
+
+    def _add_caves(self, z, floors):
+        """
+        Name the connected (4-way) areas of `floors` that no earlier region claimed. The largest
+        keeps the level's default name; every other one becomes a region
+        "<default> - Side Cave <n>", numbered from the largest down.
+        """
+        name, regions = self._regions.setdefault(z, [None, []])
+        seen = {c for _, cells in regions for c in cells}
+        floors = set(floors)
+        caves = []
+        for start in sorted(floors):
+            if start in seen:
+                continue
+            seen.add(start)
+            cave, queue = [], [start]
+            while queue:
+                cx, cy = queue.pop()
+                cave.append((cx, cy))
+                for dx, dy in [(0,1), (0,-1), (1,0), (-1,0)]:
+                    n = (cx+dx, cy+dy)
+                    if n in floors and n not in seen:
+                        seen.add(n)
+                        queue.append(n)
+            caves.append(cave)
+        caves.sort(key=len, reverse=True)
+        for n, cave in enumerate(caves[1:], 1):
+            self._add_region(z, f"{name} - Side Cave {n}", cave)
+
+    def _flush_tiles(self):
+        """Swap the buffered levels (and their regions) into the layer store; written on the next commit."""
+        levels, self._tiles = self._tiles, {}
+        regions, self._regions = self._regions, {}
+        for z, tiles in levels.items():
+            layer_store.replace_level(self.session, z, tiles, regions.get(z))
+
+    def build_regions(self, z):
+        """Region layer for a level saved before levels had one, derived from its tiles."""
+        grid = layer_store.grid(self.session, z)
+        floors = [(grid.x0 + i % grid.width, grid.y0 + i // grid.width)
+                  for i, flags in enumerate(grid.flags) if flags & WALKABLE]
+        if z == 0: self._tutorial_regions(z)
+        elif z == 1: self._town_regions(z)
+        elif z == 2: self._add_region(z, "North Forest")
+        elif z == 3: self._fire_regions(z, floors)
+        elif z == 4: self._ice_regions(z, floors)
+        default, areas = self._regions.pop(z, [None, []])
+        layer_store.set_regions(self.session, z, default, areas)
+
+    def _tutorial_regions(self, z):
+        self._add_region(z, "Dungeon Tunnels")
+        for name, cx, cy, w, h in TUTORIAL_ROOMS:
+            self._add_region(z, name, _rect(cx - w//2, cy - h//2, cx + w//2, cy + h//2))
+        for name, x1, y1, x2, y2 in TUTORIAL_CORRIDORS:
+            if name:
+                self._add_region(z, name, _rect(x1, y1, x2, y2))
+
+    def _town_regions(self, z):
+        self._add_region(z, "Wilderness")
+        for name, x, y, w, h, _ in TOWN_STRUCTURES:
+            self._add_region(z, name, _rect(x, y, x + w - 1, y + h - 1))
+        self._add_region(z, "Town Square", _rect(-20, -20, 20, 20))
+
+    def _fire_regions(self, z, floors):
+        self._add_region(z, "Volcanic Depths")
+        self._add_caves(z, floors)
+
+    def _ice_regions(self, z, floors):
+        self._add_region(z, "Glacial Cavern")
+        self._add_region(z, "Frozen Entrance", [(0, 0)])
+        self._add_caves(z, floors)
 
     def _get_level_for_z(self, z):
         """Returns a random level appropriate for the zone depth."""
@@ -34,13 +152,8 @@ class LevelBuilder:
         monster.hp_current = monster.hp_max
         
         # Scale Stats
-        stats = dict(monster.stats or {"str": 10, "dex": 10, "int": 10})
         bonus_stat = (level - 1) // 2 # +1 for every 2 levels
-        
-        for k in stats:
-            stats[k] += bonus_stat
-            
-        monster.stats = stats
+        monster.stats = {k: v + bonus_stat for k, v in monster.stats.items()}
         
         # AC Scaling (lighter)
         monster.armor_class = (monster.armor_class or 10) + ((level - 1) // 3)
@@ -93,30 +206,12 @@ class LevelBuilder:
             for x in range(min(x1, x2), max(x1, x2) + 1):
                 self.floors.add((x, y))
 
-        # 1. Start Room (3x3 at 0,0)
-        add_rect(0, 0, 3, 3)
-        
-        # 2. Main Corridor North (0,2 to 0,8)
-        add_corridor_v(0, 2, 8)
-        
-        # 3. The Grand Hall (7x5 at 0, 11)
-        add_rect(0, 11, 7, 5)
-        
-        # 4. West Wing: Armory (Connected via corridor)
-        add_corridor_h(11, -3, -8)  # Hallway West
-        add_rect(-10, 11, 5, 5)     # Armory Room
-        
-        # 5. East Wing: Library
-        add_corridor_h(11, 3, 8)    # Hallway East
-        add_rect(10, 11, 5, 5)      # Library Room
-        
-        # 6. North to Barracks
-        add_corridor_v(0, 14, 18)
-        add_rect(0, 20, 9, 5)       # Barracks (Wide)
-        
-        # 7. Final Corridor to Jail
-        add_corridor_v(0, 23, 28)
-        add_rect(0, 30, 5, 5)       # Boss/Jail Room
+        # 1-7. Rooms (Start Room, Grand Hall, Armory, Library, Barracks, Jail) & Corridors
+        for _, cx, cy, w, h in TUTORIAL_ROOMS:
+            add_rect(cx, cy, w, h)
+        for _, x1, y1, x2, y2 in TUTORIAL_CORRIDORS:
+            if x1 == x2: add_corridor_v(x1, y1, y2)
+            else: add_corridor_h(y1, x1, x2)
 
         # --- Commit Map ---
         # Floors
@@ -124,7 +219,7 @@ class LevelBuilder:
             t_type = "floor"
             if random.random() < 0.05:
                 t_type = "rock"
-            self.session.add(MapTile(x=x, y=y, z=0, tile_type=t_type, is_visited=False))
+            self._add_tile(x, y, 0, t_type)
 
         # Walls (Perimeter)
         # Identify walls by checking neighbors of floors
@@ -136,7 +231,9 @@ class LevelBuilder:
                         self.walls.add((nx, ny))
         
         for (x, y) in self.walls:
-            self.session.add(MapTile(x=x, y=y, z=0, tile_type="wall", is_visited=False))
+            self._add_tile(x, y, 0, "wall")
+        self._tutorial_regions(0)
+        self._flush_tiles()
         
         # --- Populate Enemies (Total: 9 Skeletons + 1 Boss) ---
         enemies = [
@@ -206,7 +303,7 @@ class LevelBuilder:
                     if i == x or i == x+w-1 or j == y or j == y+h-1:
                         t_type = wall
                     
-                    self.session.add(MapTile(x=i, y=j, z=z, tile_type=t_type, is_visited=True))
+                    self._add_tile(i, j, z, t_type, True)
             
             dx, dy = x + w//2, y + h - 1 
             if door_side == "top": dy = y
@@ -258,10 +355,9 @@ class LevelBuilder:
             if door_pos:
                 tiles[door_pos] = "door"
 
-        # Structures
-        place_structure(-4, 4, 9, 7, door_pos=(0, 4)) # Town Hall
-        place_structure(8, 6, 8, 7, door_pos=(8, 9)) # Smithy
-        place_structure(-14, 6, 7, 7, door_pos=(-8, 9)) # Alchemist
+        # Structures (Town Hall, Smithy, Alchemist)
+        for _, sx, sy, w, h, door in TOWN_STRUCTURES:
+            place_structure(sx, sy, w, h, door_pos=door)
 
         # --- Town Hall Interior (Furniture) ---
         # Back wall shelves
@@ -329,7 +425,9 @@ class LevelBuilder:
 
         # 4. Commit 
         for (pos, t_type) in tiles.items():
-            self.session.add(MapTile(x=pos[0], y=pos[1], z=z, tile_type=t_type, is_visited=True))
+            self._add_tile(pos[0], pos[1], z, t_type, True)
+        self._town_regions(z)
+        self._flush_tiles()
         
         # Spawn NPCs from JSON
         self._load_npcs_from_file(z)
@@ -403,25 +501,19 @@ class LevelBuilder:
         place_entrance(20, -20, "door", "rock", "Earth Dungeon")
         place_entrance(20, 15, "door", "void", "Air Dungeon")
         
-        # 5. Commit
-        game_map = []
+        # 5. Commit (only the road starts revealed)
         for (pos, t_type) in tiles.items():
-            m = MapTile(x=pos[0], y=pos[1], z=z, tile_type=t_type, is_visited=True)
+            meta = None
             if t_type == "herb":
-                 m.meta_data = {
+                 meta = {
                      "interactable": True, 
                      "interact_name": "Mystic Herb",
                      "action": "gather",
                      "hidden": False # Visible by default
                  }
-            game_map.append(m)
-        
-        for m in game_map:
-            if m.tile_type == "floor": 
-                m.is_visited = True
-            else:
-                m.is_visited = False
-            self.session.add(m)
+            self._add_tile(pos[0], pos[1], z, t_type, t_type == "floor", meta)
+        self._add_region(z, "North Forest")
+        self._flush_tiles()
             
         # 6. Spawns
         beasts = ["Dire Wolf", "Forest Bear", "Knife Goblin"]
@@ -491,7 +583,7 @@ class LevelBuilder:
             if random.random() < 0.05 and abs(x) > 5: t_type = "lava"
             elif random.random() < 0.02 and abs(x) > 5: t_type = "steam_vent"
             
-            self.session.add(MapTile(x=x, y=y, z=z, tile_type=t_type, is_visited=False))
+            self._add_tile(x, y, z, t_type)
 
         walls = set()
         for x, y in floors:
@@ -501,7 +593,9 @@ class LevelBuilder:
                         walls.add((x+dx, y+dy))
         
         for x, y in walls:
-            self.session.add(MapTile(x=x, y=y, z=z, tile_type="wall_volcanic", is_visited=False))
+            self._add_tile(x, y, z, "wall_volcanic")
+        self._fire_regions(z, floors)
+        self._flush_tiles()
             
         # 3. Monsters
         valid_floors = list(floors)
@@ -615,11 +709,13 @@ class LevelBuilder:
             
             if x == 0 and y == -2: t_type = "door_stone"
             
-            self.session.add(MapTile(x=x, y=y, z=z, tile_type=t_type, is_visited=False)) 
+            self._add_tile(x, y, z, t_type)
 
         for (x, y) in walls:
             if x == 0 and y == -2: continue 
-            self.session.add(MapTile(x=x, y=y, z=z, tile_type="wall_ice", is_visited=False))
+            self._add_tile(x, y, z, "wall_ice")
+        self._ice_regions(z, floors)
+        self._flush_tiles()
 
         # 4. Monsters
         enemies = [
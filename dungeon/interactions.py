@@ -1,5 +1,6 @@
-from .database import MapTile, WorldObject, Monster, NPC
+from .database import WorldObject, Monster, NPC
 from sqlalchemy.orm.attributes import flag_modified
+from .layers import layer_store
 
 class InteractionManager:
     def __init__(self, dm):
@@ -10,9 +11,8 @@ class InteractionManager:
     def handle_interaction(self, action, target_type, target_index):
         """Dispatches interaction handling based on action type."""
         
-        from .database import Player
         # Ensure player state is fresh from DB, not cached DM object
-        self.player = self.session.query(Player).first() 
+        self.player = self.dm.player
 
         if action == "loot" and target_type == "corpse":
             return self._handle_loot(target_index)
@@ -46,19 +46,16 @@ class InteractionManager:
              px, py, pz = self.player.x, self.player.y, self.player.z
              frozen_count = 0
              
-             affected_tiles = self.session.query(MapTile).filter(
-                 MapTile.z == pz,
-                 MapTile.x.between(px-1, px+1),
-                 MapTile.y.between(py-1, py+1),
-                 MapTile.tile_type.in_(["lava", "steam_vent"])
-             ).all()
+             affected_tiles = [
+                 pos for pos, (tile_type, _) in layer_store.area(self.session, px-1, py-1, px+1, py+1, pz).items()
+                 if tile_type in ["lava", "steam_vent"]
+             ]
              
              if not affected_tiles:
                  return "There is no lava or steam nearby to freeze."
                  
-             for t in affected_tiles:
-                 t.tile_type = "floor_volcanic"
-                 flag_modified(t, "tile_type")
+             for (tx, ty) in affected_tiles:
+                 layer_store.set_type(self.session, tx, ty, pz, "floor_volcanic")
                  frozen_count += 1
                  
              # Consume Item
@@ -82,15 +79,15 @@ class InteractionManager:
         if abs(tx - self.player.x) > 1 or abs(ty - self.player.y) > 1:
             return "Too far away."
             
-        tile = self.session.query(MapTile).filter_by(x=tx, y=ty, z=tz).first()
-        if not tile: return "Nothing here."
+        tile_type = layer_store.get(self.session, tx, ty, tz)
+        if not tile_type: return "Nothing here."
         
         from .items import ITEM_TEMPLATES
         from .rules import roll_dice
         from .database import InventoryItem
         
-        is_rock = (tile.tile_type == "rock")
-        is_herb = (tile.tile_type in ["flower_pot", "herb"])
+        is_rock = (tile_type == "rock")
+        is_herb = (tile_type in ["flower_pot", "herb"])
         
         if not (is_rock or is_herb): return "Nothing to gather."
         
@@ -124,9 +121,7 @@ class InteractionManager:
                     properties=template['properties'], player=self.player, quantity=1
                  ))
                  
-             tile.tile_type = depleted_type
-             # Update visual map instantly in session? DM sends update next.
-             flag_modified(tile, "tile_type") 
+             layer_store.set_type(self.session, tx, ty, tz, depleted_type)
              self.session.commit()
              
              leveled, new_lvl = self.dm.award_skill_xp(skill, 10)
@@ -207,18 +202,11 @@ class InteractionManager:
                      return "Too far away."
 
                 # Trigger Door Reveal at (2, 30)
-                door_tile = self.session.query(MapTile).filter_by(x=2, y=30, z=0).first()
-                if door_tile:
-                    door_tile.tile_type = "door"
-                    door_tile.is_visited = True
-                    flag_modified(door_tile, "tile_type")
-                else:
-                    # Create it
-                    new_door = MapTile(x=2, y=30, z=0, tile_type="door", is_visited=True)
-                    self.session.add(new_door)
+                # Creates the tile if it is missing
+                layer_store.put(self.session, 2, 30, 0, "door", visited=True)
 
                 # Elara Comment & State Update
-                elara = self.session.query(NPC).filter(NPC.name.like("%Elara%")).first()
+                elara = self.session.query(NPC).filter(NPC.name.like("Elara%")).first()
                 elara_msg = ""
                 if elara:
                     elara_msg = "\n\nElara: 'You found it! Quick, let's go!'"
@@ -66,9 +66,7 @@ class InventorySystem:
         base_ac = 10
         
         # Dex Bonus
-        stats = player.stats or {}
-        # Support both casing just in case (though we standardized on lowercase)
-        dex = stats.get('dex') or stats.get('DEX') or 10
+        dex = player.dexterity or 10
         dex_mod = (dex - 10) // 2
         
         ac = base_ac + dex_mod
@@ -95,10 +93,8 @@ class InventorySystem:
         # Update Player
         player.armor_class = ac
         
-        # Store weapon damage in stats so Combat can read it
-        stats_dict = dict(player.stats or {})
-        stats_dict['weapon_damage'] = weapon_damage
-        player.stats = stats_dict
+        # Store weapon damage on the player so Combat can read it
+        player.weapon_damage = weapon_damage
 
     def use_item(self, player, item_id):
         item = self.session.query(InventoryItem).filter_by(id=item_id, player=player).first()
@@ -0,0 +1,607 @@
+"""
+Map Layers.
+Each z-level is stored as a single `map_layers` row (MapLayer) and kept in memory as a
+`Layer` while the server runs, so movement, monster/NPC steps and fog of war never issue
+per-tile SQL, and loading or saving a whole level is one row read/write.
+
+Row format:
+- palette: JSON list, index -> tile_type (index 0 = no tile)
+- tiles: width * height palette indices, row-major from (x0, y0); one byte each while the
+  palette fits in a byte, otherwise uint16 little-endian
+- visited: fog-of-war bitset, bit i = cell i (LSB first, little-endian bytes)
+- meta: sparse {"x,y": meta_data} for the few tiles that carry extra data
+- regions: region id per cell, packed like tiles; region_names: id -> name (id 0 = the rest
+  of the level). Emitted by LevelBuilder (rooms, corridors, caves) and read by room naming
+
+- Writes go to the session's own copy of the layer (made on its first write to that level),
+  so other sessions never see, or save, what it has not committed. Right before the commit
+  the session takes the database's write lock and then the level's commit lock (held until
+  the commit is published or rolled back), replays the cells it changed onto the shared
+  layer's current state, writes that merged layer back, and once the commit succeeds it
+  becomes the shared layer. Commits to one level thus apply one after another, each on top
+  of the last. The changed tiles reach the world version log like any other change.
+- Fog of war is a Python int per level used as a bitset: revealing a field of view is a
+  single OR of a cell mask, and `visibility()` cuts a window out of it for the client.
+- `grid()` serves the level's tile flags (tiles.py) as a TileGrid, built on first use and
+  rebuilt after the level's tiles change, for passability and line-of-sight checks.
+- `region()` names the room at a cell with one array read; levels saved before regions
+  existed have none until LevelBuilder.build_regions() derives them from their tiles.
+- A rollback just drops the session's copies; the shared layers never held its writes.
+- Layers are cached per (game_id, z); a session works on the layers of its own game.
+- Rows left in the legacy `map_tiles` table (old saves, scripts in tools/) are folded into
+  their layer by `migrate_map_tiles()` on startup.
+"""
+import sys
+import threading
+from array import array
+
+from sqlalchemy import event, select, insert, update, delete
+from sqlalchemy.orm import scoped_session
+
+from .database import SessionFactory, DEFAULT_GAME, MapLayer, MapTile
+from .tiles import NO_TILE, TileGrid, tile_flags
+from .versioning import ChangeSet
+
+_layers = MapLayer.__table__
+_tiles = MapTile.__table__
+
+
+def pack_bits(flags, size):
+    """Iterable of truthy flags (cell order) -> int bitset."""
+    out = bytearray((size + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            out[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(out, "little")
+
+
+class Layer:
+    __slots__ = ("z", "x0", "y0", "width", "height", "types", "present", "visited", "meta", "grid",
+                 "regions", "region_names")
+
+    def __init__(self, z, x0=0, y0=0, width=0, height=0):
+        self.z = z
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.types = array("H", bytes(2 * width * height)) # Store palette index, 0 = no tile
+        self.present = 0                                   # Bitset: cell has a tile
+        self.visited = 0                                   # Bitset: cell revealed
+        self.meta = {}                                     # (x, y) -> meta_data
+        self.grid = None                                   # TileGrid, None until built / after a change
+        self.regions = None                                # array('H') region id per cell, None = no region layer
+        self.region_names = []                             # region id -> name
+
+    def cell(self, x, y):
+        """Array index of (x, y), or None outside the layer bounds."""
+        if self.x0 <= x < self.x0 + self.width and self.y0 <= y < self.y0 + self.height:
+            return (y - self.y0) * self.width + (x - self.x0)
+        return None
+
+    def grow(self, x, y):
+        """Extend the bounds to include (x, y). Returns the cell index."""
+        if not self.width:
+            x0, y0, x1, y1 = x, y, x, y
+        else:
+            x0, y0 = min(self.x0, x), min(self.y0, y)
+            x1, y1 = max(self.x0 + self.width - 1, x), max(self.y0 + self.height - 1, y)
+        width, height = x1 - x0 + 1, y1 - y0 + 1
+        types = array("H", bytes(2 * width * height))
+        regions = None if self.regions is None else array("H", bytes(2 * width * height))
+        for row in range(self.height):
+            src = row * self.width
+            dst = (self.y0 + row - y0) * width + (self.x0 - x0)
+            types[dst:dst + self.width] = self.types[src:src + self.width]
+            if regions is not None:
+                regions[dst:dst + self.width] = self.regions[src:src + self.width]
+        present = self.window_bits(self.present, x0, y0, x1, y1)
+        visited = self.window_bits(self.visited, x0, y0, x1, y1)
+        self.x0, self.y0, self.width, self.height = x0, y0, width, height
+        self.types, self.present, self.visited = types, present, visited
+        if regions is not None:
+            self.regions = regions
+        return self.cell(x, y)
+
+    def window_bits(self, bits, x0, y0, x1, y1):
+        """Re-index a layer bitset onto the window (x0, y0)-(x1, y1), row-major."""
+        w = x1 - x0 + 1
+        sx, ex = max(x0, self.x0), min(x1, self.x0 + self.width - 1)
+        if sx > ex:
+            return 0
+        run = (1 << (ex - sx + 1)) - 1
+        out = 0
+        for y in range(max(y0, self.y0), min(y1, self.y0 + self.height - 1) + 1):
+            row = (bits >> ((y - self.y0) * self.width + (sx - self.x0))) & run
+            if row:
+                out |= row << ((y - y0) * w + (sx - x0))
+        return out
+
+    def copy(self):
+        """Independent copy (the TileGrid snapshot is shared; it is replaced, never changed)."""
+        other = Layer(self.z, self.x0, self.y0)
+        other.width, other.height = self.width, self.height
+        other.types = array("H", self.types)
+        other.present, other.visited = self.present, self.visited
+        other.meta = dict(self.meta)
+        other.grid = self.grid
+        other.regions = None if self.regions is None else array("H", self.regions)
+        other.region_names = list(self.region_names)
+        return other
+
+    def copy_cell(self, src, x, y):
+        """Take (x, y)'s tile, fog and meta_data from layer `src`, growing if needed."""
+        i = src.cell(x, y)
+        if i is not None and (src.types[i] or self.cell(x, y) is not None):
+            j = self.cell(x, y)
+            if j is None:
+                j = self.grow(x, y)
+            self.types[j] = src.types[i]
+            bit = 1 << j
+            self.present = self.present | bit if (src.present >> i) & 1 else self.present & ~bit
+            self.visited = self.visited | bit if (src.visited >> i) & 1 else self.visited & ~bit
+            self.grid = None
+        if (x, y) in src.meta:
+            self.meta[(x, y)] = src.meta[(x, y)]
+        else:
+            self.meta.pop((x, y), None)
+
+
+class _Draft:
+    """A session's uncommitted copy of a level: the shared layer it started from and the cells it changed."""
+    __slots__ = ("base", "layer", "cells")
+
+    def __init__(self, base, layer, cells):
+        self.base = base   # Shared layer the copy was taken from (None: a level replaced outright)
+        self.layer = layer
+        self.cells = cells # {(x, y)} written, None = the whole level
+
+
+class LayerStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._layers = {}           # (game_id, z) -> Layer
+        self._commit_locks = {}     # (game_id, z) -> Lock held from a session's flush to its publish/discard
+        self._palette = [None]      # index -> tile_type (shared by all loaded layers)
+        self._palette_index = {}    # tile_type -> index
+        self._flags = [NO_TILE]     # index -> tile flags
+
+    # --- Reads ---
+
+    def get(self, session, x, y, z):
+        """Tile type at (x, y, z), or None if there is no tile."""
+        with self._lock:
+            layer = self._layer(session, z)
+            i = layer.cell(x, y)
+            return None if i is None else self._palette[layer.types[i]]
+
+    def is_visited(self, session, x, y, z):
+        with self._lock:
+            layer = self._layer(session, z)
+            i = layer.cell(x, y)
+            return i is not None and bool((layer.visited >> i) & 1)
+
+    def visibility(self, session, x0, y0, x1, y1, z):
+        """Fog-of-war bits for the window, row-major, as little-endian bytes."""
+        with self._lock:
+            layer = self._layer(session, z)
+            bits = layer.window_bits(layer.visited, x0, y0, x1, y1)
+        return bits.to_bytes(((x1 - x0 + 1) * (y1 - y0 + 1) + 7) // 8, "little")
+
+    def meta(self, session, x, y, z):
+        """Copy of the tile's meta_data ({} if it has none)."""
+        with self._lock:
+            return dict(self._layer(session, z).meta.get((x, y), {}))
+
+    def area(self, session, x0, y0, x1, y1, z):
+        """{(x, y): (tile_type, is_visited)} for every existing tile in the box."""
+        result = {}
+        w = x1 - x0 + 1
+        with self._lock:
+            layer = self._layer(session, z)
+            visited = layer.window_bits(layer.visited, x0, y0, x1, y1)
+            for y in range(max(y0, layer.y0), min(y1, layer.y0 + layer.height - 1) + 1):
+                row = (y - layer.y0) * layer.width - layer.x0
+                for x in range(max(x0, layer.x0), min(x1, layer.x0 + layer.width - 1) + 1):
+                    t = layer.types[row + x]
+                    if t:
+                        result[(x, y)] = (self._palette[t], bool((visited >> ((y - y0) * w + x - x0)) & 1))
+        return result
+
+    def grid(self, session, z):
+        """TileGrid of level z (tile flags per cell)."""
+        with self._lock:
+            layer = self._layer(session, z)
+            if layer.grid is None:
+                flags = self._flags
+                layer.grid = TileGrid(z, layer.x0, layer.y0, layer.width, layer.height,
+                                      bytearray([flags[t] for t in layer.types]))
+            return layer.grid
+
+    def region(self, session, x, y, z):
+        """Name of the region (room, corridor, cave) at (x, y, z), or None."""
+        with self._lock:
+            layer = self._layer(session, z)
+            if not layer.region_names:
+                return None
+            i = layer.cell(x, y)
+            rid = layer.regions[i] if i is not None and layer.regions is not None else 0
+            return layer.region_names[rid]
+
+    def has_regions(self, session, z):
+        with self._lock:
+            return bool(self._layer(session, z).region_names)
+
+    def bounds(self, session, z):
+        """(x0, y0, x1, y1) covered by level z (empty range if there is no layer)."""
+        with self._lock:
+            layer = self._layer(session, z)
+            return (layer.x0, layer.y0, layer.x0 + layer.width - 1, layer.y0 + layer.height - 1)
+
+    def has_level(self, session, z):
+        with self._lock:
+            return any(self._layer(session, z).types)
+
+    def levels(self, session):
+        """Every z that has a stored layer."""
+        query = select(_layers.c.z).where(_layers.c.game_id == _game(session)).order_by(_layers.c.z)
+        return [z for (z,) in session.execute(query)]
+
+    # --- Writes ---
+
+    def set_type(self, session, x, y, z, tile_type):
+        """Change an existing tile's type. Returns False if there is no tile there."""
+        with self._lock:
+            layer = self._layer(session, z)
+            i = layer.cell(x, y)
+            if i is None or not layer.types[i]:
+                return False
+            draft = self._draft(session, z)
+            draft.layer.types[i] = self._index(tile_type)
+            draft.layer.grid = None
+            self._mark(session, draft, x, y)
+            return True
+
+    def set_visited(self, session, x, y, z, visited=True):
+        """Reveal (or hide) an existing tile. Returns True if anything changed."""
+        with self._lock:
+            layer = self._layer(session, z)
+            i = layer.cell(x, y)
+            if i is None or not layer.types[i] or bool((layer.visited >> i) & 1) == visited:
+                return False
+            draft = self._draft(session, z)
+            draft.layer.visited ^= 1 << i
+            self._mark(session, draft, x, y)
+            return True
+
+    def reveal(self, session, z, cells):
+        """Mark every existing tile among cells [(x, y)] visited (one OR). Returns the newly revealed cells."""
+        with self._lock:
+            layer = self._layer(session, z)
+            mask = 0
+            for x, y in cells:
+                i = layer.cell(x, y)
+                if i is not None:
+                    mask |= 1 << i
+            new = mask & layer.present & ~layer.visited
+            if not new:
+                return []
+            draft = self._draft(session, z)
+            draft.layer.visited |= new
+            revealed = []
+            while new:
+                low = new & -new
+                new ^= low
+                y, x = divmod(low.bit_length() - 1, layer.width)
+                revealed.append((layer.x0 + x, layer.y0 + y))
+            for x, y in revealed:
+                self._mark(session, draft, x, y)
+            return revealed
+
+    def reveal_level(self, session, z):
+        """Clear the fog on a whole level. Returns the number of tiles revealed."""
+        with self._lock:
+            draft = self._draft(session, z)
+            draft.cells = None
+            layer = draft.layer
+            count = bin(layer.present & ~layer.visited).count("1")
+            layer.visited |= layer.present
+        session.info.setdefault("world_changes", ChangeSet()).full = True
+        return count
+
+    def set_meta(self, session, x, y, z, meta_data):
+        with self._lock:
+            draft = self._draft(session, z)
+            if meta_data:
+                draft.layer.meta[(x, y)] = dict(meta_data)
+            else:
+                draft.layer.meta.pop((x, y), None)
+            self._mark(session, draft, x, y)
+            session.info.setdefault("world_changes", ChangeSet()).sections.add("secrets")
+
+    def put(self, session, x, y, z, tile_type, visited=False):
+        """Create (or overwrite) a tile, growing the layer if needed."""
+        with self._lock:
+            draft = self._draft(session, z)
+            layer = draft.layer
+            i = layer.cell(x, y)
+            if i is None:
+                i = layer.grow(x, y)
+            layer.types[i] = self._index(tile_type)
+            layer.grid = None
+            layer.present |= 1 << i
+            if visited:
+                layer.visited |= 1 << i
+            else:
+                layer.visited &= ~(1 << i)
+            self._mark(session, draft, x, y)
+
+    def replace_level(self, session, z, tiles, regions=None):
+        """
+        Swap in a freshly generated level. tiles: [(x, y, tile_type, visited, meta_data)],
+        regions: (default name, [(name, cells)]) as LevelBuilder emits them.
+        Clients resync after the commit.
+        """
+        layer = self._build(z, tiles)
+        if regions:
+            _paint_regions(layer, *regions)
+        _begin(session)
+        session.info.setdefault("dirty_layers", {})[z] = _Draft(None, layer, None)
+        session.info.setdefault("world_changes", ChangeSet()).full = True
+        return layer
+
+    def set_regions(self, session, z, default, areas):
+        """Give level z a region layer: `default` names every cell outside the [(name, cells)] areas."""
+        with self._lock:
+            draft = self._draft(session, z)
+            draft.cells = None
+            _paint_regions(draft.layer, default, areas)
+
+    def flush(self, session):
+        """Write every layer this session touched, one row each (called before commit)."""
+        drafts = session.info.get("dirty_layers")
+        if not drafts:
+            return
+        game_id = _game(session)
+        levels = sorted(drafts)
+        # The database write lock first (a no-op UPDATE takes it even on a new level), then the
+        # level locks: always in that order, so two committers cannot wait on each other.
+        first = (_layers.c.game_id == game_id) & (_layers.c.z == levels[0])
+        session.execute(update(_layers).where(first).values(z=_layers.c.z))
+        held = session.info.setdefault("layer_locks", [])
+        for z in levels:
+            with self._lock:
+                lock = self._commit_locks.setdefault((game_id, z), threading.Lock())
+            lock.acquire()
+            held.append(lock)
+        for z in levels:
+            with self._lock:
+                row = self._pack(self._rebase(session, z, drafts[z]))
+            key = (_layers.c.game_id == game_id) & (_layers.c.z == z)
+            if not session.execute(update(_layers).where(key).values(**row)).rowcount:
+                session.execute(insert(_layers).values(game_id=game_id, z=z, **row))
+
+    def publish(self, session):
+        """Make the layers this session committed the shared ones (called after commit)."""
+        drafts = session.info.pop("dirty_layers", None)
+        if drafts:
+            game_id = _game(session)
+            with self._lock:
+                for z, draft in drafts.items():
+                    self._layers[(game_id, z)] = draft.layer
+        self._unlock(session)
+
+    def discard(self, session):
+        """Drop the session's uncommitted layers (called after rollback)."""
+        session.info.pop("dirty_layers", None)
+        self._unlock(session)
+
+    # --- Cache Management ---
+
+    def evict_level(self, z, game_id=DEFAULT_GAME):
+        with self._lock:
+            self._layers.pop((game_id, z), None)
+
+    def evict_game(self, game_id):
+        with self._lock:
+            for key in [k for k in self._layers if k[0] == game_id]:
+                del self._layers[key]
+            for key in [k for k, lock in self._commit_locks.items() if k[0] == game_id and not lock.locked()]:
+                del self._commit_locks[key]
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+
+    # --- Internals ---
+
+    def _layer(self, session, z):
+        """The layer as `session` sees it: its own copy once it wrote to the level, else the shared one."""
+        draft = session.info.get("dirty_layers", {}).get(z)
+        return draft.layer if draft is not None else self._shared(session, z)
+
+    def _shared(self, session, z):
+        key = (_game(session), z)
+        layer = self._layers.get(key)
+        if layer is None:
+            layer = self._layers[key] = self._load(session, z)
+        return layer
+
+    def _draft(self, session, z):
+        """The session's copy of level z, taken on its first write."""
+        drafts = session.info.setdefault("dirty_layers", {})
+        draft = drafts.get(z)
+        if draft is None:
+            _begin(session)
+            base = self._shared(session, z)
+            draft = drafts[z] = _Draft(base, base.copy(), set())
+        return draft
+
+    def _unlock(self, session):
+        for lock in session.info.pop("layer_locks", ()):
+            lock.release()
+
+    def _rebase(self, session, z, draft):
+        """The draft's changes on top of the level's current shared state (which other commits may have moved)."""
+        shared = self._shared(session, z)
+        if draft.cells is None or shared is draft.base:
+            return draft.layer
+        merged = shared.copy()
+        for x, y in draft.cells:
+            merged.copy_cell(draft.layer, x, y)
+        draft.base, draft.layer = shared, merged
+        return merged
+
+    def _load(self, session, z):
+        row = session.execute(
+            select(_layers).where((_layers.c.game_id == _game(session)) & (_layers.c.z == z))
+        ).first()
+        if row is None:
+            return Layer(z)
+        layer = Layer(z, row.x0, row.y0, row.width, row.height)
+        code = "B" if len(row.tiles) == row.width * row.height else "H"
+        local = array(code, row.tiles)
+        if code == "H" and sys.byteorder == "big":
+            local.byteswap()
+        remap = [0] + [self._index(t) for t in row.palette[1:]]
+        layer.types = array("H", [remap[i] for i in local])
+        layer.present = pack_bits(layer.types, len(layer.types))
+        if len(row.visited) == len(layer.types) > 1:
+            layer.visited = pack_bits(row.visited, len(layer.types)) # Saved before the bitset: one byte per cell
+        else:
+            layer.visited = int.from_bytes(row.visited, "little")
+        for key, md in (row.meta or {}).items():
+            x, y = map(int, key.split(","))
+            layer.meta[(x, y)] = md
+        if row.region_names:
+            layer.region_names = list(row.region_names)
+            if row.regions:
+                local = array("B" if len(row.regions) == row.width * row.height else "H", row.regions)
+                if local.typecode == "H" and sys.byteorder == "big":
+                    local.byteswap()
+                layer.regions = array("H", local)
+        return layer
+
+    def _pack(self, layer):
+        used = [0] + sorted(set(layer.types) - {0})
+        remap = {g: i for i, g in enumerate(used)}
+        local = array("B" if len(used) <= 256 else "H", [remap[t] for t in layer.types])
+        if local.typecode == "H" and sys.byteorder == "big":
+            local.byteswap()
+        regions = None
+        if layer.regions is not None:
+            regions = array("B" if len(layer.region_names) <= 256 else "H", layer.regions)
+            if regions.typecode == "H" and sys.byteorder == "big":
+                regions.byteswap()
+            regions = regions.tobytes()
+        return {
+            "x0": layer.x0, "y0": layer.y0, "width": layer.width, "height": layer.height,
+            "palette": [self._palette[g] for g in used],
+            "tiles": local.tobytes(),
+            "visited": layer.visited.to_bytes((layer.width * layer.height + 7) // 8, "little"),
+            "meta": {f"{x},{y}": md for (x, y), md in layer.meta.items()},
+            "regions": regions,
+            "region_names": layer.region_names or None
+        }
+
+    def _build(self, z, tiles):
+        tiles = list(tiles)
+        if not tiles:
+            return Layer(z)
+        xs = [t[0] for t in tiles]
+        ys = [t[1] for t in tiles]
+        layer = Layer(z, min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+        visited = bytearray(len(layer.types))
+        with self._lock:
+            for x, y, tile_type, is_visited, meta_data in tiles:
+                i = layer.cell(x, y)
+                layer.types[i] = self._index(tile_type)
+                visited[i] = is_visited
+                if meta_data:
+                    layer.meta[(x, y)] = dict(meta_data)
+        layer.present = pack_bits(layer.types, len(layer.types))
+        layer.visited = pack_bits(visited, len(layer.types))
+        return layer
+
+    def _index(self, tile_type):
+        index = self._palette_index.get(tile_type)
+        if index is None:
+            index = self._palette_index[tile_type] = len(self._palette)
+            self._palette.append(tile_type)
+            self._flags.append(tile_flags(tile_type))
+        return index
+
+    def _mark(self, session, draft, x, y):
+        if draft.cells is not None:
+            draft.cells.add((x, y))
+        session.info.setdefault("world_changes", ChangeSet()).tiles.add((x, y, draft.layer.z))
+
+
+def _game(session):
+    return session.info.get("game_id", DEFAULT_GAME)
+
+
+def _begin(session):
+    """Open the session's transaction (no SQL yet) so that a rollback reaches the after_rollback hook."""
+    if isinstance(session, scoped_session):
+        session = session()
+    if not session.in_transaction():
+        session.begin()
+
+
+def _paint_regions(layer, default, areas):
+    """Region ids for the layer's cells: area i gets id i + 1 (the first area listing a cell wins), the rest 0."""
+    ids = array("H", bytes(2 * layer.width * layer.height))
+    names = [default]
+    for name, cells in areas:
+        rid = len(names)
+        names.append(name)
+        for x, y in cells:
+            i = layer.cell(x, y)
+            if i is not None and not ids[i]:
+                ids[i] = rid
+    layer.regions, layer.region_names = ids, names
+
+
+layer_store = LayerStore()
+
+
+def migrate_map_tiles(session):
+    """
+    Fold rows from the legacy one-row-per-tile `map_tiles` table into map layers (of the
+    session's game) and delete them. Returns the number of tiles converted.
+    """
+    levels = [z for (z,) in session.execute(select(_tiles.c.z).distinct())]
+    converted = 0
+    for z in levels:
+        rows = session.execute(
+            select(_tiles.c.x, _tiles.c.y, _tiles.c.tile_type, _tiles.c.is_visited, _tiles.c.meta_data)
+            .where(_tiles.c.z == z).order_by(_tiles.c.id)
+        ).all()
+        for x, y, tile_type, visited, meta_data in rows:
+            layer_store.put(session, x, y, z, tile_type, bool(visited))
+            if meta_data:
+                layer_store.set_meta(session, x, y, z, meta_data)
+        session.execute(delete(_tiles).where(_tiles.c.z == z))
+        converted += len(rows)
+    if converted:
+        print(f"Layers: Migrated {converted} map_tiles rows into {len(levels)} layers.")
+    session.commit()
+    return converted
+
+
+# --- Session Hooks ---
+
+@event.listens_for(SessionFactory, "before_commit")
+def _flush_dirty_layers(session):
+    layer_store.flush(session)
+
+
+@event.listens_for(SessionFactory, "after_commit")
+def _publish_dirty_layers(session):
+    layer_store.publish(session)
+
+
+@event.listens_for(SessionFactory, "after_rollback")
+def _discard_dirty_layers(session):
+    layer_store.discard(session)
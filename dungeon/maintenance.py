@@ -0,0 +1,93 @@
+"""
+Background Maintenance.
+Periodically purges dead monster rows so that state reads never have to write:
+- corpses whose loot has been emptied (never shown, only cluttering `monsters`)
+- lootable corpses beyond the newest N per level (unlooted kills accumulate forever)
+Deletes run in small batches on the worker's own session, each batch its own short
+transaction, so they only briefly hold the SQLite write lock. The worker covers every
+hosted game (every open save file in per-save mode); each batch belongs to one game and is
+published to that game's version log.
+"""
+import threading
+
+from sqlalchemy import delete
+
+from .database import SessionFactory, Monster, CombatEncounter, game_engines
+from .gamedata import MAINTENANCE_CONFIG
+from .versioning import ChangeSet
+
+
+class MaintenanceWorker:
+    def __init__(self, interval=None, batch_size=None, max_corpses=None):
+        self.interval = interval or MAINTENANCE_CONFIG["interval_seconds"]
+        self.batch_size = batch_size or MAINTENANCE_CONFIG["batch_size"]
+        self.max_corpses = max_corpses or MAINTENANCE_CONFIG["max_corpses_per_level"]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Maintenance Error: {e}")
+
+    def run_once(self):
+        """One maintenance pass. Returns the number of monster rows purged."""
+        return sum(self._purge(bind) for bind in game_engines())
+
+    def _purge(self, bind):
+        session = SessionFactory(bind=bind)
+        try:
+            reapable = self._reapable_monsters(session)
+            for game_id, ids in reapable.items():
+                session.info["game_id"] = game_id # Scopes the deletes and the published change
+                for i in range(0, len(ids), self.batch_size):
+                    batch = ids[i:i + self.batch_size]
+                    session.execute(delete(Monster).where(Monster.id.in_(batch)))
+                    # Core deletes skip the flush hooks: tell state clients directly
+                    changes = session.info.setdefault("world_changes", ChangeSet())
+                    changes.sections.update(("enemies", "corpses"))
+                    session.commit()
+            return sum(len(ids) for ids in reapable.values())
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _reapable_monsters(self, session):
+        in_combat = {
+            mid for (mid,) in session.query(Monster.id)
+            .join(CombatEncounter, Monster.encounter_id == CombatEncounter.id)
+            .filter(CombatEncounter.is_active == True)
+        }
+        lootable = {} # (game_id, z) -> [ids], newest first
+        reapable = {} # game_id -> [ids]
+        dead = (session.query(Monster.id, Monster.game_id, Monster.z, Monster.loot)
+                .filter(Monster.is_alive == False).order_by(Monster.id.desc()))
+        for mid, game_id, z, loot in dead:
+            if mid in in_combat:
+                continue
+            if not loot:
+                reapable.setdefault(game_id, []).append(mid)
+                continue
+            kept = lootable.setdefault((game_id, z), [])
+            if len(kept) < self.max_corpses:
+                kept.append(mid)
+            else:
+                reapable.setdefault(game_id, []).append(mid)
+        return reapable
+
+
+maintenance = MaintenanceWorker()
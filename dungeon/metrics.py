@@ -0,0 +1,151 @@
+"""
+Request Instrumentation.
+Per-request wall time broken down by named phase, plus the number of SQL statements the
+request issued (counted with events on every engine, per-save ones included). The Flask
+layer reports each request as a `Server-Timing` header and keeps running aggregates for
+`/api/debug/metrics`.
+
+    with metrics.phase("map"):
+        ...
+
+Phases outside a request (background threads, tests) are ignored.
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .gamedata import METRICS_CONFIG
+
+
+class RequestMetrics:
+    """Timing/statement counters for the request running on this thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}        # name -> seconds (summed if a phase runs several times)
+        self.statements = 0
+        self.sql_time = 0.0
+        self.total = None       # Seconds, set when the request ends
+
+
+class _Phase:
+    __slots__ = ("registry", "name", "started")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current = self.registry.current()
+        if current is not None:
+            current.phases[self.name] = current.phases.get(self.name, 0.0) + time.perf_counter() - self.started
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._endpoints = {}    # name -> running totals
+        self._slow = deque(maxlen=METRICS_CONFIG["slow_history"])
+
+    def current(self):
+        return getattr(self._local, "request", None)
+
+    def begin(self, name):
+        self._local.request = RequestMetrics(name)
+        return self._local.request
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def end(self):
+        """Close the current request, fold it into the aggregates, return it."""
+        req = self.current()
+        if req is None:
+            return None
+        self._local.request = None
+        total = req.total = time.perf_counter() - req.started
+
+        with self._lock:
+            agg = self._endpoints.setdefault(req.name, {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "statements": 0, "phases_ms": {}
+            })
+            agg["count"] += 1
+            agg["total_ms"] += total * 1000
+            agg["max_ms"] = max(agg["max_ms"], total * 1000)
+            agg["statements"] += req.statements
+            for name, seconds in req.phases.items():
+                agg["phases_ms"][name] = agg["phases_ms"].get(name, 0.0) + seconds * 1000
+
+            if total * 1000 >= METRICS_CONFIG["slow_request_ms"]:
+                self._slow.append(self._summary(req, total))
+                print(f"METRICS: Slow request {req.name} {total * 1000:.1f}ms, {req.statements} statements "
+                      f"({', '.join(f'{k}={v * 1000:.1f}ms' for k, v in req.phases.items())})")
+        return req
+
+    def server_timing(self, req):
+        """Server-Timing header value for a finished request."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in req.phases.items()]
+        parts.append(f'db;desc="{req.statements} statements";dur={req.sql_time * 1000:.1f}')
+        parts.append(f"total;dur={req.total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for name, agg in self._endpoints.items():
+                count = agg["count"]
+                endpoints[name] = {
+                    "count": count,
+                    "avg_ms": round(agg["total_ms"] / count, 2),
+                    "max_ms": round(agg["max_ms"], 2),
+                    "avg_statements": round(agg["statements"] / count, 2),
+                    "avg_phases_ms": {k: round(v / count, 2) for k, v in agg["phases_ms"].items()}
+                }
+            return {
+                "slow_request_ms": METRICS_CONFIG["slow_request_ms"],
+                "endpoints": endpoints,
+                "slow_requests": list(self._slow)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._slow.clear()
+
+    def _summary(self, req, total):
+        return {
+            "endpoint": req.name,
+            "at": time.time(),
+            "ms": round(total * 1000, 2),
+            "statements": req.statements,
+            "phases_ms": {k: round(v * 1000, 2) for k, v in req.phases.items()}
+        }
+
+
+metrics = MetricsRegistry()
+
+
+# --- Engine Hooks ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    req = metrics.current()
+    started = conn.info.pop("metrics_started", None)
+    if req is not None and started is not None:
+        req.statements += 1
+        req.sql_time += time.perf_counter() - started
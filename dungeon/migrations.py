@@ -0,0 +1,253 @@
+"""
+Schema Migrations.
+Versioned, forward-only schema changes, applied in order by `init_db()` on startup. The
+applied version lives in the `schema_version` table and each migration runs once, in its
+own transaction.
+
+The models in database.py describe the current schema, so fresh databases already get
+every index from `create_all`; migrations must therefore be safe to run on a database that
+has the change (IF NOT EXISTS, column checks) and only need to bring older saves up to date.
+
+After migrating, `check_query_plans()` runs EXPLAIN QUERY PLAN on the hot queries and warns
+when one no longer uses the index it was given.
+"""
+import json
+import time
+
+from sqlalchemy import text, inspect
+
+
+def _add_missing_columns(conn):
+    """Columns older saves were patched with by hand (tools/patch_db.py, migrate_quantity.py)."""
+    columns = {
+        "players": [("skills", "TEXT DEFAULT '{}'")],
+        "inventory_items": [("quantity", "INTEGER DEFAULT 1")],
+    }
+    for table, wanted in columns.items():
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        for name, ddl in wanted:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _hot_query_indexes(conn):
+    for ddl in [
+        # Only the (at most one) running encounter is ever looked up
+        "CREATE INDEX IF NOT EXISTS idx_encounter_active ON combat_encounters (is_active) WHERE is_active = 1",
+        # Most monsters never join an encounter
+        "CREATE INDEX IF NOT EXISTS idx_monster_encounter ON monsters (encounter_id, is_alive) WHERE encounter_id IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_monster_level ON monsters (z, is_alive)",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_lookup ON inventory_items (player_id, name, is_equipped)",
+        # LIKE 'Name%' can range-scan a NOCASE index (LIKE is case-insensitive)
+        "CREATE INDEX IF NOT EXISTS idx_npc_name_nocase ON npcs (name COLLATE NOCASE)",
+    ]:
+        conn.execute(text(ddl))
+
+
+def _unique_locations(conn):
+    """
+    One tile / world object per location; the newest row wins on older saves. A location is
+    (z, x, y), led by game_id where the table already has one (a save created after game
+    scoping), so identical coordinates in different games are not duplicates.
+    """
+    for table, index in [("map_tiles", "idx_maptile_location"), ("world_objects", "idx_wobj_location")]:
+        key = "z, x, y"
+        if "game_id" in {c["name"] for c in inspect(conn).get_columns(table)}:
+            key = "game_id, " + key
+        removed = conn.execute(text(
+            f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})"
+        )).rowcount
+        if removed:
+            print(f"Migrations: Removed {removed} duplicate rows from {table}.")
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        conn.execute(text(f"CREATE UNIQUE INDEX {index} ON {table} ({key})"))
+
+
+def _game_scoping(conn):
+    """Every save gets an identity: `game_id` on each game-owned table, leading its keys and location indexes."""
+    from .database import DEFAULT_GAME, NPC, MapLayer
+    for table in ["players", "inventory_items", "monsters", "world_objects", "combat_encounters"]:
+        if "game_id" not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN game_id VARCHAR NOT NULL DEFAULT '{DEFAULT_GAME}'"))
+    # npcs.name is unique per game and map_layers is keyed by (game_id, z): SQLite cannot
+    # alter constraints, so those two tables are rebuilt.
+    for model in (NPC, MapLayer):
+        _rebuild_with_game_id(conn, model.__table__, DEFAULT_GAME)
+    for index, ddl in [
+        ("idx_wobj_location", "CREATE UNIQUE INDEX idx_wobj_location ON world_objects (game_id, z, x, y)"),
+        ("idx_monster_location", "CREATE INDEX idx_monster_location ON monsters (game_id, z, x, y)"),
+        ("idx_monster_level", "CREATE INDEX idx_monster_level ON monsters (game_id, z, is_alive)"),
+        ("idx_encounter_active", "CREATE INDEX idx_encounter_active ON combat_encounters (game_id, is_active) WHERE is_active = 1"),
+    ]:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        conn.execute(text(ddl))
+
+
+def _rebuild_with_game_id(conn, table, game_id):
+    """Recreate `table` from its current model, copying the old rows into `game_id`."""
+    columns = [c["name"] for c in inspect(conn).get_columns(table.name)]
+    if "game_id" in columns:
+        return
+    old = f"{table.name}_old"
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old}"))
+    for index in inspect(conn).get_indexes(old):
+        conn.execute(text(f"DROP INDEX {index['name']}")) # Free the names for the new table
+    table.create(conn)
+    names = ", ".join(columns)
+    conn.execute(text(f"INSERT INTO {table.name} ({names}, game_id) SELECT {names}, :g FROM {old}"), {"g": game_id})
+    conn.execute(text(f"DROP TABLE {old}"))
+
+
+def _typed_player_fields(conn):
+    """
+    Hot JSON fields -> typed columns and child tables: ability scores, unspent points and
+    weapon damage become player/monster columns, skills and quest progress get their own
+    rows. The JSON columns are dropped afterwards.
+    """
+    from .database import ABILITIES, Base
+    for table in ("player_skills", "player_quests", "quest_progress"):
+        Base.metadata.tables[table].create(conn, checkfirst=True)
+
+    scores = [(column, "INTEGER NOT NULL DEFAULT 10") for column in ABILITIES.values()]
+    wanted = {
+        "players": scores + [("unspent_points", "INTEGER NOT NULL DEFAULT 0"),
+                             ("weapon_damage", "VARCHAR DEFAULT '1d4'"),
+                             ("rage_turns", "INTEGER NOT NULL DEFAULT 0")],
+        "monsters": scores,
+    }
+    for table, columns in wanted.items():
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        for name, ddl in columns:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+    for table in ("players", "monsters"):
+        if "stats" not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            continue
+        for row_id, stats in conn.execute(text(f"SELECT id, stats FROM {table}")).all():
+            values = {}
+            for key, value in _json(stats).items():
+                column = ABILITIES.get(key.lower())
+                if column:
+                    values[column] = value
+                elif table == "players" and key in ("unspent_points", "weapon_damage"):
+                    values[key] = value
+            if values:
+                assignments = ", ".join(f"{c} = :{c}" for c in values)
+                conn.execute(text(f"UPDATE {table} SET {assignments} WHERE id = :id"), dict(values, id=row_id))
+
+    columns = {c["name"] for c in inspect(conn).get_columns("players")}
+    if "skills" in columns:
+        for player_id, game_id, skills in conn.execute(text("SELECT id, game_id, skills FROM players")).all():
+            for skill, value in _json(skills).items():
+                level, xp = (value, 0) if isinstance(value, int) else (value.get("level", 0), value.get("xp", 0))
+                conn.execute(text(
+                    "INSERT INTO player_skills (game_id, player_id, skill, level, xp) VALUES (:g, :p, :s, :l, :x)"
+                ), {"g": game_id, "p": player_id, "s": skill, "l": level, "x": xp})
+    if "quest_state" in columns:
+        for player_id, game_id, state in conn.execute(text("SELECT id, game_id, quest_state FROM players")).all():
+            state = _json(state)
+            statuses = {qid: "active" for qid in state.get("active", {})}
+            statuses.update({qid: "completed" for qid in state.get("completed", [])})
+            for qid, status in statuses.items():
+                quest_row = conn.execute(text(
+                    "INSERT INTO player_quests (game_id, player_id, quest_id, status) VALUES (:g, :p, :q, :s)"
+                ), {"g": game_id, "p": player_id, "q": qid, "s": status}).lastrowid
+                progress = state["active"][qid].get("progress", {}) if status == "active" else {}
+                for target, count in progress.items():
+                    conn.execute(text(
+                        "INSERT INTO quest_progress (game_id, quest_row_id, target, count) VALUES (:g, :r, :t, :c)"
+                    ), {"g": game_id, "r": quest_row, "t": target, "c": count})
+            if state.get("active_quests"):
+                print(f"Migrations: Dropped untracked legacy quests {state['active_quests']} of player {player_id}.")
+
+    for table, names in [("players", ("stats", "skills", "quest_state")), ("monsters", ("stats",))]:
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        for name in names:
+            if name in existing:
+                conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+
+
+def _region_layers(conn):
+    """Room/corridor/cave region ids per level (see layers.py); older levels get theirs on first use."""
+    existing = {c["name"] for c in inspect(conn).get_columns("map_layers")}
+    for name, ddl in [("regions", "BLOB"), ("region_names", "JSON")]:
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE map_layers ADD COLUMN {name} {ddl}"))
+
+
+def _json(value):
+    if isinstance(value, str):
+        value = json.loads(value or "null")
+    return value or {}
+
+
+# (version, name, function). Append only; never renumber or edit an applied migration.
+MIGRATIONS = [
+    (1, "legacy_columns", _add_missing_columns),
+    (2, "hot_query_indexes", _hot_query_indexes),
+    (3, "unique_locations", _unique_locations),
+    (4, "game_scoping", _game_scoping),
+    (5, "typed_player_fields", _typed_player_fields),
+    (6, "region_layers", _region_layers),
+]
+
+# name -> (sql as the ORM emits it for a game session, params, index it must use)
+HOT_QUERIES = {
+    "active_encounter": ("SELECT * FROM combat_encounters WHERE is_active = 1 AND game_id = :g LIMIT 1",
+                         {"g": "default"}, "idx_encounter_active"),
+    "encounter_monsters": ("SELECT * FROM monsters WHERE encounter_id = :e AND is_alive = 1 AND game_id = :g",
+                           {"e": 1, "g": "default"}, "idx_monster_encounter"),
+    "level_monsters": ("SELECT * FROM monsters WHERE is_alive = 1 AND z = :z AND game_id = :g",
+                       {"z": 0, "g": "default"}, "idx_monster_level"),
+    "inventory_stack": ("SELECT * FROM inventory_items WHERE player_id = :p AND name = :n AND is_equipped = 0 AND game_id = :g",
+                        {"p": 1, "n": "Iron Ore", "g": "default"}, "idx_inventory_lookup"),
+    "npc_by_name": ("SELECT * FROM npcs WHERE name LIKE :n AND game_id = :g", {"n": "Elara%", "g": "default"}, "idx_npc_name_nocase"),
+    "object_at": ("SELECT * FROM world_objects WHERE z = :z AND x = :x AND y = :y AND game_id = :g",
+                  {"z": 0, "x": 0, "y": 0, "g": "default"}, "idx_wobj_location"),
+}
+
+
+def schema_version(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at REAL)"
+    ))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def run_migrations(engine):
+    """Apply every pending migration. Returns the names applied."""
+    with engine.begin() as conn:
+        current = schema_version(conn)
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": time.time()}
+            )
+        print(f"Migrations: Applied {version:03d}_{name}")
+        applied.append(name)
+    return applied
+
+
+def check_query_plans(engine):
+    """{query name: (uses its index, plan text)}; prints a warning for any that do not."""
+    results = {}
+    with engine.connect() as conn:
+        # EXPLAIN never checks the schema cookie, so a pooled connection keeps planning
+        # against dropped indexes: reading sqlite_master reloads its schema, and keying the
+        # text on the cookie skips statements the driver cached before the change
+        conn.execute(text("SELECT COUNT(*) FROM sqlite_master"))
+        cookie = conn.execute(text("PRAGMA schema_version")).scalar()
+        for name, (sql, params, index) in HOT_QUERIES.items():
+            explain = text(f"EXPLAIN QUERY PLAN {sql} -- schema {cookie}")
+            plan = " | ".join(row[-1] for row in conn.execute(explain, params))
+            results[name] = (index in plan, plan)
+            if index not in plan:
+                print(f"Migrations: WARNING hot query '{name}' does not use {index}: {plan}")
+    return results
@@ -1,7 +1,16 @@
-from .database import MapTile, NPC, Monster, CombatEncounter, InventoryItem, Player
+from .database import NPC, Monster, InventoryItem
 from sqlalchemy.orm.attributes import flag_modified
 from .items import ITEM_TEMPLATES
 from .generator import LevelBuilder
+from .layers import layer_store
+from .tiles import tile_flags, WALKABLE, GATHERABLE, INTERACTABLE
+from .fov import field_of_view
+from .pathing import find_path
+from .gamedata import PATH_CONFIG
+from .triggers import triggers
+from .metrics import metrics
+from .context import game_context
+from .occupancy import occupancy
 
 class MovementSystem:
     """
@@ -12,6 +21,7 @@ class MovementSystem:
     - Interaction triggering (Doors)
     - Combat triggering (Monsters)
     - NPC displacement
+    - Click-to-move (multi-step routes)
     """
     def __init__(self, dm):
         self.dm = dm
@@ -19,8 +29,7 @@ class MovementSystem:
 
     def move_player(self, dx, dy):
         """Clean robust movement logic."""
-        # Use fresh query to ensure attachment to current thread's session
-        player = self.session.query(Player).first()
+        player = self.dm.player
         if not player: return [0,0,0], "Error: No Player Found"
         
         # 1. Calculate Target
@@ -28,157 +37,71 @@ class MovementSystem:
         new_y = player.y + dy
         new_z = player.z
         
-        print(f"DM: Move Request -> ({new_x}, {new_y}, {new_z})")
-
         # 2. Check Map Collision
-        tile = self.session.query(MapTile).filter_by(x=new_x, y=new_y, z=new_z).first()
+        tile_type = layer_store.get(self.session, new_x, new_y, new_z)
+        hits = triggers.at(new_z, new_x, new_y) # Portals, doors & landmarks here (data/triggers.json)
         
         # Auto-create wall if void (safety)
-        if not tile:
+        if tile_type is None:
             # If we are in 'void', assume wall? Or allow generation hook?
             # For now, simplistic wall.
             if new_z == 0: # Dungeon
-                 tile = MapTile(x=new_x, y=new_y, z=new_z, tile_type="wall", is_visited=True)
-                 self.session.add(tile)
-                 self.session.commit()
+                 layer_store.put(self.session, new_x, new_y, new_z, "wall", visited=True)
+                 self._commit()
                  return [player.x, player.y, player.z], "You bump into a dark wall."
-            # Town bounds handled by generation usually
-            if new_z == 1:
-                # North Gate check
-                # Town is approx -20 to 20 range.
-                if new_y < -20: 
-                    # Transition to North Forest (Z=2)
-                    self.teleport_player(0, 29, 2) # South end of Forest
-                    return [0, 29, 2], "*** You enter the North Forest ***"
+            # Town bounds handled by generation usually; past them a void trigger may lead on
+            for trigger in hits:
+                if trigger["on"] == "void":
+                    return self._take_portal(trigger)
 
             return [player.x, player.y, player.z], "The path is blocked."
 
+        flags = tile_flags(tile_type)
+
         # Resource Gathering (Delegated to InteractionManager)
-        if tile.tile_type in ["rock", "flower_pot"]:
+        if flags & GATHERABLE:
              # We simulate a "gather" action on this tile
              msg = self.dm.interactions.handle_interaction("gather", "tile", f"{new_x},{new_y},{new_z}")
              # If successful (msg starts with "Success"), we usually stay put? 
              # Or moved? The original logic returned player pos (didn't move).
              return [player.x, player.y, player.z], msg
 
-        if tile.tile_type not in ["floor", "floor_wood", "floor_volcanic", "floor_ice", "door", "door_stone", "open_door", "grass", "bridge", "steam_vent", "lava", "ice_spikes", "signpost", "street_lamp", "fountain", "stairs_down"]:
-             print(f"DEBUG: Move Blocked! Tile Type: '{tile.tile_type}' not in whitelist.")
+        if not flags & WALKABLE:
              # Block: wall, wall_house, tree, water, anvil, shelf
-             if not tile.is_visited:
-                 tile.is_visited = True
-                 self.session.commit()
-             return [player.x, player.y, player.z], f"You bump into a wall ({tile.tile_type})."
+             if layer_store.set_visited(self.session, new_x, new_y, new_z):
+                 self._commit()
+             return [player.x, player.y, player.z], f"You bump into a wall ({tile_type})."
 
         # 3. Check Door Transition (Tile Event)
-        if tile.tile_type == "stairs_down":
+        if tile_type == "stairs_down":
              if new_z == 1: # Town -> Dungeon
                  self.teleport_player(0, 0, 0)
                  return [0, 0, 0], "*** You descend into the Dark Dungeon... ***"
 
-        if tile.tile_type in ["door", "door_stone"]:
-            # Hacky Secret Door check (Dungeon -> Town)
-            print(f"DM: Door interaction at {new_x},{new_y},{new_z}")
-            
-            override_narrative = None
-
-            # --- TOWN BUILDINGS (Z=1) ---
-            if new_z == 1:
-                # Town Hall (0, 4) - Door on North Wall
-                if new_x == 0 and new_y == 4:
-                    if player.y < 4: override_narrative = "You enter the Town Hall."
-                    else: override_narrative = "You exit the Town Hall."
-
-                # Smithy (8, 9) - Door on West Wall
-                if new_x == 8 and new_y == 9:
-                    if player.x < 8: override_narrative = "You enter the Smithy."
-                    else: override_narrative = "You exit the Smithy."
-
-                # Alchemist (-8, 9) - Door on East Wall
-                if new_x == -8 and new_y == 9:
-                    if player.x > -8: override_narrative = "You enter the Alchemist's Shop."
-                    else: override_narrative = "You leave the Alchemist's Shop."
-            
-            # If we set a narrative, we should NOT return yet, but allow the fall-through to save state.
-            # However, we need to pass this string down. 
-            # We will attach it to the instance temporarily or handle it at the end? 
-            # Easier hacks: We can just manually commit here and then return? 
-            # NO, let's just let it fall through and handle the narrative at the end.
-            
-            if new_z == 0 and abs(new_x) <= 2 and new_y >= 28: # Dungeon Exit Range
-                self.teleport_player(0, 0, 1) # Town
-                
-                # ... (Keep existing Elara/NPC return logic) ...
-                # (For brevity, I assume I don't need to re-copy all NPC logic if I just insert the Fire Dungeon check before returning)
-                return [0, 0, 1], "*** You emerge into Oakhaven! ***"
-
-            # --- FIRE DUNGEON ENTRANCE (Forest Z=2 -> Z=3) ---
-            # Location approx (-15, 15)
-            if new_z == 2 and abs(new_x - (-15)) <= 1 and abs(new_y - 15) <= 1:
-                self.teleport_player(0, 0, 3) # Fire Dungeon Start
-                
-                # Auto-start Quest if not active
-                try:
-                    from .quests import QuestManager
-                    qm = QuestManager(self.session, player)
-                    if qm.get_status("elemental_balance") == "available":
-                        qm.accept_quest("elemental_balance")
-                except Exception as e:
-                    print(f"Quest Auto-Start Error: {e}")
-
-                return [0, 0, 3], "*** You descend into the Volcanic Depths! ***<br><i>(Quest 'Elemental Balance' Updated)</i>"
-
-            # --- ICE DUNGEON ENTRANCE (Forest Z=2 -> Z=4) ---
-            # Location approx (-15, -20)
-            if new_z == 2 and abs(new_x - (-15)) <= 1 and abs(new_y - (-20)) <= 1:
-                self.teleport_player(0, 0, 4) # Ice Dungeon Start
-                return [0, 0, 4], "*** You enter the Frozen Caverns! ***"
-
-            # ... (Rest of existing door logic if needed) ...
+        override_narrative = None
+        if tile_type in ["door", "door_stone"]:
+            # Door triggers: portals (dungeon exit, fire/ice entrances) or enter/exit narration
+            for trigger in hits:
+                if trigger["on"] != "door": continue
+                if "to" in trigger:
+                    return self._take_portal(trigger)
+                if override_narrative is None:
+                    ex, ey = trigger["enter_step"]
+                    entering = dx * ex + dy * ey > 0 # Any step with a component along enter_step, diagonals too
+                    override_narrative = trigger["enter"] if entering else trigger["exit"]
             
             # Normal door (open it?)
-            tile.tile_type = "open_door" # Visual change?
-            # Treat as floor for now
-        
+            layer_store.set_type(self.session, new_x, new_y, new_z, "open_door") # Visual change?
             # Treat as floor for now
         
-        # 3b. DUNGEON EXITS (Z=0)
-        # Entry Door (0, -1) or (-1 to 1 range close to start)
-        if new_z == 0 and abs(new_x) <= 1 and new_y <= -1:
-             self.teleport_player(0, 0, 1) # Back to Town
-             return [0, 0, 1], "*** You ascend the stairs to Oakhaven. ***"
-             
-        # Boss Exit Door (0, 32)
-        if new_z == 0 and abs(new_x) <= 1 and new_y >= 32:
-             self.teleport_player(0, 0, 1) # Back to Town
-             return [0, 0, 1], "*** You escape the dungeon triumphantly! ***"
-             
-        # 3c. FIRE DUNGEON EXIT (Z=3)
-        # Entry Door moved to (-2, 0) based on user feedback
-        if new_z == 3 and abs(new_x - (-2)) <= 1 and abs(new_y - 0) <= 1:
-             self.teleport_player(-15, 15, 2) # Back to Forest Entrance
-             return [-15, 15, 2], "*** You escape the searing heat and return to the cool forest. ***"
-
-        # 3e. ICE DUNGEON EXIT (Z=4)
-        # Door is at (0, -2).
-        if new_z == 4 and new_x == 0 and new_y <= -2:
-             self.teleport_player(-15, -20, 2) # Back to Forest
-             return [-15, -20, 2], "*** You leave the freezing cold behind. ***"
-
-
-        # 3d. Check Zone Transitions (Edges)
-        # Forest (Z=2) -> Town (Z=1) : South Edge (y > 28)
-        if new_z == 2 and new_y >= 29:
-             self.teleport_player(0, -18, 1) # North Gate of Town
-             return [0, -18, 1], "You travel south back to Oakhaven."
-             
-        # Town (Z=1) -> Forest (Z=2) : North Edge (y < -20)
-        # (Assuming town map allows walking north)
-        if new_z == 1 and new_y <= -19:
-             self.teleport_player(0, 28, 2) # South Road of Forest
-             return [0, 28, 2], "You head north into the deep forest."
+        # 3b. Level exits & zone edges (walk triggers)
+        for trigger in hits:
+            if trigger["on"] == "walk":
+                return self._take_portal(trigger)
         
         # 4. Check Monsters (Combat Trigger)
-        enemy = self.session.query(Monster).filter_by(x=new_x, y=new_y, z=new_z, is_alive=True).first()
+        enemy_id = occupancy.first(self.session, "monster", new_x, new_y, new_z)
+        enemy = self.session.get(Monster, enemy_id) if enemy_id else None
         if enemy:
              # Start new Encounter
              msg_data = self.dm.combat.start_combat(enemy)
@@ -190,7 +113,7 @@ class MovementSystem:
         if self.dm.combat.is_active():
             # Combat Movement Logic
             # 1. Check Turn & Moves
-            encounter = self.session.query(CombatEncounter).filter_by(is_active=True).first()
+            encounter = game_context(self.session).encounter
             if not encounter:
                  pass
             elif encounter.turn_order[encounter.current_turn_index]["type"] != "player":
@@ -206,14 +129,16 @@ class MovementSystem:
             
             # 3. Decrement Counter (via combat)
             res = self.dm.combat.player_action("move") # returns {events: []}
-            self.session.commit()
+            self._commit()
             
             # Return events so frontend can play them
             return [new_x, new_y, new_z], res 
 
         # 5. Check NPCs (Blocking? Or Chat Trigger?)
-        npc = self.session.query(NPC).filter_by(x=new_x, y=new_y, z=new_z).first()
+        npc_id = occupancy.first(self.session, "npc", new_x, new_y, new_z)
+        npc = self.session.get(NPC, npc_id) if npc_id else None
         if npc:
+             grid = layer_store.grid(self.session, new_z)
              # Attempt to displace NPC to make room
              candidates = [(new_x+1, new_y), (new_x-1, new_y), (new_x, new_y+1), (new_x, new_y-1)]
              moved_npc = False
@@ -222,14 +147,10 @@ class MovementSystem:
                  if cx == player.x and cy == player.y: continue # Don't swap immediately
                  
                  # Check Wall/Void
-                 ct = self.session.query(MapTile).filter_by(x=cx, y=cy, z=new_z).first()
-                 if not ct or ct.tile_type in ["wall", "water", "void"]: continue
+                 if not grid.walkable(cx, cy): continue
                  
                  # Check Occupancy
-                 occ = self.session.query(NPC).filter_by(x=cx, y=cy, z=new_z).first()
-                 if occ: continue
-                 occ_m = self.session.query(Monster).filter_by(x=cx, y=cy, z=new_z).first()
-                 if occ_m: continue
+                 if occupancy.occupied(self.session, cx, cy, new_z): continue
                  
                  # Move NPC
                  npc.x = cx
@@ -251,17 +172,18 @@ class MovementSystem:
         
         # --- NPC AMBIENT MOVEMENT ---
         try:
-             self.dm.world_sim.process_npc_schedules()
-             
-             # --- MONSTER ROAMING & AGGRO ---
-             if new_z != 1: # Not in Safe Town
-                env_msg = self.dm.world_sim.process_environment_turn()
-                if env_msg: 
-                    pass
+            with metrics.phase("world_sim"):
+                self.dm.world_sim.process_npc_schedules()
+                
+                # --- MONSTER ROAMING & AGGRO ---
+                if new_z != 1: # Not in Safe Town
+                    env_msg = self.dm.world_sim.process_environment_turn()
+                    if env_msg: 
+                        pass
         except Exception as e:
              print(f"Error processing NPCs/Env: {e}")
         
-        self.session.commit() # Commit positions so NPC updates see new player pos
+        self._commit() # Commit positions so NPC updates see new player pos
         self.update_visited(new_x, new_y, new_z)
         
         narrative = "You move forward."
@@ -305,15 +227,13 @@ class MovementSystem:
                       
                       if target_x == player.x and target_y == player.y: continue 
                       
-                      ct = self.session.query(MapTile).filter_by(x=target_x, y=target_y, z=f.z).first()
-                      if ct and ct.tile_type not in ["wall", "water", "void"]:
+                      if layer_store.grid(self.session, f.z).walkable(target_x, target_y):
                            f.x = target_x
                            f.y = target_y
                            self.session.add(f)
 
-        # 7. Update Visibility
-        self.update_visited(new_x, new_y, new_z)
-        self.dm.save()
+        # 7. Save (visibility was updated right after the move)
+        self._commit(save=True)
         
         # 8. Return Narrative (Static + Dynamic Events)
         old_room = self.dm._generate_description(old_x, old_y, old_z)
@@ -321,8 +241,8 @@ class MovementSystem:
         
         desc = ""
         
-        # Check for Local Override (from Door logic)
-        if 'override_narrative' in locals() and override_narrative:
+        # Check for Local Override (from Door triggers)
+        if override_narrative:
              desc = override_narrative
         
         elif new_room and new_room != old_room:
@@ -330,46 +250,18 @@ class MovementSystem:
         elif new_room == "Dungeon Entrance" and not desc:
              pass
 
-        # Check Town Doors (Z=1)
-        if new_z == 1:
-            town_doors = {
-                (0, 4):  {"name": "Town Hall", "enter": (0, 1)},  
-                (8, 9):  {"name": "Blacksmith", "enter": (1, 0)}, 
-                (-8, 9): {"name": "Alchemist", "enter": (-1, 0)} 
-            }
-            if (new_x, new_y) in town_doors:
-                info = town_doors[(new_x, new_y)]
-                desc = f"Approaching {info['name']}..." # Simplified logic
-        
-        elif new_z == 2:
+        if new_z == 2 and not override_narrative:
              desc = "You are wandering the North Forest."
                     
-        # Check for proximity events (Greetings & Landmarks)
-        if new_z == 2:
-             # Fire Dungeon Entrance
-             if abs(new_x - (-15)) <= 3 and abs(new_y - 15) <= 3:
-                 desc += " <br><span style='color: #ff4500;'>Heat radiates from the stone archway...</span>"
+        # Check for proximity events (Landmarks & Greetings)
+        for trigger in hits:
+            if trigger["on"] == "near":
+                desc += f" <br><span style='color: {trigger['color']};'>{trigger['text']}</span>"
 
-        nearby_npcs = self.session.query(NPC).filter(
-            NPC.x.between(new_x-2, new_x+2),
-            NPC.y.between(new_y-2, new_y+2),
-            NPC.z == new_z
-        ).all()
-        
-        for n in nearby_npcs:
-            dist = max(abs(n.x - new_x), abs(n.y - new_y)) 
-            if dist <= 4: 
-                greeting = ""
-                if "Elara" in n.name:
-                    qs = n.quest_state or {}
-                    status = qs.get("status", "captive")
-                    if status == "captive":
-                        greeting = "Elara calls out: 'Over here! I need your help!'"
-                elif "Gareth" in n.name: greeting = "Gareth hails you: 'Well met, traveler.'"
-                elif "Elder" in n.name: greeting = "The Elder waves a weary hand."
-                
-                if greeting:
-                    desc += f" <br><span style='color: #fdcb6e;'>{greeting}</span>"
+        for i in occupancy.near(self.session, new_x, new_y, new_z, 2, "npc"):
+            greeting = triggers.greeting(self.session.get(NPC, i))
+            if greeting:
+                desc += f" <br><span style='color: #fdcb6e;'>{greeting}</span>"
         
         return [new_x, new_y, new_z], desc
 
@@ -379,14 +271,14 @@ class MovementSystem:
         if self.dm.combat.is_active():
             self.dm.combat.end_combat()
 
-        player = self.session.query(Player).first()
+        player = self.dm.player
         player.x = x
         player.y = y
         player.z = z
         self.session.commit()
         
         # Check if map exists, if not generate
-        if not self.session.query(MapTile).filter_by(z=z).first():
+        if not layer_store.has_level(self.session, z):
             if z == 1:
                 self.dm._generate_town(z)
             elif z == 2:
@@ -404,7 +296,7 @@ class MovementSystem:
         
         # Handle Followers (Elara)
         if z == 1:
-             elara = self.session.query(NPC).filter(NPC.name.like("%Elara%")).first()
+             elara = self.session.query(NPC).filter(NPC.name.like("Elara%")).first()
              if elara:
                   qs = elara.quest_state or {}
                   if qs.get("status") == "escorting":
@@ -418,49 +310,81 @@ class MovementSystem:
                        self.session.commit()
 
     def update_visited(self, cx, cy, cz):
-        # 1. Fetch Area (Square covers Max Diamond Radius 5)
-        tiles = self.session.query(MapTile).filter(
-            MapTile.x.between(cx-5, cx+5),
-            MapTile.y.between(cy-5, cy+5),
-            MapTile.z == cz
-        ).all()
-        
-        # 2. Build Memory Map
-        tile_map = {(t.x, t.y): t for t in tiles}
-        
-        # 3. BFS Flood Fill for Line of Sight
-        queue = [(cx, cy, 0)] # x, y, dist
-        visited = set([(cx, cy)])
+        """Reveal what the player sees from (cx, cy, cz). Returns (newly revealed cells, lit cells)."""
+        with metrics.phase("fog"):
+            lit = field_of_view(layer_store.grid(self.session, cz), cx, cy)
+            revealed = layer_store.reveal(self.session, cz, lit) # One OR on the level's fog bitset
+        self._commit()
+        return revealed, lit
+
+    def travel_to(self, tx, ty):
+        """
+        Click-to-move: walk an A* route to (tx, ty) on the current level, one move_player()
+        step at a time, in a single transaction. Stops at the first step that does not end
+        on the planned cell (blocked, gathering, level change), when combat starts, and after
+        stepping onto an interactable tile (doors, stairs, signs). In combat only the first
+        step is taken, since every move spends the turn's movement.
+        Returns (position, result, cells walked); `result` is the last step's result if it
+        is an event dict, otherwise the step narratives joined.
+        """
+        player = self.dm.player
+        if not player: return [0,0,0], "Error: No Player Found", []
+        z = player.z
+        grid = layer_store.grid(self.session, z)
+
+        def blocked(x, y):
+            # Plan through explored ground only, around whoever stands in the way
+            return not layer_store.is_visited(self.session, x, y, z) or occupancy.occupied(self.session, x, y, z)
+
+        route = find_path(grid, (player.x, player.y), (tx, ty), blocked=blocked)
+        if not route:
+            return [player.x, player.y, player.z], "You see no way there.", []
+        if self.dm.combat.is_active():
+            route = route[:1]
+
+        walked, narratives, result = [], [], None
+        # Per session (this system is shared by every request of the game): commits become flushes
+        self.session.info["walking"] = True
+        try:
+            for x, y in route[:PATH_CONFIG["max_steps"]]:
+                pos, result = self.move_player(x - player.x, y - player.y)
+                if isinstance(result, str) and result and result not in narratives:
+                    narratives.append(result)
+                if pos != [x, y, z]:
+                    break
+                walked.append(pos)
+                if self.dm.combat.is_active() or grid.at(x, y) & INTERACTABLE:
+                    break
+        finally:
+            self.session.info.pop("walking", None)
+        self.dm.save()
+
+        if not isinstance(result, dict):
+            result = "<br>".join(narratives)
+        return [player.x, player.y, player.z], result, walked
+
+    def _take_portal(self, trigger):
+        """Teleport through a portal trigger. Returns move_player's (position, narrative)."""
+        x, y, z = trigger["to"]
+        self.teleport_player(x, y, z)
         
-        blockers = ["wall", "wall_grey", "wall_house", "void", "door", "tree", "bedrock_wall"]
+        # Auto-start Quest if not active
+        if "quest" in trigger:
+            try:
+                from .quests import QuestManager
+                qm = QuestManager(self.session, self.dm.player)
+                if qm.get_status(trigger["quest"]) == "available":
+                    qm.accept_quest(trigger["quest"])
+            except Exception as e:
+                print(f"Quest Auto-Start Error: {e}")
         
-        # We process the queue
-        idx = 0
-        while idx < len(queue):
-            curr_x, curr_y, dist = queue[idx]
-            idx += 1
-            
-            # Reveal this tile
-            if (curr_x, curr_y) in tile_map:
-                t = tile_map[(curr_x, curr_y)]
-                if not t.is_visited:
-                    t.is_visited = True
-                
-                # If this tile is opaque, we see IT, but not PAST it.
-                if t.tile_type in blockers:
-                    continue
-            else:
-                # Void/Empty space acts as full blocker
-                continue
+        return [x, y, z], trigger["text"]
 
-            # Check Range limit (Radius 5)
-            if dist >= 5: continue
-            
-            # Propagate to Neighbors
-            for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                nx, ny = curr_x + dx, curr_y + dy
-                if (nx, ny) not in visited:
-                    visited.add((nx, ny))
-                    queue.append((nx, ny, dist + 1))
-                    
-        self.session.commit()
+    def _commit(self, save=False):
+        """Commit (through dm.save() for the final save of a move), or only flush during travel_to()."""
+        if self.session.info.get("walking"):
+            self.session.flush()
+        elif save:
+            self.dm.save()
+        else:
+            self.session.commit()
@@ -0,0 +1,225 @@
+"""
+Occupancy Index.
+Who stands where, per level: cell -> the live monsters, NPCs and the player on it, kept in
+memory so collision checks and proximity scans (combat sweeps, greetings, AI steps) are
+dictionary reads instead of SQL point/range queries.
+
+    occupancy.occupied(session, x, y, z)
+    occupancy.first(session, "monster", x, y, z)     # -> id or None
+    occupancy.near(session, x, y, z, 3, "monster")   # -> [id, ...]
+
+Entries are (kind, id) pairs, never ORM objects, so the index outlives sessions; callers
+load the rows they need (`session.get` is free for rows the request already has).
+
+- A level is built with one query per entity table on first use (cached per (game_id, z)).
+- Flushed position / alive changes are kept per session and overlaid on its reads right
+  after each flush, the point where the same checks used to see them through SQL (autoflush
+  is off, so movers flush). Other requests only see them once the session commits, when
+  they are applied to the shared levels; a rollback just drops them.
+- A level built by a session with flushed moves would read them back from the DB, so it
+  serves that session but is not shared.
+- Bulk deletes bypass the ORM: `reset_game()` and game unloading evict the whole game.
+"""
+import threading
+
+from sqlalchemy import event, inspect, select
+
+from .database import SessionFactory, DEFAULT_GAME, Monster, NPC, Player
+
+KINDS = {Monster: "monster", NPC: "npc", Player: "player"}
+
+
+def entity_key(obj):
+    """(kind, id) of a Monster, NPC or Player row."""
+    return (KINDS[type(obj)], obj.id)
+
+
+class _Level:
+    __slots__ = ("cells", "where")
+
+    def __init__(self):
+        self.cells = {}     # (x, y) -> [(kind, id), ...]
+        self.where = {}     # (kind, id) -> (x, y)
+
+    def add(self, key, x, y):
+        self.remove(key)
+        self.cells.setdefault((x, y), []).append(key)
+        self.where[key] = (x, y)
+
+    def remove(self, key):
+        cell = self.where.pop(key, None)
+        if cell is not None:
+            keys = self.cells[cell]
+            keys.remove(key)
+            if not keys:
+                del self.cells[cell]
+
+
+class _Move:
+    """A session's flushed, uncommitted placement of one entity."""
+    __slots__ = ("game_id", "origin_z", "z", "x", "y", "alive")
+
+    def __init__(self, game_id, origin_z, z, x, y, alive):
+        self.game_id = game_id
+        self.origin_z = origin_z # Level it stood on when the transaction began
+        self.z = z
+        self.x = x
+        self.y = y
+        self.alive = alive
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._levels = {}   # (game_id, z) -> _Level
+
+    # --- Reads ---
+
+    def at(self, session, x, y, z):
+        """[(kind, id)] standing on (x, y, z)."""
+        with self._lock:
+            return self._keys(session, x, y, z)
+
+    def occupied(self, session, x, y, z, ignore=None):
+        """Is any live monster, NPC or the player on (x, y, z)? `ignore`: a (kind, id) to skip."""
+        with self._lock:
+            return any(key != ignore for key in self._keys(session, x, y, z))
+
+    def first(self, session, kind, x, y, z):
+        """Id of a `kind` entity on (x, y, z), or None."""
+        with self._lock:
+            for k, entity_id in self._keys(session, x, y, z):
+                if k == kind:
+                    return entity_id
+        return None
+
+    def near(self, session, x, y, z, radius, kind):
+        """Ids of the `kind` entities within `radius` (Chebyshev) of (x, y, z)."""
+        with self._lock:
+            return [
+                entity_id for (k, entity_id), (ex, ey) in self._positions(session, z)
+                if k == kind and abs(ex - x) <= radius and abs(ey - y) <= radius
+            ]
+
+    # --- Commit / Rollback ---
+
+    def publish(self, session):
+        """Apply the moves this session committed to the shared levels (called after commit)."""
+        moves = session.info.pop("occupancy_moves", None)
+        if not moves:
+            return
+        with self._lock:
+            for key, move in moves.items():
+                for z in {move.origin_z, move.z}:
+                    level = self._levels.get((move.game_id, z))
+                    if level is not None:
+                        level.remove(key)
+                level = self._levels.get((move.game_id, move.z))
+                if move.alive and level is not None:
+                    level.add(key, move.x, move.y)
+
+    def discard(self, session):
+        """Drop the session's uncommitted moves (called after rollback)."""
+        session.info.pop("occupancy_moves", None)
+
+    # --- Cache Management ---
+
+    def evict_level(self, z, game_id=DEFAULT_GAME):
+        with self._lock:
+            self._levels.pop((game_id, z), None)
+
+    def evict_game(self, game_id):
+        with self._lock:
+            for key in [k for k in self._levels if k[0] == game_id]:
+                del self._levels[key]
+
+    def clear(self):
+        with self._lock:
+            self._levels.clear()
+
+    # --- Internals ---
+
+    def _level(self, session, z):
+        game_id = session.info.get("game_id", DEFAULT_GAME)
+        level = self._levels.get((game_id, z))
+        if level is None:
+            level = self._build(session, game_id, z)
+            if not session.info.get("occupancy_moves"):
+                self._levels[(game_id, z)] = level
+        return level
+
+    def _keys(self, session, x, y, z):
+        """[(kind, id)] on (x, y, z) as `session` sees it (its own flushed moves included)."""
+        keys = self._level(session, z).cells.get((x, y), ())
+        moves = session.info.get("occupancy_moves")
+        if not moves:
+            return list(keys)
+        game_id = session.info.get("game_id", DEFAULT_GAME)
+        return [key for key in keys if key not in moves] + [
+            key for key, m in moves.items()
+            if m.alive and (m.game_id, m.z, m.x, m.y) == (game_id, z, x, y)
+        ]
+
+    def _positions(self, session, z):
+        """[((kind, id), (x, y))] on level z as `session` sees it."""
+        where = self._level(session, z).where
+        moves = session.info.get("occupancy_moves")
+        if not moves:
+            return where.items()
+        game_id = session.info.get("game_id", DEFAULT_GAME)
+        return [(key, cell) for key, cell in where.items() if key not in moves] + [
+            (key, (m.x, m.y)) for key, m in moves.items() if m.alive and m.game_id == game_id and m.z == z
+        ]
+
+    def _build(self, session, game_id, z):
+        level = _Level()
+        for model, kind in KINDS.items():
+            query = select(model.id, model.x, model.y).where(model.game_id == game_id, model.z == z)
+            if model is Monster:
+                query = query.where(Monster.is_alive == True)
+            for entity_id, x, y in session.execute(query):
+                level.add((kind, entity_id), x, y)
+        return level
+
+    def _record(self, session, obj, deleted=False):
+        """Remember a flushed entity's cell (or that it is gone) until the session commits."""
+        key = entity_key(obj)
+        moves = session.info.setdefault("occupancy_moves", {})
+        move = moves.get(key)
+        origin_z = move.origin_z if move is not None else _previous(inspect(obj), "z", obj.z)
+        alive = not deleted and (not isinstance(obj, Monster) or obj.is_alive)
+        moves[key] = _Move(obj.game_id, origin_z, obj.z, obj.x, obj.y, alive)
+
+
+def _previous(state, attr, current):
+    """Value of `attr` before this flush (the current value if it did not change)."""
+    if state.pending or state.transient:
+        return current
+    deleted = state.attrs[attr].history.deleted
+    return deleted[0] if deleted else current
+
+
+occupancy = OccupancyIndex()
+
+
+# --- Session Hooks ---
+
+@event.listens_for(SessionFactory, "after_flush")
+def _track_positions(session, flush_context):
+    # History is still intact here (it is reset in after_flush_postexec)
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) in KINDS:
+            occupancy._record(session, obj)
+    for obj in session.deleted:
+        if type(obj) in KINDS:
+            occupancy._record(session, obj, deleted=True)
+
+
+@event.listens_for(SessionFactory, "after_commit")
+def _publish_moves(session):
+    occupancy.publish(session)
+
+
+@event.listens_for(SessionFactory, "after_rollback")
+def _discard_moves(session):
+    occupancy.discard(session)
@@ -0,0 +1,68 @@
+"""
+Pathing.
+A* over a level's TileGrid (tiles.py) for click-to-move: 4-way steps (the moves the player
+can make), Manhattan distance as the heuristic. Hazards and interactable tiles cost extra,
+so routes go around lava, and around doors and stairs (which end a walk), when they can.
+
+    route = find_path(layer_store.grid(session, z), (px, py), (tx, ty), blocked=...)
+
+The goal itself is always enterable as the last step, whatever stands there: the final
+move decides what happens (attack a monster, gather a rock, open a door).
+"""
+import heapq
+
+from .gamedata import PATH_CONFIG
+from .tiles import WALKABLE, HAZARD, INTERACTABLE
+
+_STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+def find_path(grid, start, goal, blocked=None, max_nodes=None):
+    """
+    Cells from `start` (exclusive) to `goal` (inclusive), or None if there is no route
+    within `max_nodes` expanded cells. `blocked(x, y)` vetoes cells the grid allows.
+    """
+    if start == goal:
+        return []
+    limit = PATH_CONFIG["max_nodes"] if max_nodes is None else max_nodes
+    detour_cost = PATH_CONFIG["detour_cost"]
+    gx, gy = goal
+
+    came_from = {start: None}
+    cost = {start: 0}
+    frontier = [(abs(start[0] - gx) + abs(start[1] - gy), 0, start)]
+    expanded = 0
+    while frontier and expanded < limit:
+        _, g, cell = heapq.heappop(frontier)
+        if cell == goal:
+            return _route(came_from, goal)
+        if g > cost[cell]:
+            continue # Stale entry
+        expanded += 1
+        x, y = cell
+        for dx, dy in _STEPS:
+            nxt = (x + dx, y + dy)
+            if nxt != goal:
+                flags = grid.at(*nxt)
+                if not flags & WALKABLE or (blocked and blocked(*nxt)):
+                    continue
+                step = detour_cost if flags & (HAZARD | INTERACTABLE) else 1
+            else:
+                step = 1
+            new_cost = g + step
+            if new_cost < cost.get(nxt, new_cost + 1):
+                cost[nxt] = new_cost
+                came_from[nxt] = cell
+                h = abs(nxt[0] - gx) + abs(nxt[1] - gy)
+                heapq.heappush(frontier, (new_cost + h, new_cost, nxt))
+    return None
+
+
+def _route(came_from, goal):
+    route = []
+    cell = goal
+    while came_from[cell] is not None:
+        route.append(cell)
+        cell = came_from[cell]
+    route.reverse()
+    return route
@@ -1,5 +1,9 @@
 
 # Quest Definitions and Logic
+from collections import Counter
+from functools import lru_cache
+
+from .database import PlayerQuest, QuestProgress
 
 QUEST_DATABASE = {
     "elemental_balance": {
@@ -35,6 +39,7 @@ QUEST_DATABASE = {
         "title": "The Legendary Metal",
         "giver": "Gareth Ironhand",
         "description": "Find a Titanium Fragment in the Earth Dungeon.",
+        "requirements": {"prerequisites": ["iron_supply"]},
         "objectives": [
             {"type": "item", "target": "Titanium Fragment", "count": 1}
         ],
@@ -61,6 +66,7 @@ QUEST_DATABASE = {
         "title": "Fire and Ice",
         "giver": "Seraphina",
         "description": "Retrieve an Everburning Cinder and a Freezing Spike for a master potion.",
+        "requirements": {"prerequisites": ["herbal_remedy"]},
         "objectives": [
             {"type": "item", "target": "Everburning Cinder", "count": 1},
             {"type": "item", "target": "Freezing Spike", "count": 1}
@@ -71,19 +77,24 @@ QUEST_DATABASE = {
     }
 }
 
+# Quest giver index: built once at load instead of scanning QUEST_DATABASE per NPC
+QUEST_GIVERS = {}
+for _qid, _q in QUEST_DATABASE.items():
+    QUEST_GIVERS.setdefault(_q["giver"], []).append(_qid)
+
+@lru_cache(maxsize=None)
+def quests_given_by(npc_name):
+    """Quest ids an NPC hands out (giver names match as substrings of the NPC name)."""
+    return tuple(qid for giver, qids in QUEST_GIVERS.items() if giver in npc_name for qid in qids)
+
 class QuestManager:
     def __init__(self, session, player):
         self.session = session
         self.player = player
-        # Ensure quest state structure exists
-        if not self.player.quest_state:
-            self.player.quest_state = {"active": {}, "completed": []}
             
     def get_status(self, quest_id):
-        qs = self.player.quest_state
-        if quest_id in qs.get("completed", []): return "completed"
-        if quest_id in qs.get("active", {}): return "active"
-        return "available"
+        row = self.player.quest_rows.get(quest_id)
+        return row.status if row else "available"
 
     def accept_quest(self, quest_id):
         if quest_id not in QUEST_DATABASE: return False
@@ -97,48 +108,56 @@ class QuestManager:
         if "max_level" in reqs and self.player.level > reqs["max_level"]:
             return False # Too high level (e.g. tutorial quest)
         
-        qs = self.player.quest_state
-        # Init structure if missing
-        if "active" not in qs: qs["active"] = {}
-        
-        # Add to active
-        qs["active"][quest_id] = {"progress": {}}
-        
-        # Save
-        self.player.quest_state = qs
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(self.player, "quest_state")
+        # Add to active (a repeatable quest taken again starts from zero)
+        row = self.player.quest_rows.get(quest_id)
+        if row is None:
+            row = self.player.quest_rows[quest_id] = PlayerQuest(quest_id=quest_id)
+        row.status = "active"
+        row.progress.clear()
         
         print(f"Quest Accepted: {QUEST_DATABASE[quest_id]['title']}")
         return True
 
+    def meets_requirements(self, quest_id):
+        """Level range and prerequisite quests ("requirements" in QUEST_DATABASE)."""
+        reqs = QUEST_DATABASE[quest_id].get("requirements", {})
+        if "min_level" in reqs and self.player.level < reqs["min_level"]: return False
+        if "max_level" in reqs and self.player.level > reqs["max_level"]: return False
+        return all(self.get_status(pre) == "completed" for pre in reqs.get("prerequisites", []))
+
+    def indicator_for(self, npc_name):
+        """Quest marker shown over an NPC: "turn_in", "available" or "none"."""
+        quest_ids = quests_given_by(npc_name)
+        for qid in quest_ids:
+            if self.get_status(qid) == "active" and self.can_complete(qid):
+                return "turn_in"
+        for qid in quest_ids:
+            if self.get_status(qid) == "available" and self.meets_requirements(qid):
+                return "available"
+        return "none"
+
     def can_complete(self, quest_id):
         """Check if player has required items/kills."""
         if quest_id not in QUEST_DATABASE: return False
         
         q_data = QUEST_DATABASE[quest_id]
-        qs_active = self.player.quest_state.get("active", {}).get(quest_id, {})
-        progress = qs_active.get("progress", {})
+        row = self.player.quest_rows.get(quest_id)
+        progress = row.progress if row and row.status == "active" else {}
 
         # Check all objectives
+        item_counts = None
         for obj in q_data.get("objectives", []):
             if obj["type"] == "item":
-                # Check inventory
-                required_name = obj["target"]
-                count_needed = obj.get("count", 1)
-                
-                found_count = 0
-                for item in self.player.inventory:
-                    if item.name == required_name:
-                        found_count += 1
-                
-                if found_count < count_needed:
+                # Check inventory (one pass, shared by all item objectives)
+                if item_counts is None:
+                    item_counts = Counter(item.name for item in self.player.inventory)
+                if item_counts[obj["target"]] < obj.get("count", 1):
                     return False
             
             elif obj["type"] == "kill_boss":
                  target = obj["target"]
                  count_needed = obj.get("count", 1)
-                 current = progress.get(target, 0)
+                 current = progress[target].count if target in progress else 0
                  if current < count_needed:
                      return False
                      
@@ -146,31 +165,25 @@ class QuestManager:
 
     def record_kill(self, enemy_name):
         """Update progress for kill objectives."""
-        if not self.player.quest_state: return
-        
-        qs = self.player.quest_state
         changed = False
         
         # Check all active quests
-        for qid, q_data in qs.get("active", {}).items():
+        for qid, row in self.player.quest_rows.items():
             db_data = QUEST_DATABASE.get(qid)
-            if not db_data: continue
+            if not db_data or row.status != "active": continue
             
             for obj in db_data.get("objectives", []):
                 if obj["type"] == "kill_boss" and obj["target"] == enemy_name:
-                    # Update Progress
-                    prog = q_data.get("progress", {})
-                    old_val = prog.get(enemy_name, 0)
-                    if old_val < obj.get("count", 1):
-                         prog[enemy_name] = old_val + 1
-                         q_data["progress"] = prog
+                    # Update Progress (one counter row)
+                    prog = row.progress.get(enemy_name)
+                    if prog is None:
+                        prog = row.progress[enemy_name] = QuestProgress(target=enemy_name, count=0)
+                    if prog.count < obj.get("count", 1):
+                         prog.count += 1
                          changed = True
-                         print(f"Quest Update: {db_data['title']} - Killed {enemy_name} ({prog[enemy_name]}/{obj.get('count', 1)})")
+                         print(f"Quest Update: {db_data['title']} - Killed {enemy_name} ({prog.count}/{obj.get('count', 1)})")
         
         if changed:
-            self.player.quest_state = qs
-            from sqlalchemy.orm.attributes import flag_modified
-            flag_modified(self.player, "quest_state")
             self.session.commit()
 
     def complete_quest(self, quest_id):
@@ -224,17 +237,15 @@ class QuestManager:
                      ))
 
         # 3. Update State
-        qs = self.player.quest_state
-        if quest_id in qs["active"]:
-            del qs["active"][quest_id]
-        
-        if "completed" not in qs: qs["completed"] = []
-        if not q_data.get("repeatable"):
-            qs["completed"].append(quest_id)
-            
-        self.player.quest_state = qs
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(self.player, "quest_state")
+        row = self.player.quest_rows.get(quest_id)
+        if q_data.get("repeatable"):
+            if row is not None:
+                del self.player.quest_rows[quest_id] # Available again
+        else:
+            if row is None:
+                row = self.player.quest_rows[quest_id] = PlayerQuest(quest_id=quest_id)
+            row.status = "completed"
+            row.progress.clear()
         self.session.commit()
         
         print(f"Quest Completed: {q_data['title']}")
@@ -20,7 +20,6 @@ def roll_dice(dice_str: str) -> int:
     mod = int(modifier) if modifier else 0
     
     total = sum(random.randint(1, sides) for _ in range(count))
-    if sides == 20: print(f"DEBUG ROLL: {dice_str} -> {total} + {mod} = {total+mod}")
     return total + mod
 
 def calculate_hit(roll: int, ac: int) -> bool:
@@ -38,37 +37,25 @@ def calculate_damage(dice_str: str) -> int:
 
 def get_skill_level(player, skill):
     """Get the level of a specific skill for a player."""
-    data = player.skills or {}
-    if skill not in data: return 0
-    if isinstance(data[skill], int): return data[skill] 
-    return data[skill].get("level", 0)
+    row = player.skill_rows.get(skill)
+    return row.level if row else 0
 
 def award_skill_xp(player, skill, amount):
     """Award XP to a skill and check for level up."""
-    from sqlalchemy.orm.attributes import flag_modified
+    from .database import PlayerSkill
     
-    data = player.skills or {}
-    # Ensure dict structure
-    new_data = dict(data)
-    
-    if skill not in new_data:
-        new_data[skill] = {"level": 1, "xp": 0}
-    elif isinstance(new_data[skill], int):
-            new_data[skill] = {"level": new_data[skill], "xp": 0}
-            
-    s = new_data[skill]
-    s["xp"] += amount
+    s = player.skill_rows.get(skill)
+    if s is None:
+        s = player.skill_rows[skill] = PlayerSkill(skill=skill, level=1, xp=0)
+    s.xp += amount
     
     # Level Up Logic
-    threshold = s["level"] * 50
+    threshold = s.level * 50
     leveled_up = False
-    while s["xp"] >= threshold:
-            s["xp"] -= threshold
-            s["level"] += 1
-            threshold = s["level"] * 50
+    while s.xp >= threshold:
+            s.xp -= threshold
+            s.level += 1
+            threshold = s.level * 50
             leveled_up = True
-            
-    player.skills = new_data
-    flag_modified(player, "skills")
     
-    return leveled_up, s["level"]
+    return leveled_up, s.level
@@ -0,0 +1,107 @@
+"""
+State Map Encoding.
+The legacy map payload is {"x,y,z": tile_type}, which repeats the coordinates and the
+tile name for every tile. `map_encoding=rle` instead sends a per-response palette of
+tile types and row-major chunks of palette indices, run-length encoded:
+
+    {"encoding": "rle",
+     "palette": ["grass", "tree", ...],
+     "chunks": [{"z": 1, "x": 0, "y": 0, "w": 32, "h": 32, "runs": [index, count, ...]}],
+     "removed": [[x, y, z], ...]}
+
+Index 0 means "no tile here" (unvisited or not part of this update); palette index i is
+sent as i + 1. "removed" lists tiles a delta takes away (legacy: a null value).
+
+Encoded responses also carry the fog of war for the map window as a bitmask, so the
+client never has to infer it from which tiles it happens to hold:
+
+    {"z": 1, "x": -16, "y": -16, "w": 33, "h": 33, "bits": "<base64>"}
+
+Bit (y - y0) * w + (x - x0) is set when the tile has been revealed (LSB first).
+"""
+import base64
+
+from .gamedata import STATE_VIEWPORT_CONFIG
+
+MAP_ENCODINGS = ("rle",)
+
+
+def encode_map(tiles, encoding=None):
+    """tiles: {(x, y, z): tile_type or None} -> payload in the requested encoding."""
+    if encoding == "rle":
+        return encode_map_rle(tiles)
+    return {f"{x},{y},{z}": t for (x, y, z), t in tiles.items()}
+
+
+def encode_map_rle(tiles, chunk_size=None):
+    size = chunk_size or STATE_VIEWPORT_CONFIG["rle_chunk_size"]
+    palette = {}
+    removed = []
+    groups = {}
+    for (x, y, z), tile_type in tiles.items():
+        if tile_type is None:
+            removed.append([x, y, z])
+            continue
+        index = palette.get(tile_type)
+        if index is None:
+            index = palette[tile_type] = len(palette) + 1
+        groups.setdefault((z, x // size, y // size), []).append((x, y, index))
+
+    chunks = []
+    for (z, _, _), cells in sorted(groups.items()):
+        # Shrink the chunk to the tiles it actually holds (viewport edges, partial levels)
+        x0 = min(c[0] for c in cells)
+        y0 = min(c[1] for c in cells)
+        w = max(c[0] for c in cells) - x0 + 1
+        h = max(c[1] for c in cells) - y0 + 1
+        grid = [0] * (w * h)
+        for x, y, index in cells:
+            grid[(y - y0) * w + (x - x0)] = index
+        chunks.append({"z": z, "x": x0, "y": y0, "w": w, "h": h, "runs": _run_length(grid)})
+
+    return {
+        "encoding": "rle",
+        "palette": list(palette), # Insertion order == index order
+        "chunks": chunks,
+        "removed": removed
+    }
+
+
+def encode_visibility(z, x0, y0, x1, y1, bits):
+    """bits: little-endian bitset bytes for the window (see LayerStore.visibility)."""
+    return {
+        "z": z, "x": x0, "y": y0, "w": x1 - x0 + 1, "h": y1 - y0 + 1,
+        "bits": base64.b64encode(bits).decode("ascii")
+    }
+
+
+def decode_map_rle(payload):
+    """Inverse of encode_map_rle -> {(x, y, z): tile_type or None}."""
+    palette = payload["palette"]
+    tiles = {}
+    for chunk in payload["chunks"]:
+        runs = chunk["runs"]
+        pos = 0
+        for i in range(0, len(runs), 2):
+            index, count = runs[i], runs[i + 1]
+            if index:
+                for p in range(pos, pos + count):
+                    y, x = divmod(p, chunk["w"])
+                    tiles[(chunk["x"] + x, chunk["y"] + y, chunk["z"])] = palette[index - 1]
+            pos += count
+    for x, y, z in payload["removed"]:
+        tiles[(x, y, z)] = None
+    return tiles
+
+
+def _run_length(values):
+    runs = []
+    current, count = values[0], 0
+    for v in values:
+        if v == current:
+            count += 1
+        else:
+            runs.extend((current, count))
+            current, count = v, 1
+    runs.extend((current, count))
+    return runs
@@ -0,0 +1,110 @@
+"""
+Tile Registry.
+What every tile type means to the rules, in one place: movement, monster/NPC steps, line
+of sight and interactions all read these flags instead of keeping their own lists.
+
+- WALKABLE: actors can stand on it
+- OPAQUE: blocks line of sight (the tile itself is still seen)
+- HAZARD: walkable but harmful (lava, vents, spikes)
+- INTERACTABLE: stepping onto it can trigger something (doors, stairs, signs)
+- GATHERABLE: walking into it gathers instead of moving (mining, herbalism)
+
+Cells without a tile behave like solid rock (not walkable, opaque). Unknown tile types get
+no flags: they block movement but not sight.
+
+Per level, `layer_store.grid()` (layers.py) serves a TileGrid: the flags of every cell in
+one flat array, so a passability or opacity check is an index, not a lookup by type.
+"""
+
+WALKABLE = 1
+OPAQUE = 2
+HAZARD = 4
+INTERACTABLE = 8
+GATHERABLE = 16
+
+NO_TILE = OPAQUE
+
+_WALL = OPAQUE
+_FLOOR = WALKABLE
+_DOOR = WALKABLE | OPAQUE | INTERACTABLE
+
+TILE_TYPES = {
+    # Floors
+    "floor": _FLOOR,
+    "floor_wood": _FLOOR,
+    "floor_volcanic": _FLOOR,
+    "floor_ice": _FLOOR,
+    "grass": _FLOOR,
+    "bridge": _FLOOR,
+    "open_door": _FLOOR,
+    "street_lamp": _FLOOR,
+    "fountain": _FLOOR,
+    # Hazards
+    "lava": WALKABLE | HAZARD,
+    "steam_vent": WALKABLE | HAZARD,
+    "ice_spikes": WALKABLE | HAZARD,
+    # Transitions & Signs
+    "door": _DOOR,
+    "door_stone": _DOOR,
+    "door_wood": _DOOR,
+    "stairs_down": WALKABLE | INTERACTABLE,
+    "signpost": WALKABLE | INTERACTABLE,
+    # Resources
+    "rock": GATHERABLE,
+    "flower_pot": GATHERABLE,
+    "herb": GATHERABLE,
+    # Walls & Terrain
+    "wall": _WALL,
+    "wall_grey": _WALL,
+    "wall_house": _WALL,
+    "wall_volcanic": _WALL,
+    "wall_ice": _WALL,
+    "bedrock_wall": _WALL,
+    "void": _WALL,
+    "tree": _WALL,
+    "mtn_tl": _WALL, "mtn_tm": _WALL, "mtn_tr": _WALL,
+    "mtn_ml": _WALL, "mtn_mm": _WALL, "mtn_mr": _WALL,
+    "mtn_bl": _WALL, "mtn_br": _WALL,
+    "water": 0,
+    "ice": 0,
+    # Furniture
+    "shelf": 0,
+    "anvil": 0,
+    "barrel": 0,
+    "crate": 0,
+    "chest": INTERACTABLE,
+}
+
+
+def tile_flags(tile_type):
+    """Flags of a tile type (None = no tile)."""
+    if tile_type is None:
+        return NO_TILE
+    return TILE_TYPES.get(tile_type, 0)
+
+
+class TileGrid:
+    """
+    Flags of every cell of one level, row-major from (x0, y0). A grid is a snapshot: the
+    layer store builds a new one after the level changes, so holders never see it mutate.
+    """
+    __slots__ = ("z", "x0", "y0", "width", "height", "flags")
+
+    def __init__(self, z, x0, y0, width, height, flags):
+        self.z = z
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.flags = flags # bytearray, one entry per cell
+
+    def at(self, x, y):
+        if self.x0 <= x < self.x0 + self.width and self.y0 <= y < self.y0 + self.height:
+            return self.flags[(y - self.y0) * self.width + (x - self.x0)]
+        return NO_TILE
+
+    def walkable(self, x, y):
+        return bool(self.at(x, y) & WALKABLE)
+
+    def opaque(self, x, y):
+        return bool(self.at(x, y) & OPAQUE)
@@ -0,0 +1,96 @@
+"""
+Triggers.
+Where stepping somewhere does something beyond moving: portals between levels, door
+narratives, landmark proximity text and NPC greetings. The table lives in
+dungeon/data/triggers.json, is loaded once, and every trigger is expanded into the cells it
+covers, so a step asks for its target cell with one dictionary lookup. Rects with an open
+edge can't be expanded; they are kept per level and checked by their bounds instead.
+
+A trigger covers one area on level `z`:
+- "cells": [[x, y], ...]            exact cells
+- "center": [x, y], "radius": r     a square of cells within r (Chebyshev) of the center
+- "rect": [x0, y0, x1, y1]          inclusive; null = open edge (no bound on that side)
+
+and fires "on":
+- "void":  stepping at a cell with no tile        ("to", "text": a portal)
+- "door":  stepping onto a door tile              (a portal, or "enter"/"exit" narration
+                                                   entering = stepping along "enter_step")
+- "walk":  stepping onto any walkable tile        (a portal)
+- "near":  ending a move inside the area          ("text" appended, in "color")
+
+Portals may name a "quest" that is accepted on arrival if it is still available.
+Greetings match NPC names by substring (first entry wins), optionally only for the
+quest "status" values listed (null = no status yet).
+
+    for trigger in triggers.at(z, x, y, "walk"): ...
+"""
+import json
+import os
+
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "triggers.json")
+
+
+def _is_open(trigger):
+    return "rect" in trigger and None in trigger["rect"]
+
+
+def _span(trigger):
+    x0, y0, x1, y1 = trigger["rect"]
+    return (
+        float("-inf") if x0 is None else x0, float("-inf") if y0 is None else y0,
+        float("inf") if x1 is None else x1, float("inf") if y1 is None else y1,
+    )
+
+
+def _cells(trigger):
+    if "cells" in trigger:
+        return [tuple(c) for c in trigger["cells"]]
+    if "center" in trigger:
+        cx, cy = trigger["center"]
+        r = trigger["radius"]
+        x0, y0, x1, y1 = cx - r, cy - r, cx + r, cy + r
+    else:
+        x0, y0, x1, y1 = trigger["rect"]
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+class TriggerTable:
+    def __init__(self, path=_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        cells = {}
+        self._open = {}  # z -> [(trigger, (x0, y0, x1, y1))] for rects with open edges
+        for trigger in data["triggers"]:
+            if _is_open(trigger):
+                self._open.setdefault(trigger["z"], []).append((trigger, _span(trigger)))
+                continue
+            for x, y in _cells(trigger):
+                cells.setdefault((trigger["z"], x, y), []).append(trigger)
+        self._cells = {key: tuple(hits) for key, hits in cells.items()} # (z, x, y) -> triggers, file order
+        self._order = {trigger["id"]: i for i, trigger in enumerate(data["triggers"])}
+        self._greetings = data.get("greetings", [])
+        self._greeting_for = {} # NPC name -> greeting entry (or None)
+
+    def at(self, z, x, y, on=None):
+        """Triggers covering (x, y, z), optionally only those firing `on` the given event."""
+        hits = self._cells.get((z, x, y), ())
+        spans = tuple(t for t, (x0, y0, x1, y1) in self._open.get(z, ()) if x0 <= x <= x1 and y0 <= y <= y1)
+        if spans:
+            hits = tuple(sorted(hits + spans, key=lambda t: self._order[t["id"]]))
+        if on is None:
+            return hits
+        return [t for t in hits if t["on"] == on]
+
+    def greeting(self, npc):
+        """What `npc` calls out when the player comes near, or None."""
+        if npc.name not in self._greeting_for:
+            self._greeting_for[npc.name] = next((g for g in self._greetings if g["npc"] in npc.name), None)
+        entry = self._greeting_for[npc.name]
+        if entry is None:
+            return None
+        if "status" in entry and (npc.quest_state or {}).get("status") not in entry["status"]:
+            return None
+        return entry["text"]
+
+
+triggers = TriggerTable()
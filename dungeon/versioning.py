@@ -0,0 +1,195 @@
+"""
+World Versioning.
+Every committed transaction that touches world state bumps a monotonically increasing
+world version and records *what* changed (tiles, entity sections, player fields).
+`/api/state?since=<version>` uses this log to ship only the parts that changed instead of
+rebuilding the whole state on every poll, and `/api/stream` blocks on it to push changes.
+Each hosted game has its own version (`world_versions`); `world_version` is the default game's.
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, inspect
+
+from .database import (SessionFactory, DEFAULT_GAME, ABILITIES, Monster, NPC, WorldObject, Player, InventoryItem,
+                       CombatEncounter, PlayerSkill, PlayerQuest, QuestProgress)
+
+# Player column -> field name in the "player" block of the state payload
+PLAYER_FIELDS = {
+    "x": "xyz", "y": "xyz", "z": "xyz",
+    **{column: "stats" for column in ABILITIES.values()},
+    "unspent_points": "stats",
+    "weapon_damage": "stats",
+    "hp_current": "hp",
+    "hp_max": "max_hp",
+    "level": "level",
+    "xp": "xp",
+    "gold": "gold",
+}
+
+
+class ChangeSet:
+    """What changed in one (or several merged) committed transactions."""
+
+    def __init__(self, full=False):
+        self.full = full        # Force a full resync (reset, level change, bulk edits)
+        self.tiles = set()      # {(x, y, z)}, recorded by the layer store
+        self.sections = set()   # {"enemies", "corpses", "npcs", "secrets", "combat", "inventory"}
+        self.player = set()     # {"xyz", "hp", ...} (see PLAYER_FIELDS)
+        self.events = []        # Combat/narrative events pushed alongside the change
+
+    def merge(self, other):
+        self.full = self.full or other.full
+        self.tiles |= other.tiles
+        self.sections |= other.sections
+        self.player |= other.player
+        self.events.extend(other.events)
+
+    def __bool__(self):
+        return bool(self.full or self.tiles or self.sections or self.player or self.events)
+
+
+class WorldVersion:
+    """Monotonic version counter plus a bounded log of recent change sets."""
+
+    def __init__(self, history=512):
+        self._cond = threading.Condition()
+        # Seed from the wall clock so versions handed out by a previous server process
+        # always fall below the floor and trigger a full resync.
+        self.floor = int(time.time() * 1000)
+        self.current = self.floor
+        self._log = deque(maxlen=history)
+        self.closed = False # Set when the game is unloaded: waiters return and streams end
+
+    def publish(self, changes):
+        with self._cond:
+            self.current += 1
+            self._log.append((self.current, changes))
+            self._cond.notify_all()
+            return self.current
+
+    def invalidate(self):
+        """Force every client onto a full resync (e.g. after a world reset)."""
+        return self.publish(ChangeSet(full=True))
+
+    def push_events(self, events):
+        """Publish combat/narrative events so stream listeners receive them."""
+        changes = ChangeSet()
+        changes.events = list(events)
+        return self.publish(changes)
+
+    def wait_for_change(self, since, timeout):
+        """Block until the version moves past `since` (or timeout, or close()). Returns the current version."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.current != since or self.closed, timeout)
+            return self.current
+
+    def close(self):
+        """Retire this log (its game was unloaded) and wake everyone waiting on it."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def changes_since(self, since):
+        """Merged ChangeSet after `since`, or None if the client must resync."""
+        with self._cond:
+            if since is None or since < self.floor or since > self.current:
+                return None
+            if since < self.current and (not self._log or self._log[0][0] > since + 1):
+                return None # Part of the history has already been dropped
+
+            merged = ChangeSet()
+            for version, changes in self._log:
+                if version > since:
+                    merged.merge(changes)
+            if merged.full:
+                return None
+            return merged
+
+
+class WorldVersions:
+    """game_id -> WorldVersion, created on first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, game_id=DEFAULT_GAME):
+        with self._lock:
+            version = self._versions.get(game_id)
+            if version is None:
+                version = self._versions[game_id] = WorldVersion()
+            return version
+
+    def drop(self, game_id):
+        """Forget an unloaded game's log; its streams end and its clients resync if it is loaded again."""
+        if game_id == DEFAULT_GAME:
+            return # Kept: `world_version` below must stay the live object
+        with self._lock:
+            version = self._versions.pop(game_id, None)
+        if version is not None:
+            version.close()
+
+
+world_versions = WorldVersions()
+world_version = world_versions.get(DEFAULT_GAME)
+
+
+# --- Session Hooks ---
+
+def _record(changes, obj, deleted=False):
+    if isinstance(obj, Monster):
+        changes.sections.update(("enemies", "corpses"))
+    elif isinstance(obj, NPC):
+        changes.sections.add("npcs")
+    elif isinstance(obj, WorldObject):
+        changes.sections.add("secrets")
+    elif isinstance(obj, CombatEncounter):
+        changes.sections.add("combat")
+    elif isinstance(obj, InventoryItem):
+        changes.sections.add("inventory")
+    elif isinstance(obj, PlayerSkill):
+        changes.player.add("skills")
+    elif isinstance(obj, (PlayerQuest, QuestProgress)):
+        changes.player.add("quest_state")
+    elif isinstance(obj, Player):
+        if deleted:
+            changes.full = True
+            return
+        for column, field in PLAYER_FIELDS.items():
+            if _changed(obj, column):
+                changes.player.add(field)
+        if _changed(obj, "z"):
+            changes.full = True # Different level: nothing from the old one is reusable
+
+
+def _changed(obj, attr):
+    state = inspect(obj)
+    if state.transient or state.pending:
+        return True
+    return state.attrs[attr].history.has_changes()
+
+
+@event.listens_for(SessionFactory, "before_flush")
+def _collect_changes(session, flush_context, instances):
+    changes = session.info.setdefault("world_changes", ChangeSet())
+    for obj in session.new:
+        _record(changes, obj)
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            _record(changes, obj)
+    for obj in session.deleted:
+        _record(changes, obj, deleted=True)
+
+
+@event.listens_for(SessionFactory, "after_commit")
+def _publish_changes(session):
+    changes = session.info.pop("world_changes", None)
+    if changes:
+        world_versions.get(session.info.get("game_id", DEFAULT_GAME)).publish(changes)
+
+
+@event.listens_for(SessionFactory, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("world_changes", None)
@@ -1,4 +1,7 @@
-from .database import Monster, MapTile, NPC
+from .database import Monster, NPC
+from .layers import layer_store
+from .occupancy import occupancy
+from .distance import distance_map
 from sqlalchemy.orm.attributes import flag_modified
 import random
 
@@ -13,24 +16,20 @@ class WorldSimulation:
         
         # Get local monsters (simple bounding box for optimization?)
         # For now, fetch all on level.
-        from .database import Player
-        player = self.session.query(Player).first()
+        player = self.dm.player
         if not player: return None
         monsters = self.session.query(Monster).filter_by(z=player.z, is_alive=True).all()
         
-        # Cache MapTiles for collision (optimization could be done here, but query is safe enough for <20 monsters)
+        # Tile collision is served from the level's tile grid (no SQL per step)
+        grid = layer_store.grid(self.session, player.z)
+        chase = distance_map(grid, player.x, player.y) # Shared by every chaser this turn
         
         def is_blocked(tx, ty, tz):
              # Check Wall/Water/Void
-             t = self.session.query(MapTile).filter_by(x=tx, y=ty, z=tz).first()
-             if not t: return True
-             # Allow: floor, grass, floor_wood, open_door, bridge, lava
-             allow_list = ["floor", "floor_wood", "grass", "open_door", "bridge", "lava"]
-             if t.tile_type not in allow_list: return True
+             if not grid.walkable(tx, ty): return True
              
              # Check Other Monster
-             occ = self.session.query(Monster).filter_by(x=tx, y=ty, z=tz, is_alive=True).first()
-             if occ: return True
+             if occupancy.first(self.session, "monster", tx, ty, tz): return True
              return False
 
         alerts = []
@@ -41,35 +40,17 @@ class WorldSimulation:
             
             # 1. Aggro Check (Vision Range: 5)
             if dist <= 5:
-                # Chase Player
-                dx = 0
-                dy = 0
-                if m.x < player.x: dx = 1
-                elif m.x > player.x: dx = -1
-                
-                if m.y < player.y: dy = 1
-                elif m.y > player.y: dy = -1
-                
                 # Check for "Touching" PLAYER -> Combat Trigger
-                # If we are 1 tile away and move closer, we might hit them.
-                # Actually, check projected position.
-                tx, ty = m.x + dx, m.y + dy
-                if tx == player.x and ty == player.y:
+                # Adjacent: the next step towards the player is onto them.
+                if dist <= 1:
                      self.dm.combat.start_combat(m)
                      return "Ambush"
                      
-                # Try Move (Manhattan-ish)
-                if not is_blocked(tx, ty, m.z):
-                    m.x, m.y = tx, ty
+                # Chase Player: step down the distance map (routes around walls)
+                step = chase.step(m.x, m.y, blocked=lambda x, y: is_blocked(x, y, m.z))
+                if step:
+                    m.x, m.y = step
                     moved = True
-                else:
-                    # Try Axis only
-                    if dx != 0 and not is_blocked(m.x + dx, m.y, m.z) and (m.x + dx != player.x):
-                         m.x += dx
-                         moved = True
-                    elif dy != 0 and not is_blocked(m.x, m.y + dy, m.z) and (m.y + dy != player.y):
-                         m.y += dy
-                         moved = True
                          
             # 2. Random Roam (15% Chance)
             elif dist < 20: 
@@ -99,6 +80,7 @@ class WorldSimulation:
         # Find all NPCs on player's level with a target
         # We rely on quest_state JSON for target_x, target_y
         npcs = self.session.query(NPC).filter_by(z=self.dm.player.z).all() # Only process current level for visuals
+        grid = layer_store.grid(self.session, self.dm.player.z)
         
         for npc in npcs:
             qs = npc.quest_state or {}
@@ -143,8 +125,7 @@ class WorldSimulation:
                     if nx == self.dm.player.x and ny == self.dm.player.y: continue
                     
                     # Avoid Walls
-                    tile = self.session.query(MapTile).filter_by(x=nx, y=ny, z=npc.z).first()
-                    if not tile or tile.tile_type in ["wall", "water", "void", "tree"]: continue
+                    if not grid.walkable(nx, ny): continue
                     
                     # Move
                     npc.x = nx
@@ -5,6 +5,8 @@ taskkill /F /IM python.exe /T 2>nul
 echo.
 echo Cleaning up temporary files...
 if exist dungeon.db del dungeon.db
+if exist dungeon.db-wal del dungeon.db-wal
+if exist dungeon.db-shm del dungeon.db-shm
 echo.
 echo Starting Dungeon Crawler...
 python app.py
@@ -45,6 +45,11 @@
                     if (window.movePlayerCmd) {
                         window.movePlayerCmd({ dx, dy });
                     }
+                } else if (dx !== 0 || dy !== 0) {
+                    // Farther away: the server walks the whole route in one request
+                    if (window.movePlayerCmd) {
+                        window.movePlayerCmd({ target: [tX, tY] });
+                    }
                 }
             }
         });
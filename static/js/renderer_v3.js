@@ -8,6 +8,11 @@ const MAP_HEIGHT = 600;
 let cameraPos = [0, 0];
 let playerPos = [0, 0, 0];
 let visibleMap = {};
+let tileCoords = {}; // "x,y,z" -> [x, y, z], filled while decoding so drawing never parses keys
+let worldState = null; // Last full state, kept current by merging /api/state deltas
+let viewRadius = 0; // Map window requested from /api/state (tiles around the player)
+let stateStream = null; // EventSource on /api/stream; polling only runs while it is down
+let streamLive = false;
 
 // Images - NOW MANAGED BY spriteCache
 const playerImg = new Image(); playerImg.src = "/static/img/player.png";
@@ -84,7 +89,7 @@ window.addEventListener('wheel', (e) => {
 
     // Force Redraw
     const canvas = document.getElementById('map-canvas');
-    if (canvas) fetchAndDraw(canvas.getContext('2d'));
+    if (canvas) redraw(canvas.getContext('2d'));
 }, { passive: false });
 
 
@@ -115,7 +120,7 @@ function resizeCanvas() {
     ctx.imageSmoothingEnabled = false;
 
     // Redraw immediately
-    fetchAndDraw(ctx);
+    redraw(ctx);
 }
 window.addEventListener('resize', resizeCanvas);
 
@@ -128,11 +133,167 @@ window.onload = function () {
     if (!canvas) { console.error("No Canvas Found"); return; }
     const ctx = canvas.getContext('2d');
 
-    // Start Fetch Loop
-    setInterval(() => fetchAndDraw(ctx), 500);
+    // Server pushes state as it changes; the poll loop is the fallback while the stream is down
+    connectStream(ctx);
+    setInterval(() => { if (!streamLive) fetchAndDraw(ctx); }, 500);
 };
 
+// Map window (in tiles) that covers the canvas plus a margin for panning
+function currentRadius(canvas) {
+    return Math.ceil(Math.max(canvas.width, canvas.height) / TILE_SIZE / 2) + 2;
+}
+
+// Combat/narrative events published by the server (every client of the game gets them)
+window.onStreamEvents = function (events) {
+    events.forEach(e => {
+        if (e.type === 'text' && window.logMessage) window.logMessage(e.message, 'combat');
+        if (e.type === 'popup' && window.showPopup) window.showPopup(e.title, e.content, e.color, e.duration || 2500);
+    });
+};
+
+// While the stream is live it delivers a response's events; logging them again would double them
+window.isStreamLive = () => streamLive;
+
+function logResponseNarrative(json) {
+    if (!json.narrative || !window.logMessage) return;
+    if (streamLive && json.events && json.events.length) return; // Narrative is one of the pushed events
+    window.logMessage(json.narrative);
+}
+
+function connectStream(ctx) {
+    if (!window.EventSource) return;
+    if (stateStream) stateStream.close();
+    streamLive = false;
+
+    viewRadius = currentRadius(ctx.canvas);
+    const since = worldState ? `&since=${worldState.version}` : '';
+    stateStream = new EventSource(`/api/stream?view=viewport&radius=${viewRadius}&map_encoding=rle${since}`);
+    stateStream.addEventListener('state', (e) => {
+        streamLive = true;
+        const update = JSON.parse(e.data);
+        const data = mergeState(update);
+        if (update.events && window.onStreamEvents) window.onStreamEvents(update.events);
+        drawWorld(ctx, data);
+    });
+    // EventSource reconnects by itself and resumes via Last-Event-ID; poll until it does
+    stateStream.onerror = () => { streamLive = false; };
+}
+
+// Zoom/resize: draw from the cached state, re-subscribing if the map window grew or shrank
+function redraw(ctx) {
+    if (currentRadius(ctx.canvas) !== viewRadius) {
+        worldState = null;
+        if (stateStream) connectStream(ctx);
+        else fetchAndDraw(ctx);
+        return;
+    }
+    if (worldState) drawWorld(ctx, worldState);
+    else fetchAndDraw(ctx);
+}
+
+// Expand a map_encoding=rle payload into "x,y,z" -> tile_type (null = removed)
+function decodeMap(encoded) {
+    const tiles = {};
+    const palette = encoded.palette;
+    for (const chunk of encoded.chunks) {
+        const runs = chunk.runs;
+        let pos = 0;
+        for (let i = 0; i < runs.length; i += 2) {
+            const index = runs[i], count = runs[i + 1];
+            if (index) {
+                const tileType = palette[index - 1];
+                for (let p = pos; p < pos + count; p++) {
+                    const x = chunk.x + (p % chunk.w), y = chunk.y + Math.floor(p / chunk.w);
+                    const key = `${x},${y},${chunk.z}`;
+                    tiles[key] = tileType;
+                    tileCoords[key] = [x, y, chunk.z];
+                }
+            }
+            pos += count;
+        }
+    }
+    for (const [x, y, z] of encoded.removed) tiles[`${x},${y},${z}`] = null;
+    return tiles;
+}
+
+// Fog-of-war mask from the server: bit (y - v.y) * v.w + (x - v.x), LSB first, base64
+function decodeVisibility(v) {
+    const raw = atob(v.bits);
+    const bits = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) bits[i] = raw.charCodeAt(i);
+    return { ...v, bits };
+}
+
+function maskHas(v, x, y, z) {
+    const dx = x - v.x, dy = y - v.y;
+    if (z !== v.z || dx < 0 || dy < 0 || dx >= v.w || dy >= v.h) return false;
+    const i = dy * v.w + dx;
+    return ((v.bits[i >> 3] >> (i & 7)) & 1) === 1;
+}
+
+// Has the player revealed (x, y, z)? Falls back to the tile dictionary without a mask
+function isRevealed(data, x, y, z) {
+    const v = data.world && data.world.visibility;
+    if (!v) return !!visibleMap[`${x},${y},${z}`];
+    return maskHas(v, x, y, z);
+}
+
+// Is (x, y, z) in the player's line of sight right now? Distance fallback without a mask
+function isLit(data, x, y, z) {
+    const lit = data.world && data.world.lit;
+    if (!lit) return Math.hypot(x - playerPos[0], y - playerPos[1]) < 7;
+    return maskHas(lit, x, y, z);
+}
+
+// Fold a /api/state response into the cached state (full responses replace it)
+function mergeState(update) {
+    if (update.error) return worldState || update;
+    if (worldState && update.version < worldState.version) return worldState; // Stale (out-of-order) reply
+    if (update.world && update.world.map && update.world.map.encoding === 'rle') {
+        update.world.map = decodeMap(update.world.map);
+    }
+    if (update.world && update.world.visibility) {
+        update.world.visibility = decodeVisibility(update.world.visibility);
+    }
+    if (update.world && update.world.lit) {
+        update.world.lit = decodeVisibility(update.world.lit);
+    }
+    if (!update.delta || !worldState) {
+        if (update.version !== undefined) worldState = update;
+        return update;
+    }
+
+    worldState.version = update.version;
+    if (update.player) Object.assign(worldState.player, update.player);
+    if (update.world) {
+        const { map, ...sections } = update.world;
+        if (map) {
+            for (let key in map) {
+                if (map[key] === null) delete worldState.world.map[key];
+                else worldState.world.map[key] = map[key];
+            }
+        }
+        Object.assign(worldState.world, sections);
+    }
+    if (update.corpses) worldState.corpses = update.corpses;
+    if (update.combat) worldState.combat = update.combat;
+    return worldState;
+}
+
 async function fetchAndDraw(ctx) {
+    try {
+        // Only ask for the tiles that fit on screen (plus a margin for panning)
+        const radius = currentRadius(ctx.canvas);
+        if (radius !== viewRadius) { viewRadius = radius; worldState = null; } // Zoomed: resync window
+        const since = worldState ? `&since=${worldState.version}` : '';
+        const res = await fetch(`/api/state?view=viewport&radius=${viewRadius}&map_encoding=rle${since}`);
+        drawWorld(ctx, mergeState(await res.json()));
+    } catch (e) {
+        console.error("V3 Error:", e);
+    }
+}
+
+function drawWorld(ctx, data) {
     try {
         const canvas = ctx.canvas;
         // FORCE PIXELATION via CSS
@@ -145,9 +306,6 @@ async function fetchAndDraw(ctx) {
         ctx.webkitImageSmoothingEnabled = false;
         ctx.msImageSmoothingEnabled = false;
 
-        const res = await fetch(`/api/state?t=${Date.now()}`);
-        const data = await res.json();
-
         // UI UPDATE HOOK
         if (window.updateDashboard) window.updateDashboard(data);
 
@@ -171,7 +329,7 @@ async function fetchAndDraw(ctx) {
 
         // --- TILE RENDERING ---
         for (let key in visibleMap) {
-            const [x, y, z] = key.split(',').map(Number);
+            const [x, y, z] = tileCoords[key] || key.split(',').map(Number);
             if (z !== playerZ) continue;
 
             const drawX = centerX + (x - cameraPos[0]) * TILE_SIZE - TILE_SIZE / 2;
@@ -184,9 +342,8 @@ async function fetchAndDraw(ctx) {
 
             const tileType = visibleMap[key];
 
-            // FOG OF WAR: Distance Dimming
-            const dist = Math.sqrt(Math.pow(x - playerPos[0], 2) + Math.pow(y - playerPos[1], 2));
-            const isVisible = dist < 7;
+            // FOG OF WAR: tiles out of line of sight are memory
+            const isVisible = isLit(data, x, y, z);
 
             // Dim "Memory" tiles
             ctx.globalAlpha = isVisible ? 1.0 : 0.4;
@@ -284,7 +441,7 @@ async function fetchAndDraw(ctx) {
                 const [cx, cy, cz] = c.xyz;
                 if (cz !== playerZ) return;
                 // Fog of War Check
-                if (!visibleMap[`${cx},${cy},${cz}`]) return;
+                if (!isRevealed(data, cx, cy, cz)) return;
 
                 const drawX = centerX + (cx - cameraPos[0]) * TILE_SIZE - (TILE_SIZE / 2);
                 const drawY = centerY + (cy - cameraPos[1]) * TILE_SIZE - (TILE_SIZE / 2);
@@ -306,8 +463,7 @@ async function fetchAndDraw(ctx) {
                 if (nz !== playerZ) return;
 
                 // Fog of War Check
-                const tileKey = `${nx},${ny},${nz}`;
-                if (!visibleMap[tileKey]) return;
+                if (!isRevealed(data, nx, ny, nz)) return;
 
                 const drawX = centerX + (nx - cameraPos[0]) * TILE_SIZE - (TILE_SIZE / 2);
                 const drawY = centerY + (ny - cameraPos[1]) * TILE_SIZE - (TILE_SIZE / 2);
@@ -364,8 +520,7 @@ async function fetchAndDraw(ctx) {
                 if (ez !== playerZ) return;
 
                 // Fog of War Check
-                const tileKey = `${ex},${ey},${ez}`;
-                if (!visibleMap[tileKey]) return; // HIDDEN if not in visible/visited map
+                if (!isRevealed(data, ex, ey, ez)) return; // HIDDEN if not revealed yet
 
                 const drawX = centerX + (ex - cameraPos[0]) * TILE_SIZE - (TILE_SIZE / 2);
                 const drawY = centerY + (ey - cameraPos[1]) * TILE_SIZE - (TILE_SIZE / 2);
@@ -411,8 +566,7 @@ async function fetchAndDraw(ctx) {
                 if (oz !== playerZ) return;
 
                 // Fog of War Check
-                const tileKey = `${ox},${oy},${oz}`;
-                if (!visibleMap[tileKey]) return;
+                if (!isRevealed(data, ox, oy, oz)) return;
 
                 const drawX = centerX + (ox - cameraPos[0]) * TILE_SIZE - (TILE_SIZE / 2);
                 const drawY = centerY + (oy - cameraPos[1]) * TILE_SIZE - (TILE_SIZE / 2);
@@ -504,6 +658,14 @@ window.addEventListener('mousedown', (e) => {
 
     console.log(`Click Debug: Canvas(${canvasX.toFixed(0)},${canvasY.toFixed(0)}) Center(${centerX},${centerY}) Rel(${relX.toFixed(0)},${relY.toFixed(0)}) TileD(${tileDx.toFixed(1)},${tileDy.toFixed(1)})`);
 
+    // Clicked tile (the player is drawn centered on the canvas)
+    const targetDx = Math.round(tileDx);
+    const targetDy = Math.round(tileDy);
+    if (Math.abs(targetDx) + Math.abs(targetDy) > 1) {
+        travelTo(playerPos[0] + targetDx, playerPos[1] + targetDy);
+        return;
+    }
+
     let dx = 0;
     let dy = 0;
 
@@ -532,7 +694,8 @@ async function movePlayer(dx, dy) {
     const canvas = document.getElementById('map-canvas');
     if (canvas) {
         const ctx = canvas.getContext('2d');
-        fetchAndDraw(ctx); // Re-draw with new optimistic pos
+        if (streamLive && worldState) drawWorld(ctx, worldState); // Stream pushes the real position
+        else fetchAndDraw(ctx); // Re-draw with new optimistic pos
     }
 
     try {
@@ -548,9 +711,7 @@ async function movePlayer(dx, dy) {
             window.updateDashboard(json.state);
         }
 
-        if (json.narrative && window.logMessage) {
-            window.logMessage(json.narrative);
-        }
+        logResponseNarrative(json);
     } catch (e) {
         console.error("Move Failed", e);
         // Revert on failure (simple)
@@ -559,6 +720,30 @@ async function movePlayer(dx, dy) {
     }
 }
 
+// Click-to-move: one request walks the whole route (stops early on combat, doors, triggers)
+async function travelTo(tx, ty) {
+    try {
+        const res = await fetch('/api/move', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ target: [tx, ty] })
+        });
+        const json = await res.json();
+
+        if (json.position) playerPos = json.position;
+        const canvas = document.getElementById('map-canvas');
+        if (canvas && !streamLive) fetchAndDraw(canvas.getContext('2d'));
+
+        if (json.state && window.updateDashboard) {
+            window.updateDashboard(json.state);
+        }
+
+        logResponseNarrative(json);
+    } catch (e) {
+        console.error("Travel Failed", e);
+    }
+}
+
 // Draw Input Debug
 function drawInputDebug(ctx) {
     ctx.fillStyle = "white";
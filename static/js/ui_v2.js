@@ -1338,7 +1338,8 @@ window.combatAction = async function (action) {
         });
         const data = await res.json();
 
-        if (data.result && data.result.events) {
+        // With the stream live the same events arrive through window.onStreamEvents
+        if (data.result && data.result.events && !(window.isStreamLive && window.isStreamLive())) {
             data.result.events.forEach(e => {
                 if (e.type === 'text' && window.logMessage) window.logMessage(e.message, 'combat');
                 if (e.type === 'popup') window.showPopup(e.title, e.content, e.color, e.duration || 2500);
@@ -30,6 +30,728 @@ def test_dm_state():
     assert dm2.get_player_position() == new_pos
     print("Persistence OK.")
 
+def test_state_delta():
+    print("Testing State Deltas...")
+    dm = DungeonMaster()
+    full = dm.get_state_dict()
+    assert full["delta"] is False
+    v = full["version"]
+
+    # Nothing happened -> empty delta
+    quiet = dm.get_state_dict(since=v)
+    assert quiet["delta"] is True and "player" not in quiet and "world" not in quiet
+
+    dm.move_player(0, 1)
+    delta = dm.get_state_dict(since=v)
+    assert delta["version"] > v
+    print(f"Delta keys after move: {sorted(delta.keys())}")
+
+    # Unknown version -> full resync
+    assert dm.get_state_dict(since=0)["delta"] is False
+    print("Deltas OK.")
+
+def test_state_viewport():
+    print("Testing Viewport State...")
+    dm = DungeonMaster()
+    px, py, pz = dm.get_state_dict()["player"]["xyz"]
+    state = dm.get_state_dict(view={"radius": 3})
+    for key in state["world"]["map"]:
+        x, y, z = map(int, key.split(","))
+        assert z == pz and abs(x - px) <= 3 and abs(y - py) <= 3
+    print(f"Viewport tiles: {len(state['world']['map'])}")
+
+def test_state_push():
+    print("Testing Stream Push...")
+    from dungeon.versioning import world_version
+    dm = DungeonMaster()
+    v = dm.get_state_dict()["version"]
+
+    # Idle: times out without a new version
+    assert world_version.wait_for_change(v, 0.05) == v
+
+    world_version.push_events([{"type": "text", "message": "Ping"}])
+    assert world_version.wait_for_change(v, 0.05) > v
+    delta = dm.get_state_dict(since=v)
+    assert delta["events"][0]["message"] == "Ping"
+    print("Push OK.")
+
+def test_map_encoding():
+    print("Testing RLE Map Encoding...")
+    import json
+    from dungeon.state_encoding import encode_map_rle, decode_map_rle
+    forest = {(x, y, 2): ("tree" if (x * 7 + y) % 13 == 0 else "grass") for x in range(60) for y in range(60)}
+    forest[(5, 5, 2)] = None # Delta removal
+    encoded = encode_map_rle(forest)
+    assert decode_map_rle(encoded) == forest
+
+    dm = DungeonMaster()
+    legacy = dm.get_state_dict()["world"]["map"]
+    rle = dm.get_state_dict(encoding="rle")["world"]["map"]
+    decoded = {f"{x},{y},{z}": t for (x, y, z), t in decode_map_rle(rle).items()}
+    assert decoded == legacy
+    print(f"Map bytes: legacy {len(json.dumps(legacy))}, rle {len(json.dumps(rle))}")
+
+def test_etags():
+    print("Testing ETags...")
+    from app import app
+    from dungeon.versioning import world_version
+    client = app.test_client()
+    for url in ['/api/state', '/api/shop/list', '/api/craft/list', '/api/narrative']:
+        first = client.get(url)
+        tag = first.headers['ETag']
+        again = client.get(url, headers={'If-None-Match': tag})
+        assert again.status_code == 304, url
+
+    state_tag = client.get('/api/state').headers['ETag']
+    assert state_tag == f'"state-default-{world_version.current}"' # Per game: versions of two games may coincide
+    assert client.get('/api/narrative').headers['ETag'] == f'"narrative-default-{world_version.current}"'
+
+    # The asset tag follows files added anywhere in the library, not just its top levels
+    import os, shutil, tempfile
+    library = os.path.join(app.root_path, 'static', 'asset_library')
+    folder = next(entry.path for entry in os.scandir(library) if entry.is_dir())
+    probe = tempfile.mkdtemp(dir=folder) # Two levels down
+    try:
+        assets_tag = client.get('/api/assets/list').headers['ETag']
+        open(os.path.join(probe, "probe.png"), "wb").close()
+        listed = client.get('/api/assets/list', headers={'If-None-Match': assets_tag})
+        assert listed.status_code == 200 and any(f.endswith("/probe.png") for f in listed.get_json()["files"])
+    finally:
+        shutil.rmtree(probe)
+
+    # A stalled AI turn commits nothing, so it can't move the tag: the failsafe still runs
+    from sqlalchemy import insert, delete
+    from dungeon.database import engine, CombatEncounter
+    encounters = CombatEncounter.__table__
+    with engine.begin() as conn: # Behind the version log's back, like a turn processor that died mid-turn
+        stuck_id = conn.execute(insert(encounters).values(
+            game_id="default", is_active=True, current_turn_index=0,
+            turn_order=[{"type": "monster", "id": -1}, {"type": "player"}])).inserted_primary_key[0]
+    try:
+        stalled = client.get('/api/state', headers={'If-None-Match': state_tag})
+        assert stalled.status_code == 200 and stalled.get_json()["combat"]["current_turn"] == "player"
+    finally:
+        with engine.begin() as conn:
+            conn.execute(delete(encounters).where(encounters.c.id == stuck_id))
+    world_version.push_events([]) # Any commit moves the state tag
+    assert client.get('/api/state', headers={'If-None-Match': state_tag}).status_code == 200
+    print("ETags OK.")
+
+def test_layer_store():
+    print("Testing Layer Store...")
+    import threading
+    from dungeon.layers import layer_store
+    from dungeon.database import MapLayer
+    from dungeon.versioning import world_version
+    dm = DungeonMaster()
+    z = 0
+    tiles = layer_store.area(dm.session, *layer_store.bounds(dm.session, z), z)
+    (x, y), (original, _) = next((pos, t) for pos, t in tiles.items() if not t[1])
+    assert dm.session.query(MapLayer).filter_by(z=z).count() == 1 # Whole level in one row
+
+    # Writes land in the DB (and the version log) on commit
+    v = dm.get_state_dict()["version"]
+    assert layer_store.set_visited(dm.session, x, y, z)
+    dm.session.commit()
+    layer_store.evict_level(z) # Reload from the packed row
+    assert layer_store.is_visited(dm.session, x, y, z)
+    assert layer_store.get(dm.session, x, y, z) == original
+    assert (x, y, z) in world_version.changes_since(v).tiles
+
+    # Rolled back writes are dropped from the cache
+    layer_store.set_type(dm.session, x, y, z, "lava")
+    assert layer_store.get(dm.session, x, y, z) == "lava"
+    dm.session.rollback()
+    assert layer_store.get(dm.session, x, y, z) == original
+
+    # Other sessions only see (and save) a session's writes once it commits
+    from dungeon.database import SessionFactory
+    (x2, y2), (other, _) = next((pos, t) for pos, t in tiles.items() if pos != (x, y))
+    a, b = SessionFactory(), SessionFactory()
+    try:
+        layer_store.set_type(a, x, y, z, "lava")
+        assert layer_store.get(b, x, y, z) == original
+        layer_store.set_type(b, x2, y2, z, "lava")
+        b.commit()
+        a.rollback() # Keeps b's committed write
+        assert layer_store.get(dm.session, x2, y2, z) == "lava"
+        layer_store.evict_level(z)
+        assert layer_store.get(dm.session, x, y, z) == original # b's row does not carry a's write
+
+        layer_store.set_type(a, x, y, z, "lava")
+        layer_store.set_type(b, x2, y2, z, other)
+        b.commit()
+        a.commit() # a's cell is merged onto b's newer commit
+        layer_store.evict_level(z)
+        assert (layer_store.get(dm.session, x, y, z), layer_store.get(dm.session, x2, y2, z)) == ("lava", other)
+
+        # Concurrent commits to one level from the same snapshot: both cells survive
+        layer_store.set_type(a, x, y, z, original)
+        layer_store.set_type(b, x2, y2, z, "lava")
+        ready = threading.Barrier(2)
+        def commit(session):
+            ready.wait()
+            session.commit()
+        workers = [threading.Thread(target=commit, args=(session,)) for session in (a, b)]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+        assert (layer_store.get(dm.session, x, y, z), layer_store.get(dm.session, x2, y2, z)) == (original, "lava")
+        layer_store.evict_level(z)
+        assert (layer_store.get(dm.session, x, y, z), layer_store.get(dm.session, x2, y2, z)) == (original, "lava")
+        layer_store.set_type(b, x2, y2, z, other)
+        b.commit()
+    finally:
+        a.close()
+        b.close()
+        layer_store.set_type(dm.session, x, y, z, original)
+        dm.session.commit()
+    print("Layer Store OK.")
+
+def test_fog_bitset():
+    print("Testing Fog Bitset...")
+    import base64
+    from dungeon.layers import layer_store
+    from dungeon.state_encoding import decode_map_rle
+    dm = DungeonMaster()
+    z = 0
+    tiles = layer_store.area(dm.session, *layer_store.bounds(dm.session, z), z)
+    (x, y), _ = next((pos, t) for pos, t in tiles.items() if not t[1])
+
+    assert layer_store.reveal(dm.session, z, [(x, y), (999, 999)]) == [(x, y)] # Only real tiles
+    assert layer_store.reveal(dm.session, z, [(x, y)]) == []
+    dm.session.commit()
+    layer_store.evict_level(z)
+    assert layer_store.is_visited(dm.session, x, y, z)
+
+    # The client gets the mask for its window; it matches the tiles it is sent
+    state = dm.get_state_dict(view={"radius": 8}, encoding="rle")
+    vis = state["world"]["visibility"]
+    bits = int.from_bytes(base64.b64decode(vis["bits"]), "little")
+    for (tx, ty, tz) in decode_map_rle(state["world"]["map"]):
+        assert (bits >> ((ty - vis["y"]) * vis["w"] + tx - vis["x"])) & 1
+    assert bin(bits).count("1") == len(decode_map_rle(state["world"]["map"]))
+    print("Fog Bitset OK.")
+
+def test_level_generation():
+    print("Testing Level Generation...")
+    from dungeon.layers import layer_store
+    from dungeon.generator import LevelBuilder
+    from dungeon.versioning import world_version
+    dm = DungeonMaster()
+    z = max(layer_store.levels(dm.session) + [8]) + 1 # A level no run has generated yet
+    assert not layer_store.has_level(dm.session, z)
+    v = dm.get_state_dict()["version"]
+
+    LevelBuilder(dm.session).generate_fire_dungeon(z)
+    entrance = layer_store.get(dm.session, 0, 0, z)
+    assert entrance is not None
+    layer_store.evict_level(z)
+    assert layer_store.get(dm.session, 0, 0, z) == entrance # Committed with the level
+    assert world_version.changes_since(v) is None # Clients resync
+    print("Level Generation OK.")
+
+def test_map_tiles_migration():
+    print("Testing map_tiles Migration...")
+    from dungeon.layers import layer_store, migrate_map_tiles
+    from dungeon.database import MapTile
+    dm = DungeonMaster()
+    z = 7
+    dm.session.add(MapTile(x=-3, y=5, z=z, tile_type="floor", is_visited=True))
+    dm.session.add(MapTile(x=4, y=-2, z=z, tile_type="herb", meta_data={"interactable": True}))
+    dm.session.commit()
+
+    assert migrate_map_tiles(dm.session) == 2
+    layer_store.evict_level(z)
+    assert layer_store.get(dm.session, -3, 5, z) == "floor"
+    assert layer_store.is_visited(dm.session, -3, 5, z)
+    assert layer_store.get(dm.session, 0, 0, z) is None # Gap inside the bounds
+    assert layer_store.meta(dm.session, 4, -2, z) == {"interactable": True}
+    assert dm.session.query(MapTile).count() == 0
+    print("Migration OK.")
+
+def test_schema_migrations():
+    print("Testing Schema Migrations...")
+    from sqlalchemy import text
+    from dungeon.database import engine, init_db
+    from dungeon.migrations import MIGRATIONS, run_migrations, check_query_plans
+    DungeonMaster()
+
+    # Roll the save back to before the index migrations, with a duplicate object
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_version WHERE version >= 2"))
+        for index in ["idx_monster_level", "idx_encounter_active", "idx_wobj_location"]:
+            conn.execute(text(f"DROP INDEX {index}"))
+        conn.execute(text("INSERT INTO world_objects (name, obj_type, x, y, z) VALUES ('Old', 'chest', 99, 99, 5), ('New', 'chest', 99, 99, 5)"))
+        conn.execute(text("INSERT INTO world_objects (game_id, name, obj_type, x, y, z) VALUES ('other', 'Theirs', 'chest', 99, 99, 5)"))
+    assert not check_query_plans(engine)["level_monsters"][0]
+
+    assert run_migrations(engine) == [name for version, name, _ in MIGRATIONS if version >= 2]
+    assert run_migrations(engine) == [] # Each migration runs once
+    init_db()
+    assert all(ok for ok, plan in check_query_plans(engine).values())
+    with engine.connect() as conn:
+        names = conn.execute(text("SELECT name FROM world_objects WHERE z = 5 AND x = 99 AND y = 99 ORDER BY id")).scalars().all()
+        conn.execute(text("DELETE FROM world_objects WHERE z = 5 AND x = 99 AND y = 99"))
+        conn.commit()
+    assert names == ["New", "Theirs"] # Same location in another game is not a duplicate
+    print("Migrations OK.")
+
+def test_quest_indicators():
+    print("Testing Quest Indicators...")
+    from dungeon.quests import QuestManager, quests_given_by
+    from dungeon.database import Player, InventoryItem
+    assert quests_given_by("Gareth Ironhand") == ("iron_supply", "titanium_hunt")
+
+    dm = DungeonMaster()
+    player = dm.session.query(Player).first()
+    qm = QuestManager(dm.session, player)
+    assert not qm.meets_requirements("titanium_hunt") # Needs iron_supply first
+
+    dm.get_state_dict()
+    dm._quest_status_cache["Probe"] = "none"
+    dm.get_state_dict() # Nothing relevant changed -> cache kept
+    assert "Probe" in dm._quest_status_cache
+
+    dm.session.add(InventoryItem(name="Iron Ore", item_type="material", player=player))
+    dm.session.commit()
+    dm.get_state_dict()
+    assert "Probe" not in dm._quest_status_cache
+    print("Quest Indicators OK.")
+
+def test_request_metrics():
+    print("Testing Request Metrics...")
+    from app import app
+    client = app.test_client()
+    res = client.get('/api/state')
+    timing = res.headers['Server-Timing']
+    assert "map;dur=" in timing and "db;desc=" in timing
+    snapshot = client.get('/api/debug/metrics').get_json()
+    assert snapshot["endpoints"]["get_state"]["avg_statements"] > 0
+    print(f"Server-Timing: {timing}")
+
+def test_corpse_reaper():
+    print("Testing Corpse Reaper...")
+    from dungeon.database import Monster
+    from dungeon.maintenance import MaintenanceWorker
+    dm = DungeonMaster()
+    empty = Monster(name="Husk", hp_current=0, hp_max=5, x=90, y=90, z=9, is_alive=False, loot=[])
+    old = Monster(name="Old Kill", hp_current=0, hp_max=5, x=91, y=90, z=9, is_alive=False, loot=[{"name": "Bone"}])
+    new = Monster(name="New Kill", hp_current=0, hp_max=5, x=92, y=90, z=9, is_alive=False, loot=[{"name": "Bone"}])
+    dm.session.add_all([empty, old, new])
+    dm.session.commit()
+    ids = (empty.id, old.id, new.id)
+
+    MaintenanceWorker(batch_size=1, max_corpses=1).run_once()
+    dm.session.expire_all()
+    remaining = {m.id for m in dm.session.query(Monster).filter(Monster.id.in_(ids))}
+    assert remaining == {ids[2]}
+    print("Reaper OK.")
+
+def test_game_hosting():
+    print("Testing Game Hosting...")
+    import tempfile
+    from dungeon import database
+    from dungeon.database import Player, NPC, CombatEncounter
+    from dungeon.games import GameRegistry
+    from dungeon.layers import layer_store
+    with tempfile.TemporaryDirectory() as tmp:
+        database.save_engines = database.SaveEngines(tmp) # Fresh saves on every run
+        games = GameRegistry(capacity=2)
+        try:
+            a, b = games.get("test_a"), games.get("test_b")
+            pa, pb = a.session.query(Player).first(), b.session.query(Player).first()
+            assert pa.game_id != pb.game_id
+            assert b.session.query(NPC).filter(NPC.name.like("Elara%")).count() == 1 # Each game has its own cast
+
+            a.session.add(CombatEncounter(turn_order=[{"type": "player"}], is_active=True))
+            pa.gold = 123
+            version_b = b.world_version.current
+            a.session.commit()
+            assert b.session.query(CombatEncounter).filter_by(is_active=True).first() is None
+            assert b.world_version.current == version_b # b's clients are not woken by a's commits
+
+            games.get("test_c") # Over capacity: the least recently used game (a) is unloaded
+            assert games.loaded() == ["test_b", "test_c"]
+            assert not any(game_id == "test_a" for game_id, z in layer_store._layers)
+            a = games.get("test_a")
+            assert a.session.query(Player).first().gold == 123
+            assert a.session.query(CombatEncounter).filter_by(is_active=True).count() == 1
+        finally:
+            for game_id in games.loaded():
+                games.unload(game_id)
+            database.save_engines = None
+    print("Game Hosting OK.")
+
+def test_save_files():
+    print("Testing Per-Save Files...")
+    import os, sqlite3, tempfile, threading, time
+    from dungeon import database
+    from dungeon.database import Player
+    from dungeon.games import GameRegistry
+    with tempfile.TemporaryDirectory() as tmp:
+        database.save_engines = database.SaveEngines(tmp, capacity=1)
+        games = GameRegistry()
+        try:
+            open_saves = lambda: [game_id for game_id, _ in database.save_engines.open_saves()]
+            a, b = games.get("save_a"), games.get("save_b")
+            assert open_saves() == ["save_a", "save_b"] # Over capacity, but a's session still uses its file
+            a.player.gold = 77
+            a.session.commit()
+            a.session.remove() # Last lease on save_a.db: closed now
+            assert open_saves() == ["save_b"]
+            database.save_engines.close("save_b") # Leased by b's session: disposed once it is removed
+            assert open_saves() == [] and b.session.query(Player).count() == 1
+            b.session.remove()
+
+            leased = [] # Concurrent first opens share one engine; the save is created once, outside the global lock
+            workers = [threading.Thread(target=lambda: leased.append(database.save_engines.acquire("save_c"))) for _ in range(4)]
+            for worker in workers: worker.start()
+            for worker in workers: worker.join()
+            assert len(leased) == 4 and len(set(leased)) == 1
+            for save_engine in leased:
+                database.save_engines.release(save_engine)
+            database.save_engines.close("save_c")
+            with sqlite3.connect(os.path.join(tmp, "save_c.db")) as conn:
+                assert conn.execute("SELECT COUNT(*) FROM players").fetchone() == (0,)
+            os.remove(os.path.join(tmp, "save_c.db"))
+
+            # Unloading a game whose session is still open on another thread (e.g. a stream)
+            held, resume, seen = threading.Event(), threading.Event(), []
+            def other_thread():
+                seen.append(a.session.query(Player).count())
+                held.set()
+                resume.wait()
+                seen.append(a.session.query(Player).count()) # Its save file was not closed under it
+                a.session.remove()
+            worker = threading.Thread(target=other_thread)
+            worker.start()
+            held.wait()
+            version = a.world_version
+            games.unload("save_a")
+            started = time.monotonic()
+            version.wait_for_change(version.current, 5)
+            assert version.closed and time.monotonic() - started < 1 # Its streams wake up and end
+            assert "save_a" not in open_saves() and database.save_engines._closing
+            resume.set()
+            worker.join()
+            assert seen == [1, 1] and not database.save_engines._closing # Disposed with its last session
+            assert sorted(f for f in os.listdir(tmp) if f.endswith(".db")) == ["save_a.db", "save_b.db"]
+            with sqlite3.connect(os.path.join(tmp, "save_a.db")) as conn:
+                assert conn.execute("SELECT game_id, gold FROM players").fetchall() == [("save_a", 77)]
+            with sqlite3.connect(os.path.join(tmp, "save_b.db")) as conn:
+                assert conn.execute("SELECT COUNT(*) FROM npcs WHERE game_id != 'save_b'").fetchone() == (0,)
+        finally:
+            for game_id in games.loaded():
+                games.unload(game_id)
+            database.save_engines = None
+    print("Per-Save Files OK.")
+
+def test_typed_player_fields():
+    print("Testing Typed Player Fields...")
+    from sqlalchemy import event
+    from dungeon.database import engine
+    from dungeon.quests import QuestManager
+    from dungeon.rules import award_skill_xp, get_skill_level
+    dm = DungeonMaster()
+    player = dm.player
+    assert player.stats["str"] == player.strength
+    player.skill_rows.pop("mining", None) # Start from a fresh skill on reused databases
+    player.quest_rows.pop("iron_supply", None)
+    dm.session.commit()
+    award_skill_xp(player, "mining", 10)
+    qm = QuestManager(dm.session, player)
+    qm.accept_quest("iron_supply")
+    dm.session.commit()
+
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        assert award_skill_xp(player, "mining", 45) == (True, 2)
+        player.strength += 1
+        dm.session.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    writes = [s for s in statements if s.startswith(("UPDATE", "INSERT"))]
+    assert any(s.startswith("UPDATE player_skills SET level=?, xp=?") for s in writes), writes
+    assert any(s.startswith("UPDATE players SET strength=?") for s in writes), writes
+
+    dm.session.expire_all()
+    assert get_skill_level(dm.player, "mining") == 2
+    assert dm.player.quest_state["active"] == {"iron_supply": {"progress": {}}}
+    assert dm.get_state_dict()["player"]["skills"]["mining"] == {"level": 2, "xp": 5}
+    print("Typed Player Fields OK.")
+
+def test_request_context():
+    print("Testing Request Context...")
+    import threading
+    from sqlalchemy import event
+    from dungeon.database import engine, Monster
+    dm = DungeonMaster()
+    dm.session.remove() # A new request
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        player = dm.player
+        assert not dm.combat.is_active()
+        dm.move_player(1, 0)
+        dm.move_player(-1, 0)
+        assert dm.player is player and not dm.combat.is_active()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    for table in ("players", "combat_encounters"):
+        loads = [s for s in statements if s.startswith("SELECT") and f"FROM {table}" in s]
+        assert len(loads) == 1, loads # Loaded once, not once per subsystem or per commit
+
+    goblin = Monster(name="Context Goblin", monster_type="goblin", hp_current=5, hp_max=5,
+                     x=player.x + 1, y=player.y, z=player.z)
+    dm.session.add(goblin)
+    dm.session.commit()
+    assert not dm.combat.is_active() # "No encounter" is cached now
+    def other_request():
+        dm.combat.start_combat(dm.session.get(Monster, goblin.id))
+        dm.session.remove()
+    worker = threading.Thread(target=other_request)
+    worker.start()
+    worker.join()
+    assert dm.combat.is_active() # A fight started by another session shows up without a new request
+    dm.combat.end_combat()
+    assert not dm.combat.is_active()
+    dm.session.delete(goblin)
+    dm.session.commit()
+    print("Request Context OK.")
+
+def test_tile_grid():
+    print("Testing Tile Grid...")
+    from dungeon.layers import layer_store
+    from dungeon.tiles import tile_flags, WALKABLE, OPAQUE, GATHERABLE
+    assert tile_flags("floor_volcanic") & WALKABLE and tile_flags("door") & OPAQUE
+    assert tile_flags("herb") & GATHERABLE and not tile_flags("water") & WALKABLE
+    dm = DungeonMaster()
+    px, py, z = dm.get_player_position()
+    grid = layer_store.grid(dm.session, z)
+    assert layer_store.grid(dm.session, z) is grid # Built once
+    x0, y0, x1, y1 = layer_store.bounds(dm.session, z)
+    for (x, y), (tile_type, _) in layer_store.area(dm.session, x0, y0, x1, y1, z).items():
+        assert grid.at(x, y) == tile_flags(tile_type)
+    assert not grid.walkable(x1 + 1, y1) and grid.opaque(x1 + 1, y1) # Nothing there: solid rock
+
+    assert grid.walkable(px, py)
+    layer_store.set_type(dm.session, px, py, z, "wall")
+    assert not layer_store.grid(dm.session, z).walkable(px, py) # Rebuilt after the change
+    dm.session.rollback()
+    assert layer_store.grid(dm.session, z).walkable(px, py)
+    print("Tile Grid OK.")
+
+def test_field_of_view():
+    print("Testing Field of View...")
+    from dungeon.fov import field_of_view
+    from dungeon.tiles import TileGrid, WALKABLE, OPAQUE
+    flags = bytearray([WALKABLE] * 21 * 21) # Open room from (-10, -10), pillar at (2, 0)
+    flags[10 * 21 + 12] = OPAQUE
+    grid = TileGrid(0, -10, -10, 21, 21, flags)
+    lit = field_of_view(grid, 0, 0, 5)
+    assert (0, 0) in lit and (2, 0) in lit and (1, 1) in lit
+    assert (3, 0) not in lit and (4, 0) not in lit # In the pillar's shadow
+    assert (0, 6) not in lit and (3, 4) in lit    # Radius
+    assert field_of_view(grid, 0, 0, 5) is lit     # Memoized
+
+    dm = DungeonMaster()
+    x, y, z = dm.get_player_position()
+    revealed, lit = dm.movement.update_visited(x, y, z)
+    assert (x, y) in lit and set(revealed) <= lit
+    assert dm.movement.update_visited(x, y, z) == ([], lit) # Nothing new to reveal
+    state = dm.get_state_dict(view={"radius": 8}, encoding="rle")
+    assert state["world"]["lit"]["x"] == x - 5
+    print("Field of View OK.")
+
+def test_occupancy():
+    print("Testing Occupancy Index...")
+    from dungeon.database import SessionFactory, Monster
+    from dungeon.occupancy import occupancy
+    dm = DungeonMaster()
+    px, py, z = dm.get_player_position()
+    assert occupancy.first(dm.session, "player", px, py, z) == dm.player.id
+    for m in dm.session.query(Monster).filter_by(z=z, is_alive=True).all():
+        assert ("monster", m.id) in occupancy.at(dm.session, m.x, m.y, z)
+
+    rat = Monster(name="Test Rat", monster_type="rat", hp_current=1, hp_max=1, x=px + 40, y=py + 40, z=z)
+    dm.session.add(rat)
+    dm.session.commit()
+    assert occupancy.first(dm.session, "monster", px + 40, py + 40, z) == rat.id
+    assert rat.id in occupancy.near(dm.session, px + 42, py + 41, z, 2, "monster")
+    other = SessionFactory() # Another request of the game
+    try:
+        rat.x += 1
+        dm.session.flush() # Movers flush: their own session's index follows
+        assert not occupancy.occupied(dm.session, px + 40, py + 40, z)
+        assert occupancy.first(dm.session, "monster", px + 41, py + 40, z) == rat.id
+        assert rat.id in occupancy.near(dm.session, px + 43, py + 40, z, 2, "monster")
+        assert occupancy.first(other, "monster", px + 40, py + 40, z) == rat.id # Uncommitted: not for others
+        assert not occupancy.occupied(other, px + 41, py + 40, z)
+        dm.session.rollback() # Uncommitted move: dropped
+        assert occupancy.first(dm.session, "monster", px + 40, py + 40, z) == rat.id
+        rat.x += 1
+        dm.session.commit()
+        assert occupancy.first(other, "monster", px + 41, py + 40, z) == rat.id # Committed: everyone
+        rat.x -= 1
+        dm.session.commit()
+    finally:
+        other.close()
+    rat.is_alive = False
+    dm.session.commit()
+    assert not occupancy.occupied(dm.session, px + 40, py + 40, z)
+    dm.session.delete(rat)
+    dm.session.commit()
+    print("Occupancy Index OK.")
+
+def test_travel():
+    print("Testing Click-to-Move...")
+    from dungeon.pathing import find_path
+    from dungeon.layers import layer_store
+    from dungeon.tiles import TileGrid, WALKABLE, OPAQUE, HAZARD, INTERACTABLE
+    flags = bytearray([WALKABLE] * 5 * 5) # 5x5 room, wall across x=2 except at y=4, lava at (1, 1)
+    for y in range(4):
+        flags[y * 5 + 2] = OPAQUE
+    flags[1 * 5 + 1] = WALKABLE | HAZARD
+    grid = TileGrid(0, 0, 0, 5, 5, flags)
+    route = find_path(grid, (0, 0), (4, 0))
+    assert route[-1] == (4, 0) and (2, 4) in route and len(route) == 12 # Through the gap
+    assert (1, 1) not in find_path(grid, (0, 2), (1, 0)) # Around the lava
+    assert find_path(grid, (0, 0), (4, 0), blocked=lambda x, y: (x, y) == (2, 4)) is None
+    assert find_path(grid, (0, 0), (0, 0)) == []
+
+    dm = DungeonMaster()
+    px, py, z = dm.get_player_position()
+    _, lit = dm.movement.update_visited(px, py, z)
+    world = layer_store.grid(dm.session, z)
+    targets = sorted(lit, key=lambda c: -abs(c[0] - px) - abs(c[1] - py))
+    for tx, ty in targets:
+        route = find_path(world, (px, py), (tx, ty))
+        if route and len(route) > 1 and world.walkable(tx, ty) and not any(world.at(*c) & INTERACTABLE for c in route):
+            break
+    pos, narrative, walked = dm.travel_to(tx, ty)
+    assert walked and walked == [[x, y, z] for x, y in route[:len(walked)]]
+    assert pos == walked[-1] == dm.get_player_position()
+    dm.session.expire_all()
+    assert dm.get_player_position() == pos # Committed
+    assert "walking" not in dm.session.info # Other requests of this session commit again
+    print("Click-to-Move OK.")
+
+def test_distance_map():
+    print("Testing Distance Maps...")
+    from dungeon.distance import distance_map
+    from dungeon.database import Monster
+    from dungeon.layers import layer_store
+    from dungeon.tiles import TileGrid, WALKABLE, OPAQUE
+    flags = bytearray([WALKABLE] * 7 * 7) # 7x7 room, wall across y=3 except at x=6
+    for x in range(6):
+        flags[3 * 7 + x] = OPAQUE
+    grid = TileGrid(0, 0, 0, 7, 7, flags)
+    dmap = distance_map(grid, 0, 6)
+    assert dmap.at(0, 6) == 0 and dmap.at(0, 0) == 12 and dmap.at(3, 3) is None
+    assert distance_map(grid, 0, 6) is dmap # Memoized
+    assert dmap.step(0, 0) == (1, 1) and dmap.step(5, 2) == (6, 3) # Around the wall, not into it
+    assert dmap.step(5, 2, blocked=lambda x, y: (x, y) == (6, 3)) is None
+
+    dm = DungeonMaster()
+    px, py, z = dm.get_player_position()
+    _, lit = dm.movement.update_visited(px, py, z)
+    chase = distance_map(layer_store.grid(dm.session, z), px, py)
+    sx, sy = max((c for c in lit if chase.at(*c) in (3, 4)), key=lambda c: chase.at(*c))
+    wolf = Monster(name="Test Wolf", monster_type="wolf", hp_current=1, hp_max=1, x=sx, y=sy, z=z)
+    dm.session.add(wolf)
+    dm.session.flush()
+    assert dm.combat._move_actor_towards(wolf, px, py)
+    assert max(abs(wolf.x - px), abs(wolf.y - py)) == 1
+    dm.session.rollback()
+    print("Distance Maps OK.")
+
+def test_triggers():
+    print("Testing Triggers...")
+    from types import SimpleNamespace
+    from dungeon.layers import layer_store
+    from dungeon.triggers import triggers
+    assert [t["id"] for t in triggers.at(2, -14, 16, "door")] == ["fire_dungeon_entrance"]
+    assert [t["id"] for t in triggers.at(2, -12, 12)] == ["fire_dungeon_heat"]
+    assert triggers.at(2, -11, 12) == () and triggers.at(1, 5, -40, "void")
+    assert [t["id"] for t in triggers.at(1, 500, -300)] == ["town_north_gate_void", "town_north_edge"] # Open edges: no bound
+    assert triggers.at(1, 500, -18) == ()
+    assert triggers.greeting(SimpleNamespace(name="Gareth the Smith", quest_state=None)).startswith("Gareth hails")
+    assert triggers.greeting(SimpleNamespace(name="Elara", quest_state={"status": "trapped"})) is None
+
+    dm = DungeonMaster()
+    dm.movement.teleport_player(0, 3, 1)
+    layer_store.set_type(dm.session, 0, 4, 1, "door")
+    pos, narrative = dm.move_player(0, 1)
+    assert pos == [0, 4, 1] and narrative.startswith("You enter the Town Hall.")
+    dm.movement.teleport_player(-1, 3, 1)
+    layer_store.set_type(dm.session, 0, 4, 1, "door")
+    pos, narrative = dm.move_player(1, 1) # Diagonal steps through the door count as entering too
+    assert pos == [0, 4, 1] and narrative.startswith("You enter the Town Hall.")
+    dm.movement.teleport_player(0, -18, 1)
+    pos, narrative = dm.move_player(0, -1)
+    assert pos == [0, 28, 2] and dm.get_player_position() == pos
+    assert narrative == "You head north into the deep forest."
+    dm.movement.teleport_player(0, 0, 1)
+    print("Triggers OK.")
+
+def test_regions():
+    print("Testing Region Layers...")
+    from sqlalchemy import text
+    from dungeon.layers import layer_store
+    from dungeon.generator import LevelBuilder
+    dm = DungeonMaster()
+    assert dm._generate_description(0, 11, 0) == "Grand Hall"
+    assert dm._generate_description(0, 5, 0) == "Dark Corridor"
+    assert dm._generate_description(-5, 11, 0) == "Dungeon Tunnels" # Unnamed hallway
+    assert dm._generate_description(10, 8, 1) == "The Smithy"
+    assert dm._generate_description(0, 0, 1) == "Town Square"
+    assert dm._generate_description(0, -21, 1) == "Wilderness"
+
+    builder = LevelBuilder(dm.session)
+    builder._add_region(9, "Cave")
+    builder._add_caves(9, [(5, 5), (0, 0), (0, 1), (8, 0)])
+    assert builder._regions[9] == ["Cave", [("Cave - Side Cave 1", [(5, 5)]), ("Cave - Side Cave 2", [(8, 0)])]]
+
+    dm.session.commit()
+    layer_store.evict_level(0)
+    assert dm._generate_description(0, 30, 0) == "High Security Jail" # Saved with the level
+    dm.session.execute(text("UPDATE map_layers SET regions = NULL, region_names = NULL WHERE z = 1"))
+    dm.session.commit()
+    layer_store.evict_level(1)
+    assert not layer_store.has_regions(dm.session, 1) # An older save
+    assert dm._generate_description(10, 8, 1) == "The Smithy" # Rebuilt on first use
+    dm.session.commit()
+    print("Region Layers OK.")
+
 if __name__ == "__main__":
     test_dice()
     test_dm_state()
+    test_state_delta()
+    test_state_viewport()
+    test_state_push()
+    test_map_encoding()
+    test_etags()
+    test_layer_store()
+    test_fog_bitset()
+    test_level_generation()
+    test_map_tiles_migration()
+    test_schema_migrations()
+    test_quest_indicators()
+    test_request_metrics()
+    test_corpse_reaper()
+    test_game_hosting()
+    test_save_files()
+    test_typed_player_fields()
+    test_request_context()
+    test_tile_grid()
+    test_field_of_view()
+    test_occupancy()
+    test_travel()
+    test_distance_map()
+    test_triggers()
+    test_regions()
@@ -0,0 +1,107 @@
+"""
+Benchmark: poll + move throughput per SQLite profile (see SQLITE_PROFILES in database.py).
+
+Each profile runs in its own process against a fresh temporary database: one thread keeps
+moving the player back and forth (write transactions) while several threads poll the
+viewport state like browser tabs do (read transactions).
+
+    python tools/bench_db_profile.py [--seconds 10] [--readers 4] [--profiles legacy,wal]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(seconds, readers):
+    sys.path.insert(0, ROOT)
+    from dungeon.dm import DungeonMaster
+
+    dm = DungeonMaster()
+
+    # Find a direction we can walk back and forth in
+    start = dm.get_player_position()
+    step = (1, 0)
+    for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        pos, _ = dm.move_player(dx, dy)
+        if pos != start:
+            dm.move_player(-dx, -dy)
+            step = (dx, dy)
+            break
+
+    stop = time.time() + seconds
+    counts = {"moves": 0, "polls": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def mover():
+        sign = 1
+        while time.time() < stop:
+            try:
+                dm.move_player(step[0] * sign, step[1] * sign)
+                sign = -sign
+                with lock: counts["moves"] += 1
+            except Exception:
+                with lock: counts["errors"] += 1
+            finally:
+                dm.session.remove()
+
+    def poller():
+        while time.time() < stop:
+            state = dm.get_state_dict(view={"radius": 16})
+            dm.session.remove()
+            with lock:
+                if "error" in state: counts["errors"] += 1
+                else: counts["polls"] += 1
+
+    threads = [threading.Thread(target=mover)] + [threading.Thread(target=poller) for _ in range(readers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    counts["moves_per_s"] = round(counts["moves"] / seconds, 1)
+    counts["polls_per_s"] = round(counts["polls"] / seconds, 1)
+    print("RESULT " + json.dumps(counts))
+
+
+def run_profile(profile, seconds, readers):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DUNGEON_DB_PROFILE"] = profile
+        env["DUNGEON_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--seconds", str(seconds), "--readers", str(readers)],
+            cwd=tmp, env=env, capture_output=True, text=True
+        )
+        for line in out.stdout.splitlines():
+            if line.startswith("RESULT "):
+                return json.loads(line[len("RESULT "):])
+        print(out.stdout[-2000:], out.stderr[-2000:])
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--profiles", default="legacy,wal")
+    parser.add_argument("--worker", action="store_true")
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.seconds, args.readers)
+        return
+
+    print(f"{'profile':<10}{'moves/s':>10}{'polls/s':>10}{'errors':>8}")
+    for profile in args.profiles.split(","):
+        r = run_profile(profile, args.seconds, args.readers)
+        if r:
+            print(f"{profile:<10}{r['moves_per_s']:>10}{r['polls_per_s']:>10}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
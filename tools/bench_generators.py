@@ -0,0 +1,81 @@
+"""
+Benchmark: wall time of every LevelBuilder generator (build + commit of the packed layer
+row), plus the size of the stored layer.
+
+Runs against a fresh temporary database (via DUNGEON_DB_URL); the schema is recreated
+before each run so every generator starts from an empty world.
+
+    python tools/bench_generators.py [--runs 3] [--profile wal]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENERATORS = [
+    ("tutorial", lambda b, p: b.generate_tutorial_dungeon(p)),
+    ("town", lambda b, p: b.generate_town(1)),
+    ("forest", lambda b, p: b.generate_forest(2)),
+    ("fire", lambda b, p: b.generate_fire_dungeon(3)),
+    ("ice", lambda b, p: b.generate_ice_dungeon(4)),
+]
+
+
+def run(runs):
+    sys.path.insert(0, ROOT)
+    from dungeon.database import Base, engine, SessionFactory, Player, MapLayer
+    from dungeon.generator import LevelBuilder
+    from dungeon.layers import layer_store
+    from dungeon.gamedata import PLAYER_START_CONFIG
+
+    def timed(gen, seed):
+        layer_store.clear()
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        session = SessionFactory()
+        try:
+            cfg = PLAYER_START_CONFIG
+            player = Player(name=cfg["name"], hp_current=cfg["hp_current"], hp_max=cfg["hp_max"],
+                            stats=cfg["stats"], x=0, y=0, z=0)
+            session.add(player)
+            session.commit()
+
+            random.seed(seed)
+            started = time.perf_counter()
+            gen(LevelBuilder(session), player)
+            session.commit()
+            elapsed = time.perf_counter() - started
+
+            layer = session.query(MapLayer).one()
+            tiles = len(layer_store.area(session, *layer_store.bounds(session, layer.z), layer.z))
+            return elapsed, tiles, len(layer.tiles) + len(layer.visited)
+        finally:
+            session.close()
+
+    print(f"{'generator':<10}{'tiles':>8}{'ms':>10}{'bytes':>10}")
+    for name, gen in GENERATORS:
+        results = [timed(gen, seed) for seed in range(runs)]
+        elapsed, tiles, size = min(results)
+        print(f"{name:<10}{tiles:>8}{elapsed * 1000:>10.1f}{size:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--profile", default=None, help="SQLite profile (see SQLITE_PROFILES)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DUNGEON_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        if args.profile:
+            os.environ["DUNGEON_DB_PROFILE"] = args.profile
+        os.chdir(tmp) # Generators must not touch the real save files
+        run(args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: SQL statements (and wall time) per request, by endpoint.
+
+Drives the Flask app with its test client against a fresh temporary database and reads the
+per-endpoint averages the request metrics keep (the `statements` count of every request).
+Exploration requests walk the player back and forth; combat requests park a (harmless)
+goblin next to the player and keep ending the turn, so every request also runs a monster turn.
+
+    python tools/bench_request_statements.py [--requests 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(requests):
+    sys.path.insert(0, ROOT)
+    import app as server
+    from dungeon.database import Monster
+    from dungeon.metrics import metrics
+
+    server.maintenance.stop()
+    client = server.app.test_client()
+    dm = server.games.get("default")
+
+    step = {"dx": 1, "dy": 0}
+    start = dm.get_player_position()
+    for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        pos, _ = dm.move_player(dx, dy)
+        if pos != start:
+            dm.move_player(-dx, -dy)
+            step = {"dx": dx, "dy": dy}
+            break
+    dm.session.remove()
+
+    def explore():
+        for i in range(requests):
+            sign = 1 if i % 2 == 0 else -1
+            client.post("/api/move", json={"dx": step["dx"] * sign, "dy": step["dy"] * sign})
+            client.get("/api/state?radius=16")
+
+    def fight():
+        player = dm.player
+        player.hp_current = player.hp_max = 10 ** 6
+        goblin = Monster(name="Bench Goblin", monster_type="goblin", hp_current=10 ** 6, hp_max=10 ** 6,
+                         x=player.x + step["dx"], y=player.y + step["dy"], z=player.z)
+        goblin.stats = {"str": 1, "dex": 1}
+        dm.session.add(goblin)
+        dm.session.commit()
+        dm.combat.start_combat(goblin)
+        dm.session.remove()
+        for _ in range(requests):
+            client.post("/api/combat/action", json={"action": "end_turn"})
+
+    print(f"{'endpoint':<16}{'requests':>9}{'statements':>12}{'avg ms':>9}")
+    for name, scenario in [("explore", explore), ("combat", fight)]:
+        metrics.reset()
+        started = time.perf_counter()
+        scenario()
+        elapsed = time.perf_counter() - started
+        for endpoint, agg in sorted(metrics.snapshot()["endpoints"].items()):
+            print(f"{endpoint:<16}{agg['count']:>9}{agg['avg_statements']:>12}{agg['avg_ms']:>9}")
+        print(f"  ({name}: {elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DUNGEON_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.pop("DUNGEON_SAVE_DIR", None)
+        os.chdir(tmp) # The app must not touch the real save files
+        run(args.requests)
+
+
+if __name__ == "__main__":
+    main()
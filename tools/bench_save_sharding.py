@@ -0,0 +1,102 @@
+"""
+Benchmark: write throughput with many active games, shared database vs one file per save.
+
+Each mode runs in its own process against a fresh temporary directory: every game gets a
+thread that keeps moving its player back and forth (one write transaction per step).
+In shared mode all games commit to one dungeon.db; in per-save mode (DUNGEON_SAVE_DIR)
+each game commits to its own file.
+
+    python tools/bench_save_sharding.py [--seconds 10] [--games 8] [--modes shared,per_save]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(seconds, games):
+    sys.path.insert(0, ROOT)
+    from dungeon.games import GameRegistry
+
+    registry = GameRegistry(capacity=games)
+    dms = [registry.get(f"bench_{i}") for i in range(games)]
+
+    def find_step(dm):
+        start = dm.get_player_position()
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            pos, _ = dm.move_player(dx, dy)
+            if pos != start:
+                dm.move_player(-dx, -dy)
+                return dx, dy
+        return 1, 0
+
+    steps = [find_step(dm) for dm in dms]
+    stop = time.time() + seconds
+    counts = {"moves": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def mover(dm, step):
+        sign = 1
+        while time.time() < stop:
+            try:
+                dm.move_player(step[0] * sign, step[1] * sign)
+                sign = -sign
+                with lock: counts["moves"] += 1
+            except Exception:
+                with lock: counts["errors"] += 1
+            finally:
+                dm.session.remove()
+
+    threads = [threading.Thread(target=mover, args=(dm, step)) for dm, step in zip(dms, steps)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    counts["moves_per_s"] = round(counts["moves"] / seconds, 1)
+    print("RESULT " + json.dumps(counts))
+
+
+def run_mode(mode, seconds, games):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DUNGEON_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        env.pop("DUNGEON_SAVE_DIR", None)
+        if mode == "per_save":
+            env["DUNGEON_SAVE_DIR"] = os.path.join(tmp, "saves")
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--seconds", str(seconds), "--games", str(games)],
+            cwd=tmp, env=env, capture_output=True, text=True
+        )
+        for line in out.stdout.splitlines():
+            if line.startswith("RESULT "):
+                return json.loads(line[len("RESULT "):])
+        print(out.stdout[-2000:], out.stderr[-2000:])
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--games", type=int, default=8)
+    parser.add_argument("--modes", default="shared,per_save")
+    parser.add_argument("--worker", action="store_true")
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.seconds, args.games)
+        return
+
+    print(f"{'mode':<10}{'games':>7}{'moves/s':>10}{'errors':>8}")
+    for mode in args.modes.split(","):
+        r = run_mode(mode, args.seconds, args.games)
+        if r:
+            print(f"{mode:<10}{args.games:>7}{r['moves_per_s']:>10}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
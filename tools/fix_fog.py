@@ -1,19 +1,13 @@
-from dungeon.database import get_session, MapTile
+from dungeon.database import get_session
+from dungeon.layers import layer_store
 
 def fix_fog():
     session = get_session()
     print("Revealing Ice Dungeon Entrance area...")
     
     # Reveal radius 5 around 0,0 for Z=4
-    tiles = session.query(MapTile).filter_by(z=4).filter(
-        MapTile.x >= -5, MapTile.x <= 5,
-        MapTile.y >= -5, MapTile.y <= 5
-    ).all()
-    
-    count = 0
-    for t in tiles:
-        t.is_visited = True
-        count += 1
+    cells = [(x, y) for x in range(-5, 6) for y in range(-5, 6)]
+    count = len(layer_store.reveal(session, 4, cells))
         
     session.commit()
     print(f"Revealed {count} tiles.")
@@ -15,13 +15,7 @@ if player.level == 1 and (player.xp or 0) >= 150:
     player.hp_max += 5
     player.hp_current = player.hp_max
     
-    stats = dict(player.stats or {})
-    if 'unspent_points' not in stats: stats['unspent_points'] = 0
-    stats['unspent_points'] += 1
-    player.stats = stats
-    
-    from sqlalchemy.orm.attributes import flag_modified
-    flag_modified(player, "stats")
+    player.unspent_points = (player.unspent_points or 0) + 1
     
     session.commit()
     print(f"Fixed! New: Lvl {player.level}, XP {player.xp}")